@@ -0,0 +1,120 @@
+# Quick Stage batch driver.
+# Stages every .blend file in a folder by running one background Blender per file,
+# several at the same time, so the whole machine is used instead of a single session.
+#
+# Runs with plain Python (no Blender needed to launch it):
+#   python quickstage_batch.py assets/ --jobs 8 -- --ratio HDScr --reso res2160 --light kfh --camrig complex
+# Everything after '--' is handed to quickstage_final.py's command line (see run_cli there).
+# A JSON summary of every file is printed at the end, or written to --report.
+
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ADDON = os.path.join(HERE, "quickstage_final.py")
+
+# Must match CLI_TAG in quickstage_final.py.
+CLI_TAG = "QUICKSTAGE_RESULT "
+
+
+# Every .blend in the given paths. Folders are searched (recursively with --recursive),
+# Blender's own backup files (.blend1, .blend2 ...) are skipped since they don't end in .blend.
+def find_blends(paths, recursive=False):
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        if recursive:
+            for root, dirs, files in os.walk(path):
+                found.extend(os.path.join(root, f) for f in files if f.endswith(".blend"))
+        else:
+            found.extend(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".blend"))
+    return sorted(found)
+
+
+# The Blender command for one file. Each worker gets its share of the CPU threads,
+# so eight Blenders don't each try to use every core.
+def blender_command(blender, blend, stage_args, threads):
+    cmd = [blender, "-b", blend, "--factory-startup"]
+    if threads:
+        cmd += ["-t", str(threads)]
+    return cmd + ["-P", ADDON, "--"] + stage_args
+
+
+# Runs one Blender and digs the JSON result line out of its output.
+def stage_file(blender, blend, stage_args, threads, timeout):
+    start = time.perf_counter()
+    result = {'file': blend, 'ok': False}
+    try:
+        proc = subprocess.run(blender_command(blender, blend, stage_args, threads),
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        result['error'] = "timed out after " + str(timeout) + "s"
+    except OSError as err:
+        result['error'] = "could not start Blender: " + str(err)
+    else:
+        for line in proc.stdout.splitlines():
+            if line.startswith(CLI_TAG):
+                result.update(json.loads(line[len(CLI_TAG):]))
+        if 'error' not in result and not result['ok']:
+            result['error'] = "no result from Blender (exit code " + str(proc.returncode) + ")"
+            result['log'] = proc.stdout[-2000:]
+    result['wall_seconds'] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    stage_args = []
+    if "--" in argv:
+        stage_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser(description="Stage many .blend files with Quick Stage in parallel.")
+    parser.add_argument("paths", nargs="+", help=".blend files or folders containing them")
+    parser.add_argument("--recursive", action="store_true", help="Also look inside sub folders")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"), help="Blender executable (default: $BLENDER or 'blender')")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="How many Blenders run at the same time")
+    parser.add_argument("--threads", type=int, default=0, help="Threads per Blender (default: cores / jobs)")
+    parser.add_argument("--timeout", type=float, default=None, help="Give up on a file after this many seconds")
+    parser.add_argument("--report", help="Write the JSON summary to this file")
+    args = parser.parse_args(argv)
+
+    blends = find_blends(args.paths, args.recursive)
+    jobs = max(1, min(args.jobs, len(blends) or 1))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // jobs)
+
+    # The work happens in the Blender processes, the threads here only wait on them.
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(stage_file, args.blender, blend, stage_args, threads, args.timeout) for blend in blends]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(("ok    " if result['ok'] else "FAIL  ") + result['file'], file=sys.stderr, flush=True)
+
+    results.sort(key=lambda r: r['file'])
+    summary = {
+        'files': len(results),
+        'failed': sum(1 for r in results if not r['ok']),
+        'results': results,
+    }
+    text = json.dumps(summary, indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+# Quick Stage benchmark suite.
+# Measures what the rigs cost, so a change can be checked for making things faster or slower:
+# - spawn: wall time and depsgraph updates for every light preset and both camera rigs,
+#   in scenes padded with filler objects (empty, 10k and 100k by default).
+# - eval: seconds per frame of playing back an animated complex camera rig (with camera light).
+# - render: a tiny fixed-sample Cycles render of the reference scene per light preset.
+#
+# Runs in background Blender, or with the bpy module from pip (python quickstage_bench.py ...):
+#   blender -b -P quickstage_bench.py -- --out results.json
+#   blender -b -P quickstage_bench.py -- --baseline baseline.json
+# With --baseline, the results are compared against an earlier --out file and the run fails
+# (exit code 1) with a table of everything that got slower than --tolerance allows.
+# Use --save-baseline to write the current results as the new baseline.
+#
+# Other modes:
+#   --compare-ops   the old bpy.ops chain against the bpy.data spawn engine, per light preset.
+#   --relight-cleanup  stages the relight matrix and cleans it up, and fails if anything is left behind.
+#   --tiers         renders the reference scene once per render quality tier. Add --write-tiers
+#                   to store the timings next to the addon, where the Render Settings panel shows them.
+
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import bpy
+
+# Make the addon file importable, it sits right next to this script.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import quickstage_final as qs
+
+
+# Our own arguments: everything after '--' inside Blender, or the normal arguments
+# when run as a plain Python script with the bpy module.
+def script_args():
+    argv = sys.argv
+    if "--" in argv:
+        return argv[argv.index("--") + 1:]
+    if argv and argv[0].endswith("quickstage_bench.py"):
+        return argv[1:]
+    return []
+
+
+# Counts depsgraph updates while a block of code runs.
+class DepsgraphCounter:
+    def __init__(self):
+        self.count = 0
+
+    def handler(self, scene, depsgraph=None):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        bpy.app.handlers.depsgraph_update_post.append(self.handler)
+        return self
+
+    def __exit__(self, *exc):
+        bpy.app.handlers.depsgraph_update_post.remove(self.handler)
+
+
+# Empties the file, then adds 'count' filler objects so the scene has some weight to it.
+# They all share one small mesh, and go in collections of 1000 so linking stays quick.
+def reset_scene(count):
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    scene = bpy.context.scene
+    if count:
+        mesh = bpy.data.meshes.new("Filler")
+        mesh.from_pydata([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [], [(0, 1, 2)])
+    for start in range(0, count, 1000):
+        coll = bpy.data.collections.new("Filler")
+        scene.collection.children.link(coll)
+        for i in range(start, min(start + 1000, count)):
+            ob = bpy.data.objects.new("Filler", mesh)
+            ob.location = (i % 100, (i // 100) % 100, i // 10000)
+            coll.objects.link(ob)
+    bpy.context.view_layer.update()
+    return scene
+
+
+# Removes objects made during a measurement (and their data), so the next one starts from the same scene.
+def remove_made(objects):
+    data = [ob.data for ob in objects if ob.data is not None]
+    bpy.data.batch_remove(objects)
+    bpy.data.batch_remove([d for d in data if d.users == 0])
+    bpy.context.view_layer.update()
+
+
+# The old way of doing it: one operator per object, then select and parent_set.
+# Driven by the same preset table so both paths build the same thing.
+def spawn_with_ops(key):
+    preset = qs.LitPresets[key]
+    tag = preset['tag']
+    made = []
+
+    litfoc = None
+    if 'focus' in preset:
+        bpy.ops.object.empty_add(type='SPHERE', radius=1.15, align='WORLD', location=preset['focus']['location'])
+        litfoc = bpy.context.active_object
+        litfoc.name = "Light Focus " + tag
+        made.append(litfoc)
+
+    for spec in preset['lights']:
+        bpy.ops.object.light_add(type=spec['type'], radius=spec.get('radius', 1), align='WORLD',
+                                 location=spec['location'], rotation=spec['rotation'])
+        light = bpy.context.active_object
+        light.name = spec['name'] + " " + tag
+        light.data.energy = spec['energy']
+        for attr, value in spec.get('data', {}).items():
+            setattr(light.data, attr, value)
+        if spec.get('track') and litfoc is not None:
+            light.constraints.new('TRACK_TO').target = litfoc
+        made.append(light)
+
+    bpy.ops.object.empty_add(type='CIRCLE', radius=5, align='WORLD', location=preset['base']['location'], rotation=(1.5708, 0, 0))
+    litbase = bpy.context.active_object
+    litbase.name = "Set Base " + tag
+
+    bpy.ops.object.select_all(action='DESELECT')
+    for ob in made:
+        ob.select_set(True)
+    litbase.select_set(True)
+    bpy.context.view_layer.objects.active = litbase
+    bpy.ops.object.parent_set(type='OBJECT', keep_transform=True)
+    return made + [litbase]
+
+
+def spawn_with_data(key):
+    litbase, made = qs.spawn_light_preset(key, bpy.context.scene.collection, bpy.context.view_layer)
+    return made
+
+
+# Everything the spawn benchmark builds: every light preset and both camera rigs (with camera light).
+def spawn_cases():
+    cases = {}
+    for key in qs.LitPresets:
+        cases["light/" + key] = lambda key=key: spawn_with_data(key)
+    for kind in ('SIMPLE', 'COMPLEX'):
+        cases["camrig/" + kind.lower()] = lambda kind=kind: list(
+            qs.build_cam_rig(kind, bpy.context.scene.collection, bpy.context.view_layer, True, bpy.context.scene).values())
+    return cases
+
+
+# Best time and depsgraph update count of a spawn function, over repeat runs.
+def measure_spawn(spawn, repeat):
+    best = None
+    updates = 0
+    for i in range(repeat):
+        with DepsgraphCounter() as counter:
+            start = time.perf_counter()
+            made = spawn()
+            took = time.perf_counter() - start
+        updates = counter.count
+        best = took if best is None else min(best, took)
+        remove_made(made)
+    return {'seconds': best, 'depsgraph_updates': updates}
+
+
+# Seconds per frame to evaluate an animated complex rig with camera light.
+# The rotation rig spins and the zoom rig slides, so every constraint in the chain has work to do.
+def measure_eval(frames):
+    scene = bpy.context.scene
+    rig = qs.build_cam_rig('COMPLEX', scene.collection, bpy.context.view_layer, True, scene)
+    scene.frame_start = 1
+    scene.frame_end = frames
+    for frame, spin, zoom in ((1, 0, -10), (frames, 6.283, -4)):
+        rig['rotation'].rotation_euler[2] = spin
+        rig['rotation'].keyframe_insert("rotation_euler", index=2, frame=frame)
+        rig['zoom'].location[1] = zoom
+        rig['zoom'].keyframe_insert("location", index=1, frame=frame)
+
+    scene.frame_set(1)
+    start = time.perf_counter()
+    for frame in range(1, frames + 1):
+        scene.frame_set(frame)
+    took = time.perf_counter() - start
+
+    remove_made(list(rig.values()))
+    return {'seconds_per_frame': took / frames}
+
+
+# The reference scene: a few shaded primitives on a floor, lit by a light preset and seen by
+# a simple camera rig at 1080p 16:9. Always built the same way, so timings from different
+# machines and versions can be compared.
+def build_reference_scene(preset='kfh'):
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    scene = bpy.context.scene
+    scene.render.engine = 'CYCLES'
+    qs.apply_render_size(scene.render, 'HDScr', 'res1080')
+
+    bpy.ops.mesh.primitive_plane_add(size=20)
+    bpy.ops.mesh.primitive_uv_sphere_add(radius=1, location=(-1.5, 0, 1), segments=64, ring_count=32)
+    bpy.ops.object.shade_smooth()
+    bpy.ops.mesh.primitive_cube_add(size=1.5, location=(1.5, 0.5, 0.75))
+    bpy.ops.object.modifier_add(type='SUBSURF')
+    bpy.ops.mesh.primitive_torus_add(location=(0, 1.5, 0.5))
+
+    qs.spawn_light_preset(preset, scene.collection)
+    rig = qs.build_cam_rig('SIMPLE', scene.collection, None, False, scene, focus_location=(0, 0, 1))
+    scene.camera = rig['camera']
+    bpy.context.view_layer.update()
+    return scene
+
+
+def render_seconds(scene):
+    start = time.perf_counter()
+    bpy.ops.render.render(write_still=False)
+    return time.perf_counter() - start
+
+
+# A small, fixed-sample render of the reference scene per light preset.
+def measure_renders(samples):
+    results = {}
+    for key in qs.LitPresets:
+        scene = build_reference_scene(key)
+        scene.render.resolution_percentage = 25
+        scene.cycles.samples = samples
+        scene.cycles.use_adaptive_sampling = False
+        scene.cycles.use_denoising = False
+        results["render/" + key] = {'seconds': render_seconds(scene)}
+    return results
+
+
+# Renders the reference scene once per quality tier. Returns seconds per frame by tier.
+def time_tiers():
+    timings = {}
+    for tier in qs.QualityTiers:
+        scene = build_reference_scene()
+        qs.apply_quality(scene, tier)
+        timings[tier] = render_seconds(scene)
+    return timings
+
+
+# What a spawn made of its lights, by light name: the light data values that decide how it looks.
+def light_settings(objects):
+    settings = {}
+    for ob in objects:
+        if ob.type == 'LIGHT':
+            ldata = ob.data
+            settings[ob.name.split(".")[0]] = {attr: round(getattr(ldata, attr), 5) for attr in
+                                               ('energy', 'shadow_soft_size', 'size', 'size_y', 'spot_size', 'spot_blend', 'angle')
+                                               if hasattr(ldata, attr)}
+    return settings
+
+
+# The lights where the two spawns differ, as {name: (ops values, data values)}.
+def light_differences(key):
+    made = spawn_with_ops(key)
+    ops = light_settings(made)
+    remove_made(made)
+    made = spawn_with_data(key)
+    data = light_settings(made)
+    remove_made(made)
+    return {name: (ops.get(name), data.get(name)) for name in set(ops) | set(data) if ops.get(name) != data.get(name)}
+
+
+# The old operator chain against the spawn engine, per light preset and scene size.
+# Both have to build the same lights, the light data is compared before timing them.
+def compare_ops(filler_sizes, repeat):
+    results = {}
+    for filler in filler_sizes:
+        reset_scene(filler)
+        for key in qs.LitPresets:
+            differences = light_differences(key)
+            ops = measure_spawn(lambda: spawn_with_ops(key), repeat)
+            data = measure_spawn(lambda: spawn_with_data(key), repeat)
+            results["compare/" + key + "/" + str(filler)] = {
+                'ops_seconds': ops['seconds'],
+                'data_seconds': data['seconds'],
+                'speedup': ops['seconds'] / data['seconds'] if data['seconds'] else None,
+                'same_lights': not differences,
+                'light_differences': differences,
+            }
+    return results
+
+
+# Stages the relight matrix (every preset, each light in its own light group) and cleans it up again,
+# without rendering. The scene has to come out the way it went in: no objects, lights, collections
+# or light groups left over.
+def check_relight_cleanup():
+    reset_scene(0)
+    scene = bpy.context.scene
+    view_layer = bpy.context.view_layer
+    scene.world = bpy.data.worlds.new("Relight Check")
+
+    def snapshot():
+        return {'objects': len(bpy.data.objects), 'lights': len(bpy.data.lights), 'collections': len(bpy.data.collections),
+                'lightgroups': sorted(lg.name for lg in view_layer.lightgroups), 'world_group': scene.world.lightgroup}
+
+    before = snapshot()
+    state = {'made': [], 'groups': [], 'nodes': []}
+    try:
+        qs.relight_stage(scene, view_layer, qs.relight_groups(), state)
+        staged = len(view_layer.lightgroups)
+    finally:
+        qs.relight_cleanup(scene, view_layer, state)
+    after = snapshot()
+    return {'lightgroups_staged': staged, 'before': before, 'after': after, 'clean': before == after}
+
+
+# Runs the whole suite. Results are one flat dict: "<what>/<case>/<scene size>" -> metrics.
+def run_suite(filler_sizes, repeat, frames, samples, skip_render):
+    results = {}
+    for filler in filler_sizes:
+        reset_scene(filler)
+        for name, spawn in spawn_cases().items():
+            results["spawn/" + name + "/" + str(filler)] = measure_spawn(spawn, repeat)
+        results["eval/camrig_complex/" + str(filler)] = measure_eval(frames)
+    if not skip_render:
+        results.update(measure_renders(samples))
+    return results
+
+
+# Compares results against a baseline. A metric regresses when it is more than tolerance
+# (a fraction, 0.25 = 25%) above the baseline. Times under min_seconds are too noisy to judge.
+# Depsgraph update counts are exact, any increase counts.
+# Returns a list of (key, metric, baseline, now) for everything that regressed.
+def compare(results, baseline, tolerance, min_seconds=0.001):
+    regressions = []
+    for key, metrics in sorted(results.items()):
+        old = baseline.get(key)
+        if old is None:
+            continue
+        for metric, now in metrics.items():
+            before = old.get(metric)
+            if not isinstance(now, (int, float)) or not isinstance(before, (int, float)):
+                continue
+            if metric == 'depsgraph_updates':
+                worse = now > before
+            else:
+                worse = max(now, before) >= min_seconds and now > before * (1 + tolerance)
+            if worse:
+                regressions.append((key, metric, before, now))
+    return regressions
+
+
+def format_regressions(regressions):
+    lines = ["%-40s %-20s %12s %12s %8s" % ("case", "metric", "baseline", "now", "change")]
+    for key, metric, before, now in regressions:
+        change = ("%+.0f%%" % ((now / before - 1) * 100)) if before else "new"
+        lines.append("%-40s %-20s %12.6g %12.6g %8s" % (key, metric, before, now, change))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="quickstage_bench.py", description="Quick Stage benchmark suite.")
+    parser.add_argument("--filler", type=int, nargs="+", default=[0, 10000, 100000], help="Scene sizes (filler objects)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per spawn measurement, the best one counts")
+    parser.add_argument("--frames", type=int, default=250, help="Frames of rig animation to evaluate")
+    parser.add_argument("--samples", type=int, default=16, help="Samples of the preset renders")
+    parser.add_argument("--no-render", action="store_true", help="Skip the preset renders")
+    parser.add_argument("--out", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this JSON file, fail on regressions")
+    parser.add_argument("--save-baseline", help="Write the results as a baseline to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before it counts as a regression")
+    parser.add_argument("--compare-ops", action="store_true", help="Compare the old bpy.ops spawn against the spawn engine")
+    parser.add_argument("--relight-cleanup", action="store_true", help="Check that the relight matrix cleans up after itself")
+    parser.add_argument("--tiers", action="store_true", help="Time the render quality tiers")
+    parser.add_argument("--write-tiers", action="store_true", help="Store the tier timings for the Render Settings panel")
+    args = parser.parse_args(script_args())
+
+    if args.tiers:
+        result = {'blender': bpy.app.version_string, 'tiers': time_tiers()}
+        if args.write_tiers:
+            with open(qs.TierTimingsFile, "w") as f:
+                json.dump(result, f, indent=2)
+        print(json.dumps(result, indent=2))
+        return 0
+
+    if args.relight_cleanup:
+        result = check_relight_cleanup()
+        print(json.dumps(result, indent=2))
+        return 0 if result['clean'] else 1
+
+    if args.compare_ops:
+        results = compare_ops(args.filler, args.repeat)
+        print(json.dumps(results, indent=2))
+        # Faster doesn't count if the lights came out different.
+        return 0 if all(r['same_lights'] for r in results.values()) else 1
+
+    results = run_suite(args.filler, args.repeat, args.frames, args.samples, args.no_render)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(text)
+    if not args.out:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Quick Stage benchmark: " + str(len(regressions)) + " regression(s)\n" + format_regressions(regressions), file=sys.stderr)
+            return 1
+        print("Quick Stage benchmark: no regressions against " + args.baseline, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ bl_info = {
     "description" : "Quickly set up a stage for your renders",
     "author" : "Samuel C.A (KomandoKartoffel)",
     "blender" : (2,92,0),
+    "version" : (1,1,0),
     "location" : "View3D > Panel",
     "wiki_url" : "",
     "category" : "Tools",
@@ -12,14 +13,175 @@ bl_info = {
 # Module imports
 
 
+import sys                  # For reading command line arguments when running in the background.
+import json                 # Results of background runs are printed as JSON, so other programs can read them.
+import time                 # Timing how long things take.
+import argparse             # Command line argument parsing.
+import os                   # File paths, for render outputs and the background workers.
+import subprocess           # Starting background Blenders.
+import tempfile             # Somewhere to put files the background Blenders need.
+import cProfile             # Optional profiling of the operators, see the diagnostics section.
+import hashlib              # Fingerprints of preset definitions, for the preset library.
+import uuid                 # Unique ids for spawned rigs.
+import zlib                 # Stable dropdown numbers for preset files.
+import shutil               # Moving multiview renders to where their jobs want them.
+from collections import deque   # A list with a maximum length, old entries fall off the front.
+try:
+    import resource         # Peak memory use of the process. Only exists on Linux and macOS.
+except ImportError:
+    resource = None
 import bpy                  # Blender's API - through here, python is able to interact with Blender and vice versa.
+import bpy.utils.previews   # Custom icons, for the light preset thumbnails.
 from math import radians    # 3D object rotation in blender - python uses radians instead of degrees.
+from mathutils import Euler, Matrix, Vector     # Blender's math module, used to build object matrices without asking the scene.
+import numpy as np          # Comes bundled with Blender. Used for doing math on lots of objects at once.
 
 
 # ======================================================
 # Below is a class that contains custom properties. Data types that are preconfigured to work with the Blender API.
 
 
+# Dropdown items shared by more than one property.
+# Each item in the list comes is this format: ('blender reference', 'dropdown menu display', 'item tooltip description')
+RatioItems = [('Sqr', "1:1", "Square"),
+            ('SDScr', "4:3", "SDTV"),
+            ('HDScr', "16:9", "HDTV"),
+            ('WideScr', "21:9", "Ultrawide")
+]
+
+ResoItems = [('res720', "720p", ""),
+            ('res1080', "1080p", ""),
+            ('res1440', "1440p", ""),
+            ('res2160', "2160p", ""),
+            ('res4320', "4320p", "")
+]
+
+
+QualityItems = [('DRAFT', "Draft", "Fast and noisy, for blocking out the look"),
+            ('PREVIEW', "Preview", "Good enough to judge lighting and materials"),
+            ('FINAL', "Final", "Full resolution and samples, for delivery")
+]
+
+LightItems = [('clmshll', "Clamshell", "Two middle lights, one above subject, one below subject."),
+            ('fltlt', "Flat Light", "Two lights at equal power, position at the side of the camera."),
+            ('kfh', "Key Fill & Highlight", "Two softlight, one on the left side, one on the right side with half strenght. A highlight lamp from above, aimed at the subject."),
+            ('hghky', "High Key", "A 45 degree light at full strength at the left, a soft light at the side of subject, and a background fill light."),
+            ('lprmlt', "Loop with Rim Light", "A 45 degree light at full strength at the left. A high powered lamp behind the subject."),
+            ('hkk', "Hard Key with Kickers", "Two soft lights behind the subject, a single hard light at an angle towards subject."),
+            ('bgr', "Badger", "Two soft lights behind the subject.")
+]
+
+
+# The light preset dropdown: the built-in presets first (numbered like they always were, so saved files
+# keep their choice), then the preset files. Rebuilt by scan_presets.
+PresetItems = [(key, name, desc, i) for i, (key, name, desc) in enumerate(LightItems)]
+
+# What the batch stager can make: any light preset, or a camera rig.
+BatchCamItems = [('CAM_SIMPLE', "Simple Cam Rig", "A camera tracking a focus empty", 100),
+                 ('CAM_COMPLEX', "Complex Cam Rig", "The full orbit / zoom camera rig", 101)]
+BatchItems = PresetItems + BatchCamItems
+
+# Sizes of the HDRI proxies (see the HDRI worlds section).
+HdriProxySizes = [('1024', "1K", "1024 pixels wide, for quick look-dev"),
+                  ('2048', "2K", "2048 pixels wide, sharper reflections in the viewport")]
+
+# Camera moves for the complex rig (see the camera moves section), and how they speed up.
+MotionItems = [('ORBIT', "Orbit", "Turntable around the focus point"),
+               ('CRANE', "Crane", "Camera rises (or drops) on an arc around the focus point"),
+               ('DOLLY', "Dolly", "Camera moves in (or out, when negative) by a distance"),
+               ('PUSH_IN', "Push In", "Camera moves a part of the way towards the focus point"),
+               ('HANDHELD', "Handheld", "Seeded wobble, on top of the other moves")]
+
+MotionEaseItems = [('LINEAR', "Linear", "Constant speed"),
+                   ('EASE_IN_OUT', "Ease In and Out", "Starts and ends slowly"),
+                   ('EASE_IN', "Ease In", "Starts slowly"),
+                   ('EASE_OUT', "Ease Out", "Ends slowly")]
+
+
+# One entry of the render queue: which camera, which frames, what size, and where the images go.
+class QSRenderJob(bpy.types.PropertyGroup):
+    bl_idname = "object.QSRenderJob"
+    bl_label = "Quick Stage render job"
+    
+    Enabled : bpy.props.BoolProperty(name = "Enabled", description = "Render this job when the queue runs", default = True)
+    Camera : bpy.props.PointerProperty(name = "Camera", description = "Camera to render from", type = bpy.types.Object,
+                                       poll = lambda self, ob: ob.type == 'CAMERA')
+    FrameStart : bpy.props.IntProperty(name = "Start", description = "First frame of the job", default = 1, min = 0)
+    FrameEnd : bpy.props.IntProperty(name = "End", description = "Last frame of the job", default = 250, min = 0)
+    ScrRat : bpy.props.EnumProperty(name = "Screen Ratio", description = "Ratio for this job", items = RatioItems, default = 'HDScr')
+    ScrReso : bpy.props.EnumProperty(name = "Render Resolution", description = "Resolution for this job", items = ResoItems, default = 'res1080')
+    Output : bpy.props.StringProperty(name = "Output", description = "Where the frames are saved, same rules as the render output path",
+                                      default = "//render/", subtype = 'FILE_PATH')
+
+
+# One light of the relight matrix. Weight scales the light's contribution in the preview,
+# the same as scaling its energy would, just without rendering again.
+class QSRelightLight(bpy.types.PropertyGroup):
+    bl_idname = "object.QSRelightLight"
+    bl_label = "Quick Stage relight light"
+    
+    Group : bpy.props.StringProperty(name = "Light Group")
+    Preset : bpy.props.StringProperty(name = "Preset")
+    Weight : bpy.props.FloatProperty(name = "Weight", description = "Energy multiplier of this light in the relight preview",
+                                     default = 1, min = 0, soft_max = 4, update = lambda self, context: relight_show(context.scene))
+
+
+# An object the render border is cropped to.
+class QSCropTarget(bpy.types.PropertyGroup):
+    bl_idname = "object.QSCropTarget"
+    bl_label = "Quick Stage crop target"
+    
+    Object : bpy.props.PointerProperty(name = "Object", type = bpy.types.Object)
+
+
+# Settings of a spawned rig, kept on its root (the Set Base of a light setup, the Focus Rig of a camera rig).
+# Changing one patches only what it is about (light energies, a few locations, the lens), instead of
+# deleting and spawning the rig again. Which ones apply depends on the rig, see RigParamsPnl.
+class QSRigParams(bpy.types.PropertyGroup):
+    bl_idname = "object.QSRigParams"
+    bl_label = "Quick Stage rig settings"
+    
+    # Light setups
+    Energy : bpy.props.FloatProperty(name = "Energy", description = "Multiplies the preset's light energies",
+                                     default = 1, min = 0, soft_max = 10, update = lambda self, context: rig_params_update(self, 'ENERGY'))
+    Distance : bpy.props.FloatProperty(name = "Distance", description = "Multiplies how far the lights are from the light focus, or from their middle if the preset has none",
+                                       default = 1, min = 0.01, soft_max = 5, update = lambda self, context: rig_params_update(self, 'DISTANCE'))
+    
+    # Camera rigs
+    Lens : bpy.props.FloatProperty(name = "Lens", description = "Focal length of the rig's camera", default = 50, min = 1,
+                                   unit = 'CAMERA', update = lambda self, context: rig_params_update(self, 'LENS'))
+    CamDistance : bpy.props.FloatProperty(name = "Distance", description = "How far the camera is from the focus", default = 10, min = 0.01,
+                                          unit = 'LENGTH', update = lambda self, context: rig_params_update(self, 'CAM_DISTANCE'))
+    CamLight : bpy.props.BoolProperty(name = "Camera Light", description = "Spot light following the camera",
+                                      update = lambda self, context: rig_params_update(self, 'CAM_LIGHT'))
+    CamLightEnergy : bpy.props.FloatProperty(name = "Light Energy", default = 1500, min = 0, unit = 'POWER',
+                                             update = lambda self, context: rig_params_update(self, 'CAM_LIGHT_ENERGY'))
+    
+    # HDRI world tied to the rig (see hdri_world). The world's drivers read these, no update needed.
+    HdriStrength : bpy.props.FloatProperty(name = "HDRI Strength", default = 1, min = 0, soft_max = 10)
+    HdriRotation : bpy.props.FloatProperty(name = "HDRI Rotation", description = "Turns the HDRI on top of the base's own rotation",
+                                           default = 0, subtype = 'ANGLE')
+
+
+# A member of a registered rig, and what it does in the rig (see the "qs_role" stamps).
+class QSRigMember(bpy.types.PropertyGroup):
+    bl_idname = "object.QSRigMember"
+    bl_label = "Quick Stage rig member"
+    
+    Object : bpy.props.PointerProperty(name = "Object", type = bpy.types.Object)
+    Role : bpy.props.StringProperty(name = "Role")
+
+
+# A registered rig. Its name is the rig id, which is also stamped on every member as "qs_rig".
+class QSRig(bpy.types.PropertyGroup):
+    bl_idname = "object.QSRig"
+    bl_label = "Quick Stage rig"
+    
+    Kind : bpy.props.StringProperty(name = "Kind")
+    Root : bpy.props.PointerProperty(name = "Root", type = bpy.types.Object)
+    Members : bpy.props.CollectionProperty(type = QSRigMember)
+
+
 class QSProps(bpy.types.PropertyGroup):
     bl_idname = "object.QSCusProp"          # Every class has a bl_idname and a bl_label
     bl_label = "Quick Stage custom props"   # bl_idname is a reference for blender, bl_label is for human - the display name of the classes.
@@ -32,589 +194,5046 @@ class QSProps(bpy.types.PropertyGroup):
     ScrRat : bpy.props.EnumProperty(
         name = "Screen Ratio",
         description = "Set camera ratio you want",
-        items = [('Sqr', "1:1", "Square"),
-                ('SDScr', "4:3", "SDTV"),
-                ('HDScr', "16:9", "HDTV"),
-                ('WideScr', "21:9", "Ultrawide")
-        ]
-        # Each item in "items" comes is this format: ('blender reference', 'dropdown menu display', 'item tooltip description')
+        items = RatioItems
     )
     
     # A list of selectable screen resolution.
     ScrReso : bpy.props.EnumProperty(
         name = "Render Resolution",
         description = "Quickly set the render resolution",
-        items = [('res720', "720p", ""),
-                ('res1080', "1080p", ""),
-                ('res1440', "1440p", ""),
-                ('res2160', "2160p", ""),
-                ('res4320', "4320p", "")
+        items = ResoItems
+    )
+    
+    # Render quality tier, applied together with the resolution percentage.
+    Quality : bpy.props.EnumProperty(name = "Quality", description = "Render quality tier", items = QualityItems, default = 'PREVIEW')
+    
+    # How rigs are spawned: built fresh, or taken from the prebuilt preset library.
+    LibMode : bpy.props.EnumProperty(
+        name = "Spawn As",
+        description = "Build every rig from scratch, or reuse the prebuilt preset library",
+        items = [('OFF', "New Objects", "Build every object and light from scratch"),
+                ('INSTANCE', "Collection Instance", "One empty instancing the library preset. Fastest and lightest, but not editable (camera rigs use linked duplicates)"),
+                ('LINKED', "Linked Duplicates", "Editable copies of the library preset objects that share their light and camera data")
         ]
     )
     
-    # A list of light set that later can be made.
-    MakeLight : bpy.props.EnumProperty(
-        name = "Render Resolution",
-        description = "Quickly set the render resolution",
-        items = [('clmshll', "Clamshell", "Two middle lights, one above subject, one below subject."),
-                ('fltlt', "Flat Light", "Two lights at equal power, position at the side of the camera."),
-                ('kfh', "Key Fill & Highlight", "Two softlight, one on the left side, one on the right side with half strenght. A highlight lamp from above, aimed at the subject."),
-                ('hghky', "High Key", "A 45 degree light at full strength at the left, a soft light at the side of subject, and a background fill light."),
-                ('lprmlt', "Loop with Rim Light", "A 45 degree light at full strength at the left. A high powered lamp behind the subject."),
-                ('hkk', "Hard Key with Kickers", "Two soft lights behind the subject, a single hard light at an angle towards subject."),
-                ('bgr', "Badger", "Two soft lights behind the subject.")
-                  
+    # Framing: new camera rigs aim at the selected objects and back off far enough to fit them in.
+    CamFrame : bpy.props.BoolProperty(name = "Frame Selection", description = "Place new camera rigs so the selected objects fill the frame", default = False)
+    CamFrameMargin : bpy.props.FloatProperty(name = "Margin", description = "Extra room around the selection, 1 is a tight fit", default = 1.1, min = 1, soft_max = 3)
+    
+    # Fitting light presets to the selected subject instead of a person standing at the origin.
+    LitFit : bpy.props.BoolProperty(name = "Fit to Selection", description = "Scale and move the light setup to the selected objects, keeping the same exposure", default = False)
+    LitOrient : bpy.props.BoolProperty(name = "Face Camera", description = "Turn the light setup so its front faces the scene camera", default = True)
+    
+    # Rig baking: the camera (and camera light) movement written into keyframes, so the constraints can be switched off.
+    BakeSimplify : bpy.props.BoolProperty(name = "Simplify", description = "Leave out keys that can be rebuilt by the keys around them", default = True)
+    BakeTol : bpy.props.FloatProperty(name = "Tolerance", description = "How far a simplified curve may stray from the rig (units, or radians for rotation)",
+                                      default = 0.0001, min = 0, precision = 5)
+    BakeMute : bpy.props.BoolProperty(name = "Mute Constraints", description = "Switch the baked objects' constraints off, they're not needed anymore", default = True)
+    
+    # Camera moves for the complex rig, over the scene's frame range.
+    MotionKind : bpy.props.EnumProperty(name = "Move", description = "Camera move to key into the rig", items = MotionItems)
+    MotionEase : bpy.props.EnumProperty(name = "Easing", description = "How the move speeds up and slows down", items = MotionEaseItems, default = 'EASE_IN_OUT')
+    MotionTurns : bpy.props.FloatProperty(name = "Turns", description = "Times around the focus point, negative turns the other way", default = 1, soft_min = -10, soft_max = 10)
+    MotionAngle : bpy.props.FloatProperty(name = "Angle", description = "How far the camera rises, negative drops it", default = radians(30), subtype = 'ANGLE')
+    MotionDistance : bpy.props.FloatProperty(name = "Distance", description = "How far the camera moves in, negative moves it out", default = 3, unit = 'LENGTH')
+    MotionAmount : bpy.props.FloatProperty(name = "Amount", description = "Part of the way to the focus point the camera moves", default = 0.3, min = 0, max = 0.99, subtype = 'FACTOR')
+    MotionShake : bpy.props.FloatProperty(name = "Shake", description = "How far the handheld wobble turns the camera", default = radians(0.5), min = 0, soft_max = radians(5), subtype = 'ANGLE')
+    MotionSeed : bpy.props.IntProperty(name = "Seed", description = "Different seeds, different wobble", default = 0, min = 0)
+    
+    # Camera array settings. How many cameras, how they are laid out, and how far from the focus point.
+    ArrCount : bpy.props.IntProperty(name = "Cameras", description = "Number of cameras in the array", default = 12, min = 1, max = 10000)
+    ArrLayout : bpy.props.EnumProperty(
+        name = "Layout",
+        description = "How the cameras are placed around the focus point",
+        items = [('RING', "Ring", "Cameras on a circle around the focus point, good for turntables"),
+                ('GRID', "Grid", "Cameras on a flat grid facing the focus point, good for catalogs"),
+                ('SPHERE', "Sphere", "Cameras spread evenly over a sphere around the focus point")
         ]
     )
+    ArrRadius : bpy.props.FloatProperty(name = "Distance", description = "Distance of the cameras from the focus point", default = 10, min = 0.01, unit = 'LENGTH')
+    ArrSpacing : bpy.props.FloatProperty(name = "Spacing", description = "Space between cameras in the grid", default = 1, min = 0.001, unit = 'LENGTH')
+    ArrHeight : bpy.props.FloatProperty(name = "Height", description = "Height of the ring above the focus point", default = 0, unit = 'LENGTH')
+    ArrHemi : bpy.props.BoolProperty(name = "Upper Half Only", description = "Only use the upper half of the sphere", default = True)
+    
+    # The render queue, stored on the scene so it is saved with the file.
+    RendJobs : bpy.props.CollectionProperty(type = QSRenderJob)
+    RendJobIdx : bpy.props.IntProperty(name = "Active Job", default = 0)
+    RendWorkers : bpy.props.IntProperty(name = "Workers", description = "How many background Blenders render the queue at the same time", default = 1, min = 1, max = 64)
+    # HDRI worlds: the file, and the proxy used in the viewport and for draft and preview renders.
+    HdriPath : bpy.props.StringProperty(name = "HDRI", description = "Environment image for the HDRI world", default = "", subtype = 'FILE_PATH')
+    HdriProxy : bpy.props.EnumProperty(name = "Proxy", description = "Size of the HDRI used in the viewport and for renders. The render queue and tiled renders use the full file at Final quality",
+                                       items = HdriProxySizes, default = '1024', update = lambda self, context: hdri_swap(context.scene, False))
+    
+    RendMultiview : bpy.props.BoolProperty(name = "Multiview", description = "Render jobs with the same frames and size as one multiview render, one view per camera, so the scene is only loaded once",
+                                           default = False)
+    
+    # Subject crop: the render border follows the subject, the rest of the frame is filled in by the compositor.
+    CropTargets : bpy.props.CollectionProperty(type = QSCropTarget)
+    CropEnable : bpy.props.BoolProperty(name = "Crop to Subject", description = "Only render the part of the frame the subject is in",
+                                        update = lambda self, context: crop_update(context.scene))
+    CropMargin : bpy.props.FloatProperty(name = "Margin", description = "Room around the subject, as a part of the frame size",
+                                         default = 0.05, min = 0, max = 0.5, subtype = 'FACTOR',
+                                         update = lambda self, context: crop_refresh(context.scene))
+    CropPerFrame : bpy.props.BoolProperty(name = "Every Frame", description = "Move the border with the subject on every frame, instead of one border around it over the whole frame range. "
+                                          "Only the render queue renders frame by frame; an animation render keeps the border of its first frame",
+                                          update = lambda self, context: crop_refresh(context.scene))
+    CropBackground : bpy.props.EnumProperty(
+        name = "Background",
+        description = "What fills the frame outside the border",
+        items = [('NONE', "Nothing", "Leave it empty (transparent)"),
+                 ('FLAT', "Flat Color", "A single color"),
+                 ('PLATE', "Background Plate", "A quick, low sample render of the whole frame (Render Plate)")],
+        default = 'FLAT', update = lambda self, context: crop_refresh(context.scene))
+    CropColor : bpy.props.FloatVectorProperty(name = "Color", subtype = 'COLOR', size = 4, min = 0, max = 1, default = (0.8, 0.8, 0.8, 1),
+                                              update = lambda self, context: crop_refresh(context.scene))
+    CropPlate : bpy.props.StringProperty(name = "Plate", default = "//render/qs_plate.exr", subtype = 'FILE_PATH')
+    CropPlateSamples : bpy.props.IntProperty(name = "Plate Samples", default = 16, min = 1)
+    
+    # Culling: objects the camera never sees over the frame range are left out of the render.
+    CullMode : bpy.props.EnumProperty(
+        name = "Cull By",
+        items = [('HIDE', "Disable in Renders", "Turn off the objects' render visibility"),
+                 ('COLLECTION', "Excluded Collection", "Move the objects into a collection excluded from the view layers, so they aren't even loaded")],
+    )
+    CullMargin : bpy.props.FloatProperty(name = "Margin", description = "Grow every object by this much first, so things just out of view still cast shadows and show in reflections",
+                                         default = 1, min = 0, unit = 'LENGTH')
+    CullFrameMargin : bpy.props.FloatProperty(name = "Frame Margin", description = "Look a bit past the edges of the frame, as a part of the frame size",
+                                              default = 0.1, min = 0, max = 2, subtype = 'FACTOR')
+    CullStep : bpy.props.IntProperty(name = "Frame Step", description = "Check every this many frames of the frame range", default = 1, min = 1)
+    CullLights : bpy.props.BoolProperty(name = "Cull Rig Lights", description = "Also leave out Quick Stage lights that don't reach anything the camera sees",
+                                        default = True)
+    CullLightDistance : bpy.props.BoolProperty(name = "Clamp Light Distance", description = "Set the EEVEE custom distance of the lights that stay to just what they need to reach")
+    
+    # Tiled still rendering, by RendWorkers background Blenders.
+    TileOutput : bpy.props.StringProperty(name = "Output", description = "Where the stitched still goes, .exr or .png",
+                                          default = "//render/tiled.exr", subtype = 'FILE_PATH')
+    TilesX : bpy.props.IntProperty(name = "Tiles X", default = 4, min = 1, max = 64)
+    TilesY : bpy.props.IntProperty(name = "Tiles Y", default = 4, min = 1, max = 64)
+    TileOverlap : bpy.props.IntProperty(name = "Overlap", description = "Pixels every tile reaches into its neighbours, cross-faded when stitching",
+                                        default = 32, min = 0, max = 512, subtype = 'PIXEL')
+    TileResume : bpy.props.BoolProperty(name = "Resume", description = "Keep the tiles already rendered for this frame and only render the missing ones",
+                                        default = True)
+    
+    # Relight matrix: all presets rendered once, previewed from cached light group passes.
+    RelightLights : bpy.props.CollectionProperty(type = QSRelightLight)
+    RelightPreset : bpy.props.EnumProperty(name = "Preview", description = "Light preset shown in the relight preview",
+                                           items = lambda self, context: PresetItems, update = lambda self, context: relight_show(context.scene))
+    RelightDir : bpy.props.StringProperty(name = "Relight Folder", description = "Where the light group passes are saved",
+                                          default = "//relight/", subtype = 'DIR_PATH')
+    
+    # Diagnostics: writing the operator records to a log file, and which operators get profiled.
+    DiagLog : bpy.props.BoolProperty(name = "Log to File", description = "Also append every record as a JSON line to the log file", default = False)
+    DiagLogPath : bpy.props.StringProperty(name = "Log File", description = "Where the records go. Empty means diagnostics.jsonl in Blender's config folder",
+                                           default = "", subtype = 'FILE_PATH')
+    DiagProfile : bpy.props.EnumProperty(name = "Profile", description = "Operators to run under cProfile. The profile is saved next to the log file",
+                                         items = lambda self, context: DiagItems, options = {'ENUM_FLAG'})
+    
+    # Registry of every rig Quick Stage spawned in this scene.
+    Rigs : bpy.props.CollectionProperty(type = QSRig)
+    RigKind : bpy.props.EnumProperty(name = "Rigs", description = "Kind of rig the buttons below work on",
+                                     items = lambda self, context: rig_kind_items(context.scene))
+    RigEnergy : bpy.props.FloatProperty(name = "Energy", description = "Multiply the energy of every light in these rigs", default = 1, min = 0)
+    RigLens : bpy.props.FloatProperty(name = "Lens", description = "Focal length for every camera in these rigs", default = 50, min = 1, unit = 'CAMERA')
+    
+    # Batch staging: lots of rigs, built a few milliseconds at a time.
+    BatchWhat : bpy.props.EnumProperty(name = "Make", description = "What every rig of the batch is", items = lambda self, context: BatchItems)
+    BatchCount : bpy.props.IntProperty(name = "Count", description = "How many rigs to make", default = 25, min = 1, soft_max = 500)
+    BatchSpacing : bpy.props.FloatProperty(name = "Spacing", description = "Distance between rigs, laid out in a grid around the 3D cursor",
+                                           default = 15, min = 0, unit = 'LENGTH')
+    BatchSlice : bpy.props.IntProperty(name = "Slice (ms)", description = "Time spent building per tick, the rest is left for the UI",
+                                       default = 10, min = 1, max = 200)
+    
+    # Stage generator. The cyclorama has sizes of its own, it is a lot bigger than the rest.
+    StageKind : bpy.props.EnumProperty(name = "Stage", description = "What to make", items = lambda self, context: StageItems)
+    StageWidth : bpy.props.FloatProperty(name = "Width", default = 1.2, min = 0.01, unit = 'LENGTH')
+    StageDepth : bpy.props.FloatProperty(name = "Depth", default = 1.2, min = 0.01, unit = 'LENGTH')
+    StageHeight : bpy.props.FloatProperty(name = "Height", default = 0.9, min = 0.01, unit = 'LENGTH')
+    StageBevel : bpy.props.FloatProperty(name = "Bevel", description = "Radius of the rounded edges", default = 0.03, min = 0, unit = 'LENGTH')
+    StageSteps : bpy.props.IntProperty(name = "Steps", description = "Steps of the risers, shelves of the rack", default = 3, min = 1, max = 32)
+    CycWidth : bpy.props.FloatProperty(name = "Width", default = 12, min = 0.1, unit = 'LENGTH')
+    CycDepth : bpy.props.FloatProperty(name = "Depth", default = 10, min = 0.1, unit = 'LENGTH')
+    CycHeight : bpy.props.FloatProperty(name = "Height", default = 6, min = 0.1, unit = 'LENGTH')
+    CycCove : bpy.props.FloatProperty(name = "Cove Radius", description = "Radius of the curve between floor and wall", default = 2, min = 0.01, unit = 'LENGTH')
+    
+    # A list of light set that later can be made, built-in presets and preset files.
+    MakeLight : bpy.props.EnumProperty(
+        name = "Light Setup",
+        description = "Light setup to make",
+        items = lambda self, context: preset_icon_items()
+    )
+
+
+# ======================================================
+# Below is the light preset table. Every preset from the MakeLight dropdown is one entry here,
+# the spawn engine further down reads it and builds the objects.
+#
+# Each entry has:
+# - tag: appended to every object name, so you can tell the sets apart in the outliner.
+# - report: the message shown after spawning.
+# - base: the circle empty that moves the entire light set.
+# - focus: (optional) a sphere empty the lights aim at. Lights with 'track' get a Track To constraint to it.
+# - lights: one dict per light. 'radius' works like the radius of bpy.ops.object.light_add,
+#   'data' holds any extra light data values (spot size, blend, etc).
+# Rotations are in radians, same as what light_add takes.
+# Preset files (see the preset files section) can also have extra 'empties', and give any light or empty
+# a 'parent' and a list of 'constraints', both pointing at 'base', 'focus' or another member by name.
+
+
+LitPresets = {
+    'clmshll': {
+        'tag': "ClmShll",
+        'report': "Light setup made: Clamshell",
+        'base': {'location': (0, 0, 1.8)},
+        'focus': {'location': (0, 0, 3.12)},
+        'lights': [
+            {'name': "Upper Light", 'type': 'AREA', 'radius': 2.5, 'location': (0, -5, 4.75), 'rotation': (1.13446, 0, 0), 'energy': 250, 'track': True},
+            {'name': "Lower Light", 'type': 'AREA', 'radius': 2.5, 'location': (0, -5, 1.5), 'rotation': (2.00713, 0, 0), 'energy': 250, 'track': True},
+        ],
+    },
+    'fltlt': {
+        'tag': "FltLt",
+        'report': "Light setup made: Flatlight",
+        'base': {'location': (0, 0, 1.5)},
+        'focus': {'location': (0, 0, 3)},
+        'lights': [
+            {'name': "Left Light", 'type': 'AREA', 'radius': 3, 'location': (5, -5, 3), 'rotation': (1.5708, 0, 0.785398), 'energy': 250, 'track': True},
+            {'name': "Right Light", 'type': 'AREA', 'radius': 3, 'location': (-5, -5, 3), 'rotation': (1.5708, 0, -0.785398), 'energy': 250, 'track': True},
+        ],
+    },
+    'kfh': {
+        'tag': "KFHLt",
+        'report': "Light setup made: Key & Fill lights",
+        'base': {'location': (0, 0, 1.8)},
+        'lights': [
+            {'name': "Fill Light", 'type': 'AREA', 'radius': 3, 'location': (5, -5, 2.5), 'rotation': (1.5708, 0, 0.785398), 'energy': 200},
+            {'name': "Key Light", 'type': 'AREA', 'radius': 3, 'location': (-3.5, -3.5, 3), 'rotation': (1.5708, 0, -0.785398), 'energy': 400},
+            {'name': "Highlight", 'type': 'SPOT', 'radius': 3, 'location': (1.5, 1.5, 8), 'rotation': (-0.314159, 0.314159, 0), 'energy': 2500,
+                'data': {'shadow_soft_size': 1.5, 'spot_size': 0.872665, 'spot_blend': 0}},
+        ],
+    },
+    'hghky': {
+        'tag': "KF",
+        'report': "Light setup made: Key & Fill with highlight",
+        'base': {'location': (0, 0, 1.8)},
+        'lights': [
+            {'name': "Fill Light", 'type': 'AREA', 'radius': 3, 'location': (5, -5, 2.5), 'rotation': (1.5708, 0, 0.785398), 'energy': 200},
+            {'name': "Key Light", 'type': 'AREA', 'radius': 3, 'location': (-3.5, -3.5, 3), 'rotation': (1.5708, 0, -0.785398), 'energy': 400},
+        ],
+    },
+    'lprmlt': {
+        'tag': "LpRm",
+        'report': "Light setup made: Loop with rim light",
+        'base': {'location': (0, 0, 1.8)},
+        'lights': [
+            {'name': "Key Light", 'type': 'AREA', 'radius': 3, 'location': (-3.5, -3.5, 3), 'rotation': (1.5708, 0, -0.785398), 'energy': 400},
+            {'name': "Highlight", 'type': 'SPOT', 'radius': 3, 'location': (2, 4, 5), 'rotation': (-1.27409, 0, -0.47473), 'energy': 2500,
+                'data': {'shadow_soft_size': 1.5, 'spot_size': 0.523599, 'spot_blend': 0}},
+        ],
+    },
+    'hkk': {
+        'tag': "HKK",
+        'report': "Light setup made: High key with Kickers",
+        'base': {'location': (0, 0, 1.8)},
+        'lights': [
+            {'name': "Back Light1", 'type': 'AREA', 'radius': 2, 'location': (3.5, 4, 2.5), 'rotation': (-1.5708, 0, -0.637045), 'energy': 300},
+            {'name': "Back Light2", 'type': 'AREA', 'radius': 2, 'location': (-3.5, 4, 2.5), 'rotation': (-1.5708, 0, 0.637045), 'energy': 300},
+            {'name': "Kicker Light", 'type': 'SPOT', 'radius': 3, 'location': (0.8, -5, 5), 'rotation': (1.22173, 0, 0.174533), 'energy': 1000},
+        ],
+    },
+    'bgr': {
+        'tag': "Bdgr",
+        'report': "Light setup made: Badger",
+        'base': {'location': (0, 0, 1.8)},
+        'focus': {'location': (0, 0, 3.5)},
+        'lights': [
+            {'name': "Upper Light", 'type': 'AREA', 'radius': 2, 'location': (3.5, 4, 2.5), 'rotation': (-1.5708, 0, -0.637045), 'energy': 500, 'track': True},
+            {'name': "Lower Light", 'type': 'AREA', 'radius': 2, 'location': (-3.5, 4, 2.5), 'rotation': (-1.5708, 0, 0.637045), 'energy': 500, 'track': True},
+        ],
+    },
+}
+
+
+# ======================================================
+# Render size. Every ratio is (width part, height part, report name), every resolution is a height in pixels.
+
+
+RatioTable = {
+    'Sqr': (1, 1, "Square"),
+    'SDScr': (4, 3, "SD"),
+    'HDScr': (16, 9, "HD"),
+    'WideScr': (21, 9, "Ultrawide"),
+}
+
+ResoTable = {
+    'res720': 720,
+    'res1080': 1080,
+    'res1440': 1440,
+    'res2160': 2160,
+    'res4320': 4320,
+}
+
+
+# Width that goes with a height for the chosen ratio. Plain math, no Blender involved.
+def ratio_width(height, ratio):
+    w, h, name = RatioTable[ratio]
+    return int(round(height * w / h))
+
+
+# Sets a scene's render size. reso is optional, without it the current height is kept
+# and only the width is changed to match the ratio.
+def apply_render_size(render, ratio, reso=None):
+    if reso is not None:
+        render.resolution_y = ResoTable[reso]
+    render.resolution_x = ratio_width(render.resolution_y, ratio)
+    return render.resolution_x, render.resolution_y
+
+
+# ======================================================
+# Render quality tiers. Samples and light paths are what really decide render time, so every tier
+# sets those together with the resolution percentage. Values are grouped by where they live:
+# 'render' is scene.render, 'cycles' is scene.cycles and 'eevee' is scene.eevee.
+# Anything the running Blender doesn't have (say, Cycles is disabled) is just skipped.
+
+
+QualityTiers = {
+    'DRAFT': {
+        'render': {'resolution_percentage': 50, 'use_simplify': True, 'simplify_subdivision_render': 1},
+        'cycles': {'samples': 32, 'use_adaptive_sampling': True, 'adaptive_threshold': 0.1, 'use_denoising': True,
+                   'max_bounces': 4, 'diffuse_bounces': 2, 'glossy_bounces': 2, 'transmission_bounces': 4,
+                   'transparent_max_bounces': 4, 'volume_bounces': 0, 'texture_limit_render': '1024'},
+        'eevee': {'taa_render_samples': 16},
+    },
+    'PREVIEW': {
+        'render': {'resolution_percentage': 75, 'use_simplify': True, 'simplify_subdivision_render': 3},
+        'cycles': {'samples': 128, 'use_adaptive_sampling': True, 'adaptive_threshold': 0.05, 'use_denoising': True,
+                   'max_bounces': 8, 'diffuse_bounces': 3, 'glossy_bounces': 3, 'transmission_bounces': 6,
+                   'transparent_max_bounces': 8, 'volume_bounces': 1, 'texture_limit_render': '2048'},
+        'eevee': {'taa_render_samples': 32},
+    },
+    'FINAL': {
+        'render': {'resolution_percentage': 100, 'use_simplify': False},
+        'cycles': {'samples': 1024, 'use_adaptive_sampling': True, 'adaptive_threshold': 0.01, 'use_denoising': True,
+                   'max_bounces': 12, 'diffuse_bounces': 4, 'glossy_bounces': 4, 'transmission_bounces': 12,
+                   'transparent_max_bounces': 8, 'volume_bounces': 0, 'texture_limit_render': 'OFF'},
+        'eevee': {'taa_render_samples': 128},
+    },
+}
+
+# Seconds per frame of each tier on the reference scene, measured on this machine. Opt-in: no timings come with
+# the add-on (they'd only be true for the machine they were taken on), the file only exists after running
+# "blender -b -P quickstage_bench.py -- --tiers --write-tiers". Read once, when first needed.
+TierTimingsFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "quickstage_tiers.json")
+TierTimings = {}
+
+
+# Applies a quality tier to a scene. Returns the names of the settings that were actually set.
+# The tier is kept on the scene too, so renders of the saved file (background workers included) know it.
+def apply_quality(scene, tier):
+    scene["qs_tier"] = tier
+    done = []
+    for section, values in QualityTiers[tier].items():
+        target = scene.render if section == 'render' else getattr(scene, section, None)
+        for attr, value in values.items():
+            if target is not None and hasattr(target, attr):
+                setattr(target, attr, value)
+                done.append(section + "." + attr)
+    return done
+
+
+# The measured timings, loaded from TierTimingsFile the first time they are asked for.
+def tier_timings():
+    if 'loaded' not in TierTimings:
+        TierTimings['loaded'] = True
+        try:
+            with open(TierTimingsFile) as f:
+                TierTimings.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+    return TierTimings.get('tiers', {})
+
+
+# ======================================================
+# Below is the spawn engine. Instead of bpy.ops calls (every single one of them refreshes the
+# view layer and the depsgraph, which gets really slow in big scenes), objects are made
+# directly as datablocks through bpy.data. Nothing here touches selection or needs a 3D view.
+
+
+# Builds a world matrix from a location and euler rotation. The scene hasn't evaluated
+# freshly made objects yet, so matrix_world can't be trusted - we do the math ourselves.
+def loc_rot_matrix(location, rotation=(0, 0, 0)):
+    return Matrix.Translation(location) @ Euler(rotation).to_matrix().to_4x4()
+
+
+# Same as parent_set with keep_transform, but without the operator:
+# the child keeps its place because the parent inverse cancels out the parent's matrix.
+def parent_keep(child, parent, parent_matrix):
+    child.parent = parent
+    child.matrix_parent_inverse = parent_matrix.inverted()
+
+
+# Makes an empty object, not yet linked to any collection.
+def new_empty(name, display, size, location, rotation=(0, 0, 0)):
+    empty = bpy.data.objects.new(name, None)
+    empty.empty_display_type = display
+    empty.empty_display_size = size
+    empty.location = location
+    empty.rotation_euler = rotation
+    return empty
+
+
+# light_add's radius is made bigger or smaller first, depending on the type ("better defaults" in Blender's source).
+LightAddScale = {'AREA': 4.0, 'SUN': 0.5}
+
+
+# Makes a light datablock and its object, not yet linked to any collection.
+# 'radius' scales the light the same way light_add's radius does: an area light's size (and size_y),
+# or the soft shadow size of the other types. Older Blenders keep both in one field, so an area
+# light's soft size is left alone, or it would be scaled twice there.
+def new_light(name, light_type, location, rotation=(0, 0, 0), energy=10, radius=1, data=None):
+    ldata = bpy.data.lights.new(name, light_type)
+    ldata.energy = energy
+    scale = radius * LightAddScale.get(light_type, 1.0)
+    if light_type == 'AREA':
+        ldata.size *= scale
+        ldata.size_y *= scale
+    else:
+        ldata.shadow_soft_size *= scale
+    for attr, value in (data or {}).items():
+        setattr(ldata, attr, value)
+    
+    light = bpy.data.objects.new(name, ldata)
+    light.location = location
+    light.rotation_euler = rotation
+    return light
+
+
+# Where new objects go: the active collection, or the scene's master collection as a fallback
+# (there is no active collection when running from scripts or in the background).
+def spawn_collection(context):
+    return getattr(context, "collection", None) or context.scene.collection
+
+
+# Links a batch of objects in one go, then (optionally) updates the view layer once.
+def link_objects(objects, collection, view_layer=None):
+    for ob in objects:
+        collection.objects.link(ob)
+    if view_layer is not None:
+        view_layer.update()
+
+
+# The spot light that rides along with a rig's camera.
+def new_cam_light(cam):
+    spot = new_light("Cam Light Rig", 'SPOT', (0, 0, 0), energy=1500,
+                     data={'shadow_soft_size': 6, 'spot_blend': 1, 'spot_size': 1.13446})
+    spot.constraints.new('COPY_TRANSFORMS').target = cam
+    return spot
+
+
+# The camera rig builder. kind is 'SIMPLE' or 'COMPLEX'.
+#
+# Simple: a camera that always faces the 'Focus Rig' empty.
+# Complex: the focus empty acts as a floor, the 'Rotation Rig' sphere follows it,
+# the 'Zoom Rig' cube is parented to the sphere and may only slide along its local Y,
+# and the camera copies the cube's location while tracking the focus.
+# With cam_light, a spot light copies the camera's transforms.
+#
+# Everything is made in one pass through bpy.data, so it works from scripts, timers and
+# background jobs, and never touches the user's selection.
+# Returns a dict of the rig members by role: focus, camera, rotation, zoom, light.
+def build_cam_rig(kind, collection, view_layer=None, cam_light=False, scene=None,
+                  focus_location=(0, 0, 0), cam_location=(0, -10, 0)):
+    rig = {}
+    
+    empty = new_empty("Focus Rig", 'PLAIN_AXES', 1, focus_location)
+    rig['focus'] = empty
+    
+    cam = bpy.data.objects.new("Camera Rig", bpy.data.cameras.new("Camera Rig"))
+    cam.location = cam_location
+    cam.rotation_euler = (1.5708, 0, 0)
+    # The focus point doubles as the depth of field focus.
+    cam.data.dof.focus_object = empty
+    rig['camera'] = cam
+    
+    if kind == 'COMPLEX':
+        sphere = new_empty("Rotation Rig", 'SPHERE', 1, focus_location)
+        cube = new_empty("Zoom Rig", 'CUBE', 1, cam_location)
+        rig['rotation'] = sphere
+        rig['zoom'] = cube
+        
+        limit = empty.constraints.new('LIMIT_ROTATION')
+        limit.use_limit_x = True
+        limit.use_limit_y = True
+        limit.use_limit_z = True
+        
+        sphere.constraints.new('COPY_LOCATION').target = empty
+        
+        # Zoom rig rides on the rotation rig.
+        parent_keep(cube, sphere, loc_rot_matrix(focus_location))
+        
+        # Only allowed to move along the rotation rig's Y axis.
+        limit = cube.constraints.new('LIMIT_LOCATION')
+        limit.use_min_x = True
+        limit.use_max_x = True
+        limit.use_min_z = True
+        limit.use_max_z = True
+        limit.owner_space = 'CUSTOM'
+        limit.space_object = sphere
+        
+        cam.constraints.new('COPY_LOCATION').target = cube
+    
+    cam.constraints.new('TRACK_TO').target = empty
+    
+    if cam_light:
+        rig['light'] = new_cam_light(cam)
+    
+    # Every member knows its part in the rig, see the rig registry.
+    for role, ob in rig.items():
+        ob["qs_role"] = role
+    
+    link_objects(rig.values(), collection, view_layer)
+    
+    # Just like camera_add, the first camera in a scene becomes the scene camera.
+    if scene is not None and scene.camera is None:
+        scene.camera = cam
+    
+    return rig
+
+
+# Computes camera positions for the camera array, all at once with numpy.
+# Returns an (count, 3) array of locations relative to the focus point.
+def array_positions(count, layout, radius, height=0, hemisphere=True, spacing=1):
+    i = np.arange(count, dtype=np.float64)
+    
+    if layout == 'RING':
+        # Evenly spaced around a circle, starting in front of the subject (-Y) like the normal rig.
+        angle = i * (2 * np.pi / count)
+        return np.column_stack((radius * np.sin(angle), -radius * np.cos(angle), np.full(count, height)))
+    
+    elif layout == 'GRID':
+        # A flat wall of cameras in front of the subject, centered on it.
+        cols = int(np.ceil(np.sqrt(count)))
+        rows = int(np.ceil(count / cols))
+        x = (i % cols - (cols - 1) / 2) * spacing
+        z = ((rows - 1) / 2 - i // cols) * spacing
+        return np.column_stack((x, np.full(count, -radius), z))
+    
+    # Sphere: a fibonacci spiral gives nice even spacing for any count.
+    if hemisphere:
+        z = 1 - (i + 0.5) / count
+    else:
+        z = 1 - 2 * (i + 0.5) / count
+    ring = np.sqrt(1 - z * z)
+    angle = i * np.pi * (3 - np.sqrt(5))
+    return np.column_stack((ring * np.sin(angle), -ring * np.cos(angle), z)) * radius
+
+
+# Euler rotations that point a camera (looking down its -Z) from each position at target.
+# The Track To constraint does this anyway, but this way the cameras already look right before the scene updates.
+def aim_rotations(positions, target):
+    d = np.asarray(target, dtype=np.float64) - positions
+    rot = np.zeros_like(d)
+    rot[:, 0] = np.arctan2(np.hypot(d[:, 0], d[:, 1]), -d[:, 2])
+    rot[:, 2] = np.arctan2(d[:, 1], d[:, 0]) - np.pi / 2
+    return rot
+
+
+# Makes count simple camera rigs sharing a single focus empty, laid out by array_positions.
+# The cameras go into their own "Camera Array" collection, and share one camera datablock
+# (like Alt+D duplicates), so changing the lens changes all of them.
+# Locations and rotations are written in bulk with foreach_set.
+# Returns a dict with the 'focus' empty, the 'cameras' list and the array 'collection'.
+def build_cam_array(count, layout, radius, collection, view_layer=None, height=0, hemisphere=True,
+                    spacing=1, scene=None, focus_location=(0, 0, 0)):
+    arr_coll = bpy.data.collections.new("Camera Array")
+    collection.children.link(arr_coll)
+    
+    empty = new_empty("Focus Rig", 'PLAIN_AXES', 1, focus_location)
+    camdata = bpy.data.cameras.new("Array Cam")
+    camdata.dof.focus_object = empty
+    
+    empty["qs_role"] = "focus"
+    cams = []
+    for n in range(count):
+        cam = bpy.data.objects.new("Array Cam " + str(n + 1).zfill(3), camdata)
+        cam["qs_role"] = "camera"
+        cam.constraints.new('TRACK_TO').target = empty
+        arr_coll.objects.link(cam)
+        cams.append(cam)
+    
+    positions = array_positions(count, layout, radius, height, hemisphere, spacing) + np.asarray(focus_location)
+    arr_coll.objects.foreach_set("location", positions.astype(np.float32).ravel())
+    arr_coll.objects.foreach_set("rotation_euler", aim_rotations(positions, focus_location).astype(np.float32).ravel())
+    
+    link_objects([empty], arr_coll, view_layer)
+    
+    if scene is not None and scene.camera is None:
+        scene.camera = cams[0]
+    
+    return {'focus': empty, 'cameras': cams, 'collection': arr_coll}
+
+
+# The light preset spawn engine. Reads one LitPresets entry and builds the whole set:
+# lights, light data, focus empty, constraints and parenting to the base.
+# Returns the base empty, and a list of every object made (base first).
+def spawn_light_preset(key, collection, view_layer=None):
+    preset = light_preset(key)
+    tag = preset['tag']
+    
+    base_rot = (1.5708, 0, 0)
+    base_matrix = loc_rot_matrix(preset['base']['location'], base_rot)
+    litbase = new_empty("Set Base " + tag, 'CIRCLE', 5, preset['base']['location'], base_rot)
+    litbase["qs_role"] = "base"
+    litbase["qs_home"] = preset['base']['location']
+    made = [litbase]
+    
+    # Everything a member can be parented to or point at, by name, with its matrix when spawned.
+    targets = {'base': (litbase, base_matrix)}
+    
+    litfoc = None
+    if 'focus' in preset:
+        litfoc = new_empty("Light Focus " + tag, 'SPHERE', 1.15, preset['focus']['location'])
+        litfoc["qs_role"] = "focus"
+        litfoc["qs_home"] = preset['focus']['location']
+        parent_keep(litfoc, litbase, base_matrix)
+        made.append(litfoc)
+        targets['focus'] = (litfoc, loc_rot_matrix(preset['focus']['location']))
+    
+    members = []
+    for spec in preset.get('empties', []):
+        empty = new_empty(spec['name'] + " " + tag, spec.get('display', 'PLAIN_AXES'), spec.get('size', 1),
+                          spec['location'], spec.get('rotation', (0, 0, 0)))
+        empty["qs_role"] = "empty:" + spec['name']
+        empty["qs_home"] = spec['location']
+        members.append((spec, empty))
+    
+    for spec in preset['lights']:
+        light = new_light(spec['name'] + " " + tag, spec['type'], spec['location'], spec.get('rotation', (0, 0, 0)),
+                          spec['energy'], spec.get('radius', 1), spec.get('data'))
+        light["qs_role"] = "light:" + spec['name']
+        # Where it started and how bright, so the rig settings can scale from there.
+        light["qs_home"] = spec['location']
+        light["qs_energy"] = spec['energy']
+        members.append((spec, light))
+    
+    for spec, ob in members:
+        targets[spec['name']] = (ob, loc_rot_matrix(spec['location'], spec.get('rotation', (0, 0, 0))))
+    
+    # Constraints and parents last, since they may point at any other member.
+    for spec, ob in members:
+        if spec.get('track') and litfoc is not None:
+            track = ob.constraints.new('TRACK_TO')
+            track.target = litfoc
+        for con in spec.get('constraints', []):
+            ob.constraints.new(con['type']).target = targets[con['target']][0]
+        
+        parent_keep(ob, *targets[spec.get('parent', 'base')])
+        made.append(ob)
+    
+    link_objects(made, collection, view_layer)
+    return litbase, made
+
+
+# ======================================================
+# Preset files. Light presets beyond the built-in ones are JSON files, one preset per file, in the
+# "presets" folder of Quick Stage's config folder (and any folders in $QUICKSTAGE_PRESETS).
+# A preset file looks like a LitPresets entry, plus a small header:
+#
+#   {"format": "quickstage-preset", "version": 1, "key": "rembrandt", "name": "Rembrandt",
+#    "description": "...", "tag": "Rmbr",
+#    "base": {"location": [0, 0, 1.8]}, "focus": {"location": [0, 0, 3]},
+#    "empties": [{"name": "Bounce Aim", "display": "SPHERE", "size": 0.5, "location": [2, -2, 1]}],
+#    "lights": [{"name": "Key", "type": "AREA", "location": [-3, -3, 3], "rotation": [1.57, 0, -0.78],
+#                "energy": 400, "radius": 3, "track": true, "parent": "base",
+#                "constraints": [{"type": "DAMPED_TRACK", "target": "Bounce Aim"}], "data": {"color": [1, 0.9, 0.8]}}]}
+#
+# Only the headers (key, name, description) are needed to fill the dropdown. They are kept in an index
+# file next to the presets folder, so starting Blender only stats the files, and only new or changed
+# files get parsed. Full definitions are parsed the first time a preset is used, and cached.
+# A timer keeps an eye on the folders, so files that are added, changed or removed show up on their own.
+
+
+PresetFormat = "quickstage-preset"
+PresetVersion = 1
+
+PresetLightTypes = ('POINT', 'SUN', 'SPOT', 'AREA')
+PresetEmptyTypes = ('PLAIN_AXES', 'ARROWS', 'SINGLE_ARROW', 'CIRCLE', 'CUBE', 'SPHERE', 'CONE', 'IMAGE')
+PresetConstraints = ('TRACK_TO', 'DAMPED_TRACK', 'LOCKED_TRACK', 'COPY_LOCATION', 'COPY_ROTATION', 'COPY_TRANSFORMS')
+
+# Light data settings a light's 'data' may set, and the kind of value each takes. Any light type
+# has the common ones, the rest only exist on some types (a sun has no spot_size, for one).
+PresetLightCommon = {'color': 'color', 'specular_factor': 'number', 'diffuse_factor': 'number', 'volume_factor': 'number',
+                     'use_shadow': 'bool', 'use_custom_distance': 'bool', 'cutoff_distance': 'number'}
+PresetLightData = {
+    'POINT': {'shadow_soft_size': 'number'},
+    'SUN': {'angle': 'number'},
+    'SPOT': {'shadow_soft_size': 'number', 'spot_size': 'number', 'spot_blend': 'number', 'show_cone': 'bool'},
+    'AREA': {'shape': 'shape', 'size': 'number', 'size_y': 'number', 'spread': 'number'},
+}
+PresetAreaShapes = ('SQUARE', 'RECTANGLE', 'DISK', 'ELLIPSE')
+
+# Headers of the preset files found, by key: name, description, path, and the file's mtime and size.
+PresetHeaders = {}
+
+# Parsed preset files, by path: ((mtime, size), definition). An entry whose file changed since is ignored.
+PresetCache = {}
+
+# Preset files that could not be used, by path, with why.
+PresetErrors = {}
+
+# What the preset folders looked like at the last scan.
+PresetWatch = {'stamp': None}
+PresetWatchInterval = 2.0
+
+
+def preset_dirs():
+    extra = os.environ.get("QUICKSTAGE_PRESETS", "")
+    return [os.path.join(config_dir(), "presets")] + [d for d in extra.split(os.pathsep) if d]
+
+
+# Every .json file in the preset folders, with its os.stat result.
+def preset_files():
+    found = []
+    for folder in preset_dirs():
+        if os.path.isdir(folder):
+            found.extend((entry.path, entry.stat()) for entry in os.scandir(folder)
+                         if entry.name.endswith(".json") and entry.is_file())
+    return sorted(found, key=lambda f: f[0])
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_vec3(value):
+    return isinstance(value, list) and len(value) == 3 and all(is_number(v) for v in value)
+
+
+# Checks a preset file's contents. Returns a list of what is wrong with it, empty when it is fine.
+def validate_preset(data):
+    if not isinstance(data, dict):
+        return ["not a JSON object"]
+    
+    errors = []
+    if data.get('format') != PresetFormat:
+        errors.append("'format' must be " + json.dumps(PresetFormat))
+    if not isinstance(data.get('version'), int) or not 1 <= data['version'] <= PresetVersion:
+        errors.append("unsupported 'version' " + json.dumps(data.get('version')) + ", this Quick Stage reads up to " + str(PresetVersion))
+    key = data.get('key')
+    if not isinstance(key, str) or not key.replace("_", "").isalnum() or key in LitPresets or key.startswith("camrig_"):
+        errors.append("'key' must be letters, digits and _, and not the key of a built-in preset")
+    for field in ('name', 'tag'):
+        if not isinstance(data.get(field), str) or not data[field]:
+            errors.append("'" + field + "' must be a non-empty string")
+    if not isinstance(data.get('description', ""), str):
+        errors.append("'description' must be a string")
+    for field in ('base', 'focus'):
+        if (field == 'base' or field in data) and not (isinstance(data.get(field), dict) and is_vec3(data[field].get('location'))):
+            errors.append("'" + field + "' needs a 'location' of [x, y, z]")
+    
+    empties = data.get('empties', [])
+    lights = data.get('lights')
+    if not isinstance(empties, list):
+        errors.append("'empties' must be a list")
+        empties = []
+    if not isinstance(lights, list) or not lights:
+        errors.append("'lights' must be a list with at least one light")
+        lights = []
+    
+    members = [("empties[%d]" % i, spec, False) for i, spec in enumerate(empties)] + \
+              [("lights[%d]" % i, spec, True) for i, spec in enumerate(lights)]
+    names = {'base'} | ({'focus'} if 'focus' in data else set())
+    parents = {}
+    value_kinds = {'number': (is_number, "a number"), 'bool': (lambda v: isinstance(v, bool), "true or false"),
+                   'color': (is_vec3, "[r, g, b]"),
+                   'shape': (lambda v: isinstance(v, str) and v in PresetAreaShapes, "one of " + ", ".join(PresetAreaShapes))}
+    for where, spec, is_light in members:
+        if not isinstance(spec, dict):
+            errors.append(where + ": not an object")
+            continue
+        name = spec.get('name')
+        if not isinstance(name, str) or not name or name in names:
+            errors.append(where + ": 'name' must be a string no other member (or base / focus) uses")
+        names.add(name)
+        if not is_vec3(spec.get('location')):
+            errors.append(where + ": 'location' must be [x, y, z]")
+        if 'rotation' in spec and not is_vec3(spec['rotation']):
+            errors.append(where + ": 'rotation' must be [x, y, z] in radians")
+        if not isinstance(spec.get('track', False), bool):
+            errors.append(where + ": 'track' must be true or false")
+        if not isinstance(spec.get('constraints', []), list) or not all(isinstance(c, dict) for c in spec.get('constraints', [])):
+            errors.append(where + ": 'constraints' must be a list of objects")
+        parents[name] = spec.get('parent', 'base')
+        
+        if is_light:
+            if spec.get('type') not in PresetLightTypes:
+                errors.append(where + ": 'type' must be one of " + ", ".join(PresetLightTypes))
+            if not is_number(spec.get('energy')) or spec['energy'] < 0:
+                errors.append(where + ": 'energy' must be a number, 0 or more")
+            if 'radius' in spec and (not is_number(spec['radius']) or spec['radius'] <= 0):
+                errors.append(where + ": 'radius' must be a number above 0")
+            data_values = spec.get('data', {})
+            if not isinstance(data_values, dict):
+                errors.append(where + ": 'data' must be an object of light settings")
+                data_values = {}
+            allowed = dict(PresetLightCommon, **(PresetLightData[spec['type']] if spec.get('type') in PresetLightTypes else {}))
+            for k, v in data_values.items():
+                kind = allowed.get(k)
+                if kind is None:
+                    errors.append(where + ": 'data' can't set " + json.dumps(k) + " on a " + str(spec.get('type')) + " light, it takes " +
+                                  ", ".join(sorted(allowed)))
+                elif not value_kinds[kind][0](v):
+                    errors.append(where + ": 'data' " + k + " must be " + value_kinds[kind][1])
+        else:
+            if spec.get('display', 'PLAIN_AXES') not in PresetEmptyTypes:
+                errors.append(where + ": 'display' must be one of " + ", ".join(PresetEmptyTypes))
+            if not is_number(spec.get('size', 1)) or spec.get('size', 1) <= 0:
+                errors.append(where + ": 'size' must be a number above 0")
+    
+    # Parents and constraint targets must exist, and parents must not go round in circles.
+    for where, spec, is_light in members:
+        if not isinstance(spec, dict):
+            continue
+        if spec.get('parent', 'base') not in names:
+            errors.append(where + ": unknown 'parent' " + json.dumps(spec.get('parent')))
+        for con in spec.get('constraints', []) if isinstance(spec.get('constraints'), list) else []:
+            if not isinstance(con, dict):
+                continue
+            if con.get('type') not in PresetConstraints:
+                errors.append(where + ": constraint 'type' must be one of " + ", ".join(PresetConstraints))
+            if con.get('target') not in names:
+                errors.append(where + ": unknown constraint 'target' " + json.dumps(con.get('target')))
+    for name in parents:
+        seen = set()
+        while name in parents and name not in seen:
+            seen.add(name)
+            name = parents[name]
+        if name in parents:
+            errors.append("parents go round in a circle through " + json.dumps(name))
+            break
+    return errors
+
+
+# Reads and checks a preset file. Raises ValueError saying what is wrong (bad JSON included).
+def load_preset_file(path):
+    with open(path, encoding = "utf-8") as f:
+        data = json.load(f)
+    errors = validate_preset(data)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return data
+
+
+def preset_index_path():
+    return os.path.join(config_dir(), "presets_index.json")
+
+
+# Dropdown number of a preset file, the same every time so saved files keep their choice.
+def preset_number(key):
+    return 1000 + zlib.crc32(key.encode()) % 1000000
+
+
+# Looks through the preset folders and refreshes the headers, the dropdowns and the index file.
+# Only files that are new or changed since the index was written get parsed.
+def scan_presets():
+    try:
+        with open(preset_index_path(), encoding = "utf-8") as f:
+            index = {h['path']: h for h in json.load(f)['headers']}
+    except (OSError, ValueError, KeyError, TypeError):
+        index = {}
+    
+    files = preset_files()
+    headers = {}
+    errors = {}
+    for path, stat in files:
+        header = index.get(path)
+        if header is None or (header['mtime'], header['size']) != (stat.st_mtime, stat.st_size):
+            try:
+                data = load_preset_file(path)
+            except (OSError, ValueError) as err:
+                errors[path] = str(err)
+                continue
+            header = {'key': data['key'], 'name': data['name'], 'description': data.get('description', ""),
+                      'version': data['version'], 'path': path, 'mtime': stat.st_mtime, 'size': stat.st_size}
+            # It is parsed now anyway.
+            PresetCache[path] = ((stat.st_mtime, stat.st_size), data)
+        if header['key'] in headers:
+            errors[path] = "key '" + header['key'] + "' is already used by " + headers[header['key']]['path']
+            continue
+        headers[header['key']] = header
+    
+    for path in set(PresetCache) - set(h['path'] for h in headers.values()):
+        del PresetCache[path]
+    
+    if list(index.values()) != list(headers.values()):
+        try:
+            with open(preset_index_path(), "w", encoding = "utf-8") as f:
+                json.dump({'version': PresetVersion, 'headers': list(headers.values())}, f, indent = 1)
+        except OSError:
+            pass
+    
+    PresetHeaders.clear()
+    PresetHeaders.update(headers)
+    PresetErrors.clear()
+    PresetErrors.update(errors)
+    PresetWatch['stamp'] = [(path, stat.st_mtime, stat.st_size) for path, stat in files]
+    
+    PresetItems[:] = [(key, name, desc, i) for i, (key, name, desc) in enumerate(LightItems)] + \
+                     [(h['key'], h['name'], h['description'] or h['path'], preset_number(h['key']))
+                      for h in sorted(headers.values(), key = lambda h: h['name'].lower())]
+    BatchItems[:] = PresetItems + BatchCamItems
+
+
+# Timer: rescans when anything in the preset folders was added, removed or changed.
+def preset_watch():
+    if [(path, stat.st_mtime, stat.st_size) for path, stat in preset_files()] != PresetWatch['stamp']:
+        scan_presets()
+    return PresetWatchInterval
+
+
+# The definition of a light preset, built-in or from a file. Files are parsed on first use.
+def light_preset(key):
+    if key in LitPresets:
+        return LitPresets[key]
+    header = PresetHeaders[key]
+    stamp = (header['mtime'], header['size'])
+    cached = PresetCache.get(header['path'])
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, load_preset_file(header['path']))
+        PresetCache[header['path']] = cached
+    return cached[1]
+
+
+def preset_keys():
+    return list(LitPresets) + sorted(PresetHeaders)
+
+
+def preset_report(key):
+    preset = light_preset(key)
+    return preset.get('report', "Light setup made: " + preset.get('name', key))
+
+
+# Light data settings a captured preset keeps, by light type.
+CaptureLightData = {
+    'POINT': ('shadow_soft_size',),
+    'SUN': ('angle',),
+    'SPOT': ('shadow_soft_size', 'spot_size', 'spot_blend'),
+    'AREA': ('shape', 'size', 'size_y'),
+}
+
+
+# Where an object sits without its constraints (a Track To doesn't say where a light was pointed).
+def rest_matrix(ob):
+    if ob.parent is None:
+        return ob.matrix_basis.copy()
+    return ob.parent.matrix_world @ ob.matrix_parent_inverse @ ob.matrix_basis
+
+
+# Turns a light setup rig in the scene back into a preset file definition.
+# Placement is taken relative to the rig's Set Base, so a rig that was moved, turned or fitted to a
+# subject still captures as a preset for the usual subject at the origin. Energies are taken back by
+# the fit's scale squared for the same reason.
+def capture_preset(rig, key, name, description=""):
+    roles = rig_roles(rig)
+    base = roles['base']
+    home = list(base.get("qs_home", (0, 0, 0)))
+    to_preset = loc_rot_matrix(home, (1.5708, 0, 0)) @ base.matrix_world.inverted()
+    scale = base.matrix_world.to_scale().x
+    
+    def rounded(values):
+        return [round(v, 5) for v in values]
+    
+    def placement(ob, spec):
+        loc, rot, size = (to_preset @ rest_matrix(ob)).decompose()
+        spec['location'] = rounded(loc)
+        spec['rotation'] = rounded(rot.to_euler())
+    
+    names = {base: 'base'}
+    preset = {'format': PresetFormat, 'version': PresetVersion, 'key': key, 'name': name, 'description': description,
+              'tag': "".join(c for c in name.title() if c.isalnum())[:8] or key, 'base': {'location': home}}
+    if 'focus' in roles:
+        names[roles['focus']] = 'focus'
+        preset['focus'] = {'location': rounded((to_preset @ roles['focus'].matrix_world).translation)}
+    
+    members = [(ob, role) for ob, role in rig_members(rig) if role.startswith(("light:", "empty:"))]
+    for ob, role in members:
+        names[ob] = role.split(":", 1)[1]
+    
+    empties = []
+    lights = []
+    for ob, role in members:
+        spec = {'name': names[ob]}
+        placement(ob, spec)
+        if ob.type == 'LIGHT':
+            ldata = ob.data
+            spec['type'] = ldata.type
+            spec['energy'] = round(ldata.energy / (scale * scale), 5)
+            spec['data'] = {'color': rounded(ldata.color)}
+            for attr in CaptureLightData.get(ldata.type, ()):
+                value = getattr(ldata, attr)
+                spec['data'][attr] = round(value, 5) if isinstance(value, float) else value
+            lights.append(spec)
+        else:
+            spec['display'] = ob.empty_display_type
+            spec['size'] = round(ob.empty_display_size, 5)
+            empties.append(spec)
+        
+        if names.get(ob.parent, 'base') != 'base':
+            spec['parent'] = names[ob.parent]
+        for con in ob.constraints:
+            target = getattr(con, "target", None)
+            if con.type not in PresetConstraints or target not in names or con.mute:
+                continue
+            if con.type == 'TRACK_TO' and names[target] == 'focus':
+                spec['track'] = True
+            else:
+                spec.setdefault('constraints', []).append({'type': con.type, 'target': names[target]})
+    
+    if empties:
+        preset['empties'] = empties
+    preset['lights'] = lights
+    return preset
+
+
+# Writes a preset definition into the user's preset folder, and picks it up right away.
+# Returns the path written.
+def save_preset(preset):
+    errors = validate_preset(preset)
+    if errors:
+        raise ValueError("; ".join(errors))
+    folder = preset_dirs()[0]
+    os.makedirs(folder, exist_ok = True)
+    path = os.path.join(folder, preset['key'] + ".json")
+    with open(path, "w", encoding = "utf-8") as f:
+        json.dump(preset, f, indent = 2)
+    scan_presets()
+    return path
+
+
+# ======================================================
+# Stage generator. Cycloramas, pedestals, risers and display racks, built as numpy arrays and written
+# into meshes with foreach_set. Every stage piece is two objects: a low poly proxy that is seen in the
+# viewport (and not rendered), and a finer render mesh parented to it (rendered, but hidden in the
+# viewport). Meshes are named after a hash of what built them, so two pedestals of the same size share
+# one mesh, and asking for it again is a lookup instead of a rebuild.
+#
+# The shapes are made from three building blocks:
+# - sweep: a 2D profile pulled along a straight line (cyclorama, risers, and with the axes turned, prisms).
+# - prism: a flat outline pulled up along Z (square pedestals, rack shelves and posts).
+# - lathe: a 2D profile turned around Z (round pedestals).
+# Mesh arrays are (verts, faces): verts is (N, 3), faces a list of (index array (k, n), smooth flags (k,)).
+
+
+StageVersion = 1
+
+# How fine each level of detail is: segments per rounded corner / cove, pieces per straight run,
+# and segments around for round things.
+StageLODs = {
+    'PROXY': {'arc': 3, 'span': 1, 'around': 24},
+    'RENDER': {'arc': 16, 'span': 6, 'around': 96},
+}
+
+StageItems = [('CYC', "Cyclorama", "Floor curving up into a back wall, for a seamless background"),
+              ('PED_ROUND', "Round Pedestal", "A cylinder with a rounded top edge"),
+              ('PED_SQUARE', "Square Pedestal", "A box with rounded corners"),
+              ('RISER', "Risers", "Steps going up towards the back"),
+              ('RACK', "Display Rack", "Shelves on four posts")]
+
+StageNames = {key: name for key, name, desc in StageItems}
+
+# Mesh datablocks made by the generator, by hash. Removed meshes are noticed and made again.
+StageMeshes = {}
+
+
+def line_points(a, b, spans):
+    return np.linspace(a, b, spans + 1)
+
+
+def arc_points(center, radius, start, end, segments):
+    t = np.linspace(start, end, segments + 1)
+    return np.column_stack((center[0] + radius * np.cos(t), center[1] + radius * np.sin(t)))
+
+
+# Joins profile pieces, each (points, curved), into one (points, curved per segment).
+# Pieces follow each other, so the first point of every piece after the first is dropped.
+def join_profile(pieces, closed=False):
+    points = [pieces[0][0]]
+    curved = []
+    for i, (piece, is_curved) in enumerate(pieces):
+        if i:
+            points.append(piece[1:])
+        curved.append(np.full(len(piece) - 1, is_curved))
+    if closed:
+        curved.append([False])
+    return np.concatenate(points), np.concatenate(curved).astype(bool)
+
+
+# A profile (P, 2) pulled along positions (S,). The profile gives the 2nd and 3rd coordinates, positions
+# the 1st. Closed profiles wrap around, and with caps get an n-gon at both ends.
+def sweep_arrays(profile, curved, positions, closed=False, caps=False):
+    P = len(profile)
+    S = len(positions)
+    verts = np.empty((S, P, 3))
+    verts[..., 0] = positions[:, None]
+    verts[..., 1:] = profile[None, :, :]
+    
+    i, j = np.meshgrid(np.arange(S - 1), np.arange(P if closed else P - 1), indexing='ij')
+    a = i * P + j
+    b = i * P + (j + 1) % P
+    quads = np.stack([a, b, b + P, a + P], axis=-1).reshape(-1, 4)
+    faces = [(quads, np.broadcast_to(curved[None, :], i.shape).ravel())]
+    
+    if caps:
+        ring = np.arange(P)
+        faces.append((ring[::-1][None, :], np.zeros(1, dtype=bool)))
+        faces.append((((S - 1) * P + ring)[None, :], np.zeros(1, dtype=bool)))
+    return verts.reshape(-1, 3), faces
+
+
+# An outline in XY (closed, counter clockwise) pulled up from z0 to z1, capped at both ends.
+def prism_arrays(outline, curved, z0, z1, spans=1):
+    verts, faces = sweep_arrays(outline, curved, line_points(z0, z1, spans), closed=True, caps=True)
+    # Turning (z, x, y) into (x, y, z) is a rotation, so the faces keep pointing outwards.
+    return verts[:, [1, 2, 0]], faces
+
+
+# A profile of (radius, z) points turned around Z, smooth all the way around. The first and last rings are capped.
+def lathe_arrays(profile, curved, around):
+    P = len(profile)
+    t = np.linspace(0, 2 * np.pi, around, endpoint=False)
+    verts = np.empty((around, P, 3))
+    verts[..., 0] = np.cos(t)[:, None] * profile[None, :, 0]
+    verts[..., 1] = np.sin(t)[:, None] * profile[None, :, 0]
+    verts[..., 2] = profile[None, :, 1]
+    
+    i, j = np.meshgrid(np.arange(around), np.arange(P - 1), indexing='ij')
+    a = i * P + j
+    c = ((i + 1) % around) * P + j
+    quads = np.stack([a, c, c + 1, a + 1], axis=-1).reshape(-1, 4)
+    faces = [(quads, np.ones(len(quads), dtype=bool))]
+    
+    ring = np.arange(around) * P
+    faces.append((ring[::-1][None, :], np.zeros(1, dtype=bool)))
+    faces.append((ring[None, :] + P - 1, np.zeros(1, dtype=bool)))
+    return verts.reshape(-1, 3), faces
+
+
+# A rectangle (w by d, centered) with rounded corners, counter clockwise, as (points, curved).
+def rounded_rect(w, d, radius, segments):
+    radius = min(radius, w / 2, d / 2)
+    if radius <= 0:
+        points = np.array([(-w / 2, -d / 2), (w / 2, -d / 2), (w / 2, d / 2), (-w / 2, d / 2)])
+        return points, np.zeros(4, dtype=bool)
+    
+    x = w / 2 - radius
+    y = d / 2 - radius
+    corners = [((x, -y), -np.pi / 2), ((x, y), 0), ((-x, y), np.pi / 2), ((-x, -y), np.pi)]
+    pieces = []
+    for k, (center, start) in enumerate(corners):
+        arc = arc_points(center, radius, start, start + np.pi / 2, segments)
+        if k:
+            # The straight edge from the previous corner to this one.
+            pieces.append((np.stack([pieces[-1][0][-1], arc[0]]), False))
+        pieces.append((arc, True))
+    return join_profile(pieces, closed=True)
+
+
+# Puts several mesh arrays together into one, with the indices moved along.
+def merge_arrays(parts):
+    verts = []
+    faces = []
+    offset = 0
+    for part_verts, part_faces in parts:
+        verts.append(part_verts)
+        faces.extend((index + offset, smooth) for index, smooth in part_faces)
+        offset += len(part_verts)
+    return np.concatenate(verts), faces
+
+
+def moved(arrays, offset):
+    return arrays[0] + np.asarray(offset, dtype=float), arrays[1]
+
+
+# Turns every face around, so it points the other way.
+def flipped(arrays):
+    return arrays[0], [(index[:, ::-1], smooth) for index, smooth in arrays[1]]
+
+
+# Floor in front (-Y), a cove of radius 'cove' at the back, and a wall going up to 'height'.
+def build_cyc(params, lod):
+    w, d, h = params['width'], params['depth'], params['height']
+    r = max(min(params['cove'], h, d), 1e-3)
+    back = d / 2
+    profile, curved = join_profile([
+        (line_points((-d / 2, 0), (back - r, 0), lod['span']), False),
+        (arc_points((back - r, r), r, -np.pi / 2, 0, lod['arc']), True),
+        (line_points((back, r), (back, h), lod['span']), False),
+    ])
+    # Faces point up off the floor and forward off the wall, towards the subject.
+    return flipped(sweep_arrays(profile, curved, line_points(-w / 2, w / 2, lod['span'])))
+
 
+def build_ped_round(params, lod):
+    radius, h = params['width'] / 2, params['height']
+    b = min(params['bevel'], radius, h)
+    pieces = [(line_points((radius, 0), (radius, h - b), lod['span']), False)]
+    if b > 0:
+        pieces.append((arc_points((radius - b, h - b), b, 0, np.pi / 2, lod['arc']), True))
+    profile, curved = join_profile(pieces)
+    return lathe_arrays(profile, curved, lod['around'])
+
+
+def build_ped_square(params, lod):
+    outline, curved = rounded_rect(params['width'], params['depth'], params['bevel'], lod['arc'])
+    return prism_arrays(outline, curved, 0, params['height'], lod['span'])
+
+
+# Steps climbing from the front (-Y) to the back, each 'height / steps' high.
+def build_riser(params, lod):
+    w, d, h, n = params['width'], params['depth'], params['height'], params['steps']
+    points = [(-d / 2, 0), (d / 2, 0), (d / 2, h)]
+    for i in range(n, 0, -1):
+        front = -d / 2 + (i - 1) * d / n
+        points.append((front, i * h / n))
+        if i > 1:
+            points.append((front, (i - 1) * h / n))
+    profile = np.array(points, dtype=float)
+    return sweep_arrays(profile, np.zeros(len(profile), dtype=bool), line_points(-w / 2, w / 2, lod['span']),
+                        closed=True, caps=True)
+
+
+# 'steps' shelves between four corner posts.
+def build_rack(params, lod):
+    w, d, h, n = params['width'], params['depth'], params['height'], params['steps']
+    post = min(0.04, w / 4, d / 4)
+    thick = min(0.025, h / (4 * n))
+    bevel = min(params['bevel'], thick / 2)
+    parts = []
+    
+    outline, curved = rounded_rect(post, post, min(params['bevel'], post / 2), lod['arc'])
+    for x in (-1, 1):
+        for y in (-1, 1):
+            parts.append(moved(prism_arrays(outline, curved, 0, h), ((w - post) / 2 * x, (d - post) / 2 * y, 0)))
+    
+    outline, curved = rounded_rect(w, d, bevel, lod['arc'])
+    for z in np.linspace(h / (n + 1) if n > 1 else h / 2, h - thick, n):
+        parts.append(prism_arrays(outline, curved, z, z + thick))
+    return merge_arrays(parts)
+
+
+StageBuilders = {'CYC': build_cyc, 'PED_ROUND': build_ped_round, 'PED_SQUARE': build_ped_square,
+                 'RISER': build_riser, 'RACK': build_rack}
+
+# The settings each kind uses, so pieces that only differ in a setting they don't use still share a mesh.
+StageParams = {'CYC': ('width', 'depth', 'height', 'cove'), 'PED_ROUND': ('width', 'height', 'bevel'),
+               'PED_SQUARE': ('width', 'depth', 'height', 'bevel'), 'RISER': ('width', 'depth', 'height', 'steps'),
+               'RACK': ('width', 'depth', 'height', 'bevel', 'steps')}
+
+
+# Writes mesh arrays into a new mesh. Faces of any size, all with foreach_set.
+def mesh_from_arrays(name, verts, faces):
+    loops = np.concatenate([index.ravel() for index, smooth in faces]).astype(np.int32)
+    totals = np.concatenate([np.full(len(index), index.shape[1]) for index, smooth in faces]).astype(np.int32)
+    smooth = np.concatenate([smooth for index, smooth in faces]).astype(bool)
+    
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", verts.astype(np.float32).ravel())
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", loops)
+    mesh.polygons.add(len(totals))
+    mesh.polygons.foreach_set("loop_start", (np.cumsum(totals) - totals).astype(np.int32))
+    # Older Blenders want the size of every face too, newer ones work it out from the starts.
+    if not mesh.polygons.bl_rna.properties['loop_total'].is_readonly:
+        mesh.polygons.foreach_set("loop_total", totals)
+    mesh.polygons.foreach_set("use_smooth", smooth)
+    mesh.update(calc_edges = True)
+    return mesh
+
+
+def stage_hash(kind, params, lod):
+    key = json.dumps([StageVersion, kind, lod, StageLODs[lod], {p: params[p] for p in StageParams[kind]}], sort_keys = True)
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+# The mesh of a stage piece at a level of detail, made only if no mesh with the same hash exists.
+def stage_mesh(kind, params, lod):
+    h = stage_hash(kind, params, lod)
+    mesh = StageMeshes.get(h)
+    try:
+        mesh = mesh if mesh is not None and mesh.get("qs_stage_hash") == h else None
+    except ReferenceError:
+        # Removed since (undo, or purged).
+        mesh = None
+    
+    name = "QS " + StageNames[kind] + " " + h[:8] + " " + lod.lower()
+    if mesh is None:
+        mesh = bpy.data.meshes.get(name)
+        if mesh is not None and mesh.get("qs_stage_hash") != h:
+            mesh = None
+    if mesh is None:
+        verts, faces = StageBuilders[kind](params, StageLODs[lod])
+        mesh = mesh_from_arrays(name, verts, faces)
+        mesh["qs_stage_hash"] = h
+    StageMeshes[h] = mesh
+    return mesh
+
+
+# Makes a stage piece: the proxy (root) and its render mesh. Returns the proxy and both objects.
+def spawn_stage(kind, params, collection, view_layer=None, location=(0, 0, 0)):
+    proxy = bpy.data.objects.new(StageNames[kind], stage_mesh(kind, params, 'PROXY'))
+    proxy.location = location
+    proxy.hide_render = True
+    proxy["qs_role"] = "proxy"
+    
+    render = bpy.data.objects.new(StageNames[kind] + " Render", stage_mesh(kind, params, 'RENDER'))
+    render.parent = proxy
+    render.hide_viewport = True
+    render.hide_select = True
+    render["qs_role"] = "render"
+    
+    link_objects([proxy, render], collection, view_layer)
+    return proxy, [proxy, render]
+
+
+def stage_params(QSData, kind):
+    if kind == 'CYC':
+        return {'width': QSData.CycWidth, 'depth': QSData.CycDepth, 'height': QSData.CycHeight, 'cove': QSData.CycCove}
+    return {'width': QSData.StageWidth, 'depth': QSData.StageDepth, 'height': QSData.StageHeight,
+            'bevel': QSData.StageBevel, 'steps': QSData.StageSteps}
+
+
+# ======================================================
+# Preset thumbnails. The Light Setup panel shows a picture of every light preset, rendered once on
+# a reference subject (a bust on a cyclorama) by a background Blender, so the UI never waits on it.
+# Thumbnails are PNGs in Blender's config folder, named after the preset's key and a hash of its
+# definition and the add-on version: a changed preset gets a new picture, the old one just stops
+# being used. The folder is kept under ThumbCacheLimit by throwing out the least recently used files.
+# Nothing happens at registration: the first time the panel draws, a timer loads what's on disk
+# (Blender reads the images when the icons are first shown) and renders what's missing.
+
+
+ThumbVersion = 1
+ThumbSize = 128
+ThumbCacheLimit = 16 * 1024 * 1024
+ThumbPoll = 0.5
+
+# previews: the bpy.utils.previews collection, stamp: the preset folders' state the icons were made for,
+# proc: the background Blender (process, log) rendering 'rendering', failed: keys that didn't render.
+ThumbState = {'previews': None, 'stamp': None, 'proc': None, 'rendering': [], 'failed': set()}
+
+# MakeLight items with icons. Like PresetItems, Blender needs the list to stay around.
+ThumbItems = []
+
+
+def thumb_folder():
+    return os.path.join(config_dir(), "thumbnails")
+
+
+def thumb_hash(key):
+    h = hashlib.sha1(repr((ThumbVersion, bl_info['version'], key)).encode())
+    h.update(json.dumps(light_preset(key), sort_keys = True).encode())
+    return h.hexdigest()[:12]
+
+
+def thumb_path(key):
+    return os.path.join(thumb_folder(), key + "_" + thumb_hash(key) + ".png")
+
+
+# Throws out the least recently used files (by modification time, using a file touches it) of a cache
+# folder until the folder fits in limit bytes. Files in keep are never thrown out.
+def cache_evict(folder, keep, limit, extension):
+    if not os.path.isdir(folder):
+        return []
+    files = [(os.stat(os.path.join(folder, f)), os.path.join(folder, f)) for f in os.listdir(folder) if f.endswith(extension)]
+    total = sum(stat.st_size for stat, path in files)
+    removed = []
+    for stat, path in sorted(files, key = lambda f: f[0].st_mtime):
+        if total <= limit:
+            break
+        if path in keep:
+            continue
+        os.remove(path)
+        total -= stat.st_size
+        removed.append(path)
+    return removed
+
+
+# The reference subject (a bust on a cyclorama) and a camera looking at it from the front (-Y).
+def thumb_stage(scene, collection):
+    head = lathe_arrays(arc_points((0, 1.62), 0.12, -0.48 * np.pi, 0.48 * np.pi, 12), np.ones(12, dtype=bool), 24)
+    body = np.array([(0.16, 0.0), (0.18, 0.9), (0.22, 1.3), (0.06, 1.44), (0.05, 1.52)])
+    bust = merge_arrays([lathe_arrays(body, np.ones(len(body) - 1, dtype=bool), 24), head])
+    cyc = build_cyc({'width': 8, 'depth': 6, 'height': 4, 'cove': 1.5}, StageLODs['RENDER'])
+    
+    objects = [bpy.data.objects.new("QS Thumb Bust", mesh_from_arrays("QS Thumb Bust", *bust)),
+               bpy.data.objects.new("QS Thumb Cyc", mesh_from_arrays("QS Thumb Cyc", *cyc))]
+    cam = bpy.data.objects.new("QS Thumb Cam", bpy.data.cameras.new("QS Thumb Cam"))
+    cam.location = (0, -5, 1.3)
+    cam.rotation_euler = aim_rotations(np.array([cam.location]), (0, 0, 1.0))[0]
+    cam.data.lens = 60
+    link_objects(objects + [cam], collection)
+    scene.camera = cam
+
+
+# Renders the thumbnails of the given presets (see thumb_path), in a scene of their own.
+# Meant for a background Blender. Returns the paths written.
+def render_thumbnails(keys):
+    scene = bpy.data.scenes.new("QS Thumbnails")
+    scene.render.engine = 'CYCLES'
+    scene.cycles.samples = 32
+    scene.render.resolution_x = scene.render.resolution_y = ThumbSize
+    scene.render.resolution_percentage = 100
+    scene.render.image_settings.file_format = 'PNG'
+    scene.render.use_file_extension = False
+    scene.world = bpy.data.worlds.new("QS Thumbnails")
+    scene.world.color = (0.02, 0.02, 0.02)
+    thumb_stage(scene, scene.collection)
+    
+    os.makedirs(thumb_folder(), exist_ok = True)
+    written = {}
+    for key in keys:
+        litbase, made = spawn_light_preset(key, scene.collection)
+        path = thumb_path(key)
+        # Written under another name first, so a half written file is never taken for a thumbnail.
+        scene.render.filepath = path + ".part"
+        bpy.ops.render.render(write_still = True, scene = scene.name)
+        os.replace(path + ".part", path)
+        written[key] = path
+        data = [ob.data for ob in made if ob.data is not None]
+        bpy.data.batch_remove(made)
+        bpy.data.batch_remove([d for d in data if d.users == 0])
+    return written
+
+
+# MakeLight's items: with icons once thumb_update made them for the current presets.
+def preset_icon_items():
+    return ThumbItems if ThumbItems and ThumbState['stamp'] == PresetWatch['stamp'] else PresetItems
+
+
+# Called from the panel's draw. Only starts the timer, drawing has to stay quick.
+def thumb_request():
+    if ThumbState['stamp'] != PresetWatch['stamp'] and not bpy.app.timers.is_registered(thumb_update):
+        bpy.app.timers.register(thumb_update, first_interval = 0)
+
+
+# Timer: loads the thumbnails that are on disk, starts a background Blender for the missing ones
+# and checks on it until it's done. Presets that fail to render aren't tried again until the presets change.
+def thumb_update():
+    proc = ThumbState['proc']
+    if proc is not None:
+        if proc[0].poll() is None:
+            return ThumbPoll
+        ThumbState['proc'] = None
+        ThumbState['failed'].update(key for key in ThumbState['rendering'] if not os.path.isfile(thumb_path(key)))
+    
+    if ThumbState['stamp'] != PresetWatch['stamp']:
+        ThumbState['failed'].clear()
+    ThumbState['stamp'] = PresetWatch['stamp']
+    pcoll = ThumbState['previews']
+    if pcoll is None:
+        pcoll = ThumbState['previews'] = bpy.utils.previews.new()
+    
+    paths = {}
+    missing = []
+    for key, name, desc, number in PresetItems:
+        try:
+            paths[key] = thumb_path(key)
+        except (KeyError, OSError, ValueError):
+            # A preset file that went away or broke since the last scan.
+            continue
+        if paths[key] not in pcoll and os.path.isfile(paths[key]):
+            pcoll.load(paths[key], paths[key], 'IMAGE')
+            # Used now, so it's the last to go.
+            os.utime(paths[key])
+        if paths[key] not in pcoll and key not in ThumbState['failed']:
+            missing.append(key)
+    
+    ThumbItems[:] = [(key, name, desc, pcoll[paths[key]].icon_id if paths.get(key) in pcoll else 'LIGHT', number)
+                     for key, name, desc, number in PresetItems]
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+    
+    if missing:
+        ThumbState['rendering'] = missing
+        try:
+            ThumbState['proc'] = launch_blenders(None, [["--thumbnails"] + missing], max(1, (os.cpu_count() or 1) // 2), "quickstage_thumbs_")[0]
+        except OSError:
+            ThumbState['failed'].update(missing)
+            return None
+        return ThumbPoll
+    cache_evict(thumb_folder(), set(paths.values()), ThumbCacheLimit, ".png")
+    return None
+
+
+def thumb_release():
+    if bpy.app.timers.is_registered(thumb_update):
+        bpy.app.timers.unregister(thumb_update)
+    if ThumbState['proc'] is not None:
+        ThumbState['proc'][0].terminate()
+        ThumbState['proc'] = None
+    if ThumbState['previews'] is not None:
+        bpy.utils.previews.remove(ThumbState['previews'])
+        ThumbState['previews'] = None
+    ThumbState['stamp'] = None
+    ThumbItems.clear()
+
+
+# ======================================================
+# HDRI worlds. An environment texture world tied to a Set Base: drivers turn the HDRI with the base
+# (plus the rig's HDRI Rotation) and take its strength from the rig's HDRI Strength, so the HDRI and
+# the lights of a setup turn together.
+# A 16k EXR makes look-dev in the viewport crawl, so the world uses a proxy: the HDRI averaged down
+# to 1k or 2k wide with numpy, made once and kept in Blender's config folder. Proxies are named after
+# a hash of the HDRI file's content (the hash is remembered per path, size and date, so a file is only
+# read through once), and the folder is kept under HdriCacheLimit, least recently used first.
+# The full resolution file is only swapped in while a Final quality render runs.
+
+
+HdriCacheLimit = 512 * 1024 * 1024
+HdriNodes = {'coords': "QS HDRI Coords", 'mapping': "QS HDRI Mapping", 'image': "QS HDRI", 'background': "QS HDRI Background"}
+
+# Content hashes by (path, modification time, size), also saved to the index file in the cache folder.
+HdriHashes = {}
+
+
+def hdri_folder():
+    return os.path.join(config_dir(), "hdri")
+
+
+def hdri_index_path():
+    return os.path.join(hdri_folder(), "index.json")
+
+
+# Hash of an HDRI file's content. Read in chunks, a 16k EXR doesn't fit in memory twice.
+def hdri_hash(path):
+    stat = os.stat(path)
+    key = repr((path, stat.st_mtime, stat.st_size))
+    if not HdriHashes:
+        try:
+            with open(hdri_index_path(), encoding = "utf-8") as f:
+                HdriHashes.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+    if key not in HdriHashes:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        HdriHashes[key] = h.hexdigest()[:16]
+        os.makedirs(hdri_folder(), exist_ok = True)
+        with open(hdri_index_path(), "w", encoding = "utf-8") as f:
+            json.dump(HdriHashes, f, indent = 1)
+    return HdriHashes[key]
+
+
+def hdri_proxy_path(digest, size):
+    return os.path.join(hdri_folder(), digest + "_" + size + ".exr")
+
+
+# Saves (height, width, 4) linear pixels as a float EXR.
+def save_exr(pixels, path):
+    h, w = pixels.shape[:2]
+    img = bpy.data.images.new("QS EXR", w, h, alpha = True, float_buffer = True)
+    img.pixels.foreach_set(pixels.astype(np.float32).ravel())
+    img.filepath_raw = path
+    img.file_format = 'OPEN_EXR'
+    img.save()
+    bpy.data.images.remove(img)
+
+
+# Makes sure every proxy size of an HDRI is in the cache. The HDRI is read once for all of them,
+# biggest proxy first, each smaller one averaged down from the one before. Returns {size: path}.
+def hdri_proxies(path):
+    digest = hdri_hash(path)
+    sizes = sorted((size for size, name, desc in HdriProxySizes), key = int, reverse = True)
+    proxies = {size: hdri_proxy_path(digest, size) for size in sizes}
+    missing = [size for size in sizes if not os.path.isfile(proxies[size])]
+    if missing:
+        pixels = read_image_pixels(path)
+        for size in sizes:
+            pixels = downsample(pixels, int(size))
+            if size in missing:
+                # Written under another name first, so a half written file is never taken for a proxy.
+                save_exr(pixels, proxies[size] + ".part")
+                os.replace(proxies[size] + ".part", proxies[size])
+        cache_evict(hdri_folder(), set(proxies.values()), HdriCacheLimit, ".exr")
+    for proxy in proxies.values():
+        os.utime(proxy)
+    return proxies
+
+
+# An image datablock for a file, reused if it's already loaded. reload when the file was written again.
+def hdri_image(path, reload = False):
+    for img in bpy.data.images:
+        if img.library is None and os.path.normpath(bpy.path.abspath(img.filepath)) == os.path.normpath(path):
+            if reload:
+                img.reload()
+            return img
+    return bpy.data.images.load(path)
+
+
+# The environment texture node of a Quick Stage HDRI world, or None.
+def hdri_node(world):
+    if world is None or "qs_hdri" not in world or world.node_tree is None:
+        return None
+    return world.node_tree.nodes.get(HdriNodes['image'])
+
+
+# A driver on a world node input, reading the Set Base. variables are (name, type, transform or data path).
+def hdri_driver(tree, path, index, expression, base, variables):
+    fcurve = tree.driver_add(path, index) if index is not None else tree.driver_add(path)
+    driver = fcurve.driver
+    driver.type = 'SCRIPTED'
+    driver.expression = expression
+    for name, kind, what in variables:
+        var = driver.variables.new()
+        var.name = name
+        var.type = kind
+        target = var.targets[0]
+        if kind == 'TRANSFORMS':
+            target.id = base
+            target.transform_type = what
+            target.transform_space = 'WORLD_SPACE'
+        else:
+            target.id_type = 'OBJECT'
+            target.id = base
+            target.data_path = what
+    return fcurve
+
+
+# Makes the HDRI world, tied to base, and makes it the scene's world. Uses the proxy of the given size.
+def hdri_world(scene, base, path, size):
+    proxies = hdri_proxies(path)
+    world = bpy.data.worlds.new("QS HDRI " + bpy.path.display_name_from_filepath(path))
+    world.use_nodes = True
+    tree = world.node_tree
+    tree.nodes.clear()
+    
+    coords = tree.nodes.new('ShaderNodeTexCoord')
+    mapping = tree.nodes.new('ShaderNodeMapping')
+    env = tree.nodes.new('ShaderNodeTexEnvironment')
+    background = tree.nodes.new('ShaderNodeBackground')
+    output = tree.nodes.new('ShaderNodeOutputWorld')
+    for x, (node, name) in enumerate(((coords, HdriNodes['coords']), (mapping, HdriNodes['mapping']), (env, HdriNodes['image']),
+                                      (background, HdriNodes['background']), (output, "QS HDRI Output"))):
+        node.name = node.label = name
+        node.location = (x * 250, 0)
+    tree.links.new(coords.outputs['Generated'], mapping.inputs['Vector'])
+    tree.links.new(mapping.outputs['Vector'], env.inputs['Vector'])
+    tree.links.new(env.outputs['Color'], background.inputs['Color'])
+    tree.links.new(background.outputs['Background'], output.inputs['Surface'])
+    env.image = hdri_image(proxies[size])
+    
+    # Turning the lookup by -angle turns the picture by angle, the same way the base turns.
+    hdri_driver(tree, 'nodes["' + HdriNodes['mapping'] + '"].inputs[2].default_value', 2, "-rot - offset", base,
+                [("rot", 'TRANSFORMS', 'ROT_Z'), ("offset", 'SINGLE_PROP', "QSRigParams.HdriRotation")])
+    hdri_driver(tree, 'nodes["' + HdriNodes['background'] + '"].inputs[1].default_value', None, "strength", base,
+                [("strength", 'SINGLE_PROP', "QSRigParams.HdriStrength")])
+    
+    world["qs_hdri"] = path
+    base["qs_world"] = world.name
+    scene.world = world
+    return world
+
+
+# Puts the full resolution HDRI (full=True) or the chosen proxy into the scene's HDRI world.
+# A proxy thrown out of the cache since is made again. Returns False when there's nothing to swap.
+def hdri_swap(scene, full):
+    node = hdri_node(scene.world)
+    if node is None or not os.path.isfile(scene.world["qs_hdri"]):
+        return False
+    path = scene.world["qs_hdri"]
+    if full:
+        img = hdri_image(path)
+    else:
+        proxy = hdri_proxy_path(hdri_hash(path), scene.QSProp.HdriProxy)
+        made = not os.path.isfile(proxy)
+        img = hdri_image(hdri_proxies(path)[scene.QSProp.HdriProxy], reload = made)
+    if node.image != img:
+        old = node.image
+        node.image = img
+        if not full and old is not None:
+            # The full resolution pixels can leave memory now.
+            old.buffers_free()
+    return True
+
+
+# Final renders use the full file. The add-on's own renders (the render queue and tiled renders, from the
+# panel or the command line) swap it in right before they start and back afterwards, going by the tier
+# apply_quality last set. Not from a render handler: the render may already be reading the image by then.
+def hdri_render_begin(scene):
+    return scene.get("qs_tier") == 'FINAL' and hdri_swap(scene, True)
+
+
+def hdri_render_end(scene, swapped):
+    if swapped:
+        hdri_swap(scene, False)
+
+
+# Files saved in the middle of a final render, or whose proxy left the cache, are put right on load.
+@bpy.app.handlers.persistent
+def hdri_load_post(*args):
+    for scene in bpy.data.scenes:
+        hdri_swap(scene, False)
+
+
+# ======================================================
+# Render queue. Each job (QSRenderJob) is a camera, a frame range, a size and an output path.
+# The queue is rendered by one or more background Blenders ("workers"). Every worker opens the file
+# once and renders its share of the jobs one after another with persistent data turned on,
+# so the scene isn't rebuilt for every camera. Frames that are already on disk are skipped,
+# which makes an interrupted queue pick up where it left off.
+
+
+# Where a frame of a job ends up on disk, named the same way Blender names it.
+# base_dir is what '//' means, for when the file being rendered is a temporary copy.
+def job_frame_path(scene, job, frame, base_dir=None):
+    scene.render.filepath = bpy.path.abspath(job.Output, start=base_dir)
+    return scene.render.frame_path(frame=frame)
+
+
+# The frames of a job that still have to be rendered. Empty files don't count as done.
+def job_frames_left(scene, job, base_dir=None):
+    left = []
+    for frame in range(job.FrameStart, job.FrameEnd + 1):
+        path = job_frame_path(scene, job, frame, base_dir)
+        if not (os.path.isfile(path) and os.path.getsize(path) > 0):
+            left.append(frame)
+    return left
+
+
+# Shares out jobs between workers, biggest jobs first, each to the worker with the least work so far.
+# Every worker runs this with the same input, so they all agree on the plan without talking to each other.
+# Returns one list of job indices per worker.
+def split_jobs(loads, workers):
+    plan = [[] for w in range(workers)]
+    totals = [0] * workers
+    for index in sorted(range(len(loads)), key=lambda i: -loads[i]):
+        w = totals.index(min(totals))
+        plan[w].append(index)
+        totals[w] += loads[index]
+    return [sorted(p) for p in plan]
+
+
+# The jobs that will actually render: enabled and with a camera.
+def queue_jobs(scene):
+    return [job for job in scene.QSProp.RendJobs if job.Enabled and job.Camera is not None]
+
+
+# Renders one job frame by frame, skipping finished frames.
+def render_job(scene, job, base_dir=None):
+    apply_render_size(scene.render, job.ScrRat, job.ScrReso)
+    scene.camera = job.Camera
+    
+    frames = job_frames_left(scene, job, base_dir)
+    for frame in frames:
+        scene.frame_set(frame)
+        job_frame_path(scene, job, frame, base_dir)
+        bpy.ops.render.render(write_still=True)
+    
+    return {'camera': job.Camera.name, 'rendered': len(frames),
+            'skipped': job.FrameEnd - job.FrameStart + 1 - len(frames)}
+
+
+# Renders this worker's share of the queue, in the current Blender.
+# With Multiview on, jobs that can share a render are shared out (and rendered) as one.
+def render_queue_worker(scene, worker=0, workers=1, base_dir=None):
+    jobs = queue_jobs(scene)
+    groups = multiview_groups(jobs) if scene.QSProp.RendMultiview else [[job] for job in jobs]
+    plan = split_jobs([(group[0].FrameEnd - group[0].FrameStart + 1) * len(group) for group in groups], workers)
+    
+    # Keep the render data (BVH, textures, etc) around between renders. Cycles only, others just ignore it.
+    scene.render.use_persistent_data = True
+    results = []
+    swapped = hdri_render_begin(scene)
+    try:
+        for index in plan[worker]:
+            if len(groups[index]) > 1:
+                results += render_views(scene, groups[index], base_dir)
+            else:
+                results.append(render_job(scene, groups[index][0], base_dir))
+    finally:
+        hdri_render_end(scene, swapped)
+    return results
+
+
+# Starts the background Blenders for a queue. Their output goes to log files rather than pipes,
+# so a chatty render can never block on a full pipe. Returns a list of (process, log path).
+def launch_render_workers(blend_path, workers, base_dir, threads=0, multiview=False):
+    return launch_blenders(blend_path, [["--render-queue", "--worker", str(w), "--workers", str(workers), "--base-dir", base_dir]
+                                        + (["--multiview"] if multiview else []) for w in range(workers)], threads, "quickstage_queue_")
+
+
+# Starts one background Blender on blend_path per list of arguments (for run_cli), each with its
+# share of the CPU threads unless threads is given. Without a blend_path they start from factory settings.
+# Returns a list of (process, log path).
+def launch_blenders(blend_path, arg_lists, threads=0, prefix="quickstage_"):
+    logdir = tempfile.mkdtemp(prefix=prefix)
+    if not threads:
+        threads = max(1, (os.cpu_count() or 1) // max(1, len(arg_lists)))
+    
+    procs = []
+    for w, args in enumerate(arg_lists):
+        log = os.path.join(logdir, "worker" + str(w) + ".log")
+        cmd = ([bpy.app.binary_path, "-b"] + ([blend_path] if blend_path else ["--factory-startup"])
+               + ["-t", str(threads), "-P", os.path.abspath(__file__), "--"] + list(args))
+        with open(log, "w") as f:
+            procs.append((subprocess.Popen(cmd, stdout=f, stderr=subprocess.STDOUT), log))
+    return procs
+
+
+# Picks the result lines (see CLI_TAG) out of a worker's log.
+def read_worker_results(log):
+    results = []
+    with open(log) as f:
+        for line in f:
+            if line.startswith(CLI_TAG):
+                results.append(json.loads(line[len(CLI_TAG):]))
+    return results
+
+
+# Saves what the workers should render. The open file might have unsaved changes, so a copy goes to
+# the temp folder, and '//' paths are pointed back to where the real file lives.
+def save_queue_copy():
+    base_dir = os.path.dirname(bpy.data.filepath) or tempfile.gettempdir()
+    path = os.path.join(tempfile.gettempdir(), "quickstage_queue_" + str(os.getpid()) + ".blend")
+    bpy.ops.wm.save_as_mainfile(filepath=path, copy=True)
+    return path, base_dir
+
+
+# ======================================================
+# Multiview rendering. Rendering the same frames from five cameras as five jobs loads the scene
+# five times: BVH, textures, shaders. Blender's multiview can render several views of one scene in
+# a single render instead, the scene is synced once and only the camera changes between views.
+# A custom view picks its camera by name: the scene camera's name minus its view suffix, plus the
+# suffix of the view. So for the render the cameras are renamed to MultiviewPrefix + suffix, one view
+# per camera, and the images (one file per view) are moved to each job's own output afterwards.
+# Names, views and settings are put back when it's done, also when the render fails.
+
+
+MultiviewPrefix = "QS Multiview"
+
+
+# Jobs that can be one render: same frames and the same size. A camera can only be one view,
+# so a second job on the same camera starts a group of its own.
+def multiview_groups(jobs):
+    groups = []
+    for job in jobs:
+        key = (job.FrameStart, job.FrameEnd, job.ScrRat, job.ScrReso)
+        for group in groups:
+            if group[0] == key and all(j.Camera != job.Camera for j in group[1]):
+                group[1].append(job)
+                break
+        else:
+            groups.append((key, [job]))
+    return [jobs for key, jobs in groups]
+
+
+# Switches the scene to custom multiview with one view per camera. Returns what it needs to undo it,
+# and the view name of every camera.
+def multiview_setup(scene, cameras):
+    render = scene.render
+    state = {'multiview': render.use_multiview, 'format': render.views_format, 'image_format': render.image_settings.views_format,
+             'camera': scene.camera, 'use': [(view, view.use) for view in render.views], 'views': [], 'names': []}
+    render.use_multiview = True
+    render.views_format = 'MULTIVIEW'
+    render.image_settings.views_format = 'INDIVIDUAL'
+    for view in render.views:
+        view.use = False
+    
+    names = []
+    for n, cam in enumerate(cameras):
+        view = render.views.new("QS View " + str(n + 1).zfill(2))
+        view.camera_suffix = "_" + str(n + 1).zfill(2)
+        view.use = True
+        state['views'].append(view.name)
+        state['names'].append((cam, cam.name))
+        cam.name = MultiviewPrefix + view.camera_suffix
+        if cam.name != MultiviewPrefix + view.camera_suffix:
+            raise RuntimeError("an object called " + MultiviewPrefix + view.camera_suffix + " is in the way of the multiview cameras")
+        names.append(view.name)
+    scene.camera = cameras[0]
+    return state, names
+
+
+# Puts back what multiview_setup changed.
+def multiview_restore(scene, state):
+    render = scene.render
+    for cam, name in state['names']:
+        cam.name = name
+    for name in state['views']:
+        view = render.views.get(name)
+        if view is not None:
+            render.views.remove(view)
+    for view, use in state['use']:
+        view.use = use
+    render.use_multiview = state['multiview']
+    render.views_format = state['format']
+    render.image_settings.views_format = state['image_format']
+    scene.camera = state['camera']
+
+
+# Renders a group of jobs (see multiview_groups) as one multiview render, frame by frame.
+# A frame is rendered when any of the jobs still misses it, and every view of it lands where its job
+# would have put it. Returns one result per job, like render_job.
+def render_views(scene, jobs, base_dir=None):
+    first = jobs[0]
+    apply_render_size(scene.render, first.ScrRat, first.ScrReso)
+    left = [set(job_frames_left(scene, job, base_dir)) for job in jobs]
+    frames = sorted(set().union(*left))
+    folder = os.path.join(os.path.dirname(job_frame_path(scene, first, first.FrameStart, base_dir)), "_multiview", "")
+    
+    state, views = multiview_setup(scene, [job.Camera for job in jobs])
+    try:
+        for frame in frames:
+            scene.frame_set(frame)
+            scene.render.filepath = folder
+            bpy.ops.render.render(write_still=True)
+            
+            # A job that already has this frame keeps its file; its view of the render is dropped.
+            renders = [scene.render.frame_path(frame=frame, view=view) for view in views]
+            for job, job_left, path in zip(jobs, left, renders):
+                if frame in job_left:
+                    target = job_frame_path(scene, job, frame, base_dir)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(path, target)
+                elif os.path.exists(path):
+                    os.remove(path)
+    finally:
+        multiview_restore(scene, state)
+        if os.path.isdir(folder) and not os.listdir(folder):
+            os.rmdir(folder)
+    
+    return [{'camera': job.Camera.name, 'rendered': len(job_left), 'skipped': job.FrameEnd - job.FrameStart + 1 - len(job_left),
+             'multiview': len(jobs)} for job, job_left in zip(jobs, left)]
+
+
+# ======================================================
+# Subject crop. When the subject only fills part of the frame, rendering the whole frame mostly
+# traces empty backdrop. With crop on, the subject's bounding box is projected through the scene
+# camera, and the render border is set around it (plus a margin): either once around where the subject
+# goes over the whole frame range, or again on every frame from a frame change handler.
+# The border isn't cropped away, and a couple of compositor nodes put the render over a flat color
+# or over a background plate (one low sample render of the whole frame), so the output keeps its size.
+
+
+CropNodes = ("QS Crop Over", "QS Crop Background", "QS Crop Scale")
+
+
+def crop_objects(scene):
+    return [t.Object for t in scene.QSProp.CropTargets if t.Object is not None]
+
+
+# The 8 world space corners of every object's (evaluated) bounding box, as an (8N, 3) array.
+def subject_corners(objects, depsgraph):
+    corners = []
+    for ob in objects:
+        ob_eval = ob.evaluated_get(depsgraph)
+        box = np.array([tuple(c) for c in ob_eval.bound_box], dtype=np.float64)
+        mat = np.array(ob_eval.matrix_world, dtype=np.float64)
+        corners.append(box @ mat[:3, :3].T + mat[:3, 3])
+    return np.concatenate(corners)
+
+
+# Where points land in the camera's frame, as a border (min x, max x, min y, max y) in 0..1,
+# grown by margin. The whole frame when a point is behind the camera, None when all are outside it.
+def project_border(scene, camera, points, margin, depsgraph):
+    render = scene.render
+    width, height = render_pixel_size(render)
+    proj = np.array(camera.calc_matrix_camera(depsgraph, x = width, y = height,
+                                              scale_x = render.pixel_aspect_x, scale_y = render.pixel_aspect_y))
+    view = np.array(camera.evaluated_get(depsgraph).matrix_world.inverted())
+    clip = np.c_[points, np.ones(len(points))] @ (proj @ view).T
+    if (clip[:, 3] <= 1e-6).any():
+        return (0.0, 1.0, 0.0, 1.0)
+    
+    ndc = clip[:, :2] / clip[:, 3:4]
+    low = np.clip((ndc.min(axis=0) + 1) / 2 - margin, 0, 1)
+    high = np.clip((ndc.max(axis=0) + 1) / 2 + margin, 0, 1)
+    if (high <= low).any():
+        return None
+    return (float(low[0]), float(high[0]), float(low[1]), float(high[1]))
+
+
+# Border of the subject on the current frame.
+def subject_border(scene, depsgraph):
+    objects = crop_objects(scene)
+    if not objects or scene.camera is None:
+        return (0.0, 1.0, 0.0, 1.0)
+    return project_border(scene, scene.camera, subject_corners(objects, depsgraph), scene.QSProp.CropMargin, depsgraph)
+
+
+# One border around the subject over the whole frame range (goes through every frame).
+def subject_border_range(scene):
+    current = scene.frame_current
+    borders = []
+    for frame in range(scene.frame_start, scene.frame_end + 1):
+        scene.frame_set(frame)
+        border = subject_border(scene, bpy.context.evaluated_depsgraph_get())
+        if border is not None:
+            borders.append(border)
+    scene.frame_set(current)
+    if not borders:
+        return None
+    b = np.array(borders)
+    return (float(b[:, 0].min()), float(b[:, 1].max()), float(b[:, 2].min()), float(b[:, 3].max()))
+
+
+# Sets the render border. An empty border (subject out of frame) becomes a single pixel.
+def set_border(render, border):
+    if border is None:
+        width, height = render_pixel_size(render)
+        border = (0.0, 1.0 / max(width, 1), 0.0, 1.0 / max(height, 1))
+    render.use_border = True
+    render.use_crop_to_border = False
+    render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y = border
+
+
+# Puts the render over the chosen background in the compositor, between whatever feeds the
+# Composite node and the node itself. With the background set to nothing, the nodes are taken out.
+def crop_compositor(scene):
+    QSData = scene.QSProp
+    mode = QSData.CropBackground if QSData.CropEnable else 'NONE'
+    if mode == 'NONE' and not scene.use_nodes:
+        return
+    scene.use_nodes = True
+    tree = scene.node_tree
+    nodes = tree.nodes
+    
+    over = nodes.get(CropNodes[0])
+    composite = next((n for n in nodes if n.type == 'COMPOSITE'), None)
+    if composite is None:
+        composite = nodes.new('CompositorNodeComposite')
+    if over is not None:
+        # Take the old nodes out, reconnecting what they were sitting between.
+        source = over.inputs[2].links[0].from_socket if over.inputs[2].is_linked else None
+        for name in CropNodes:
+            if name in nodes:
+                nodes.remove(nodes[name])
+        if source is not None:
+            tree.links.new(source, composite.inputs[0])
+    if mode == 'NONE':
+        return
+    
+    if composite.inputs[0].is_linked:
+        source = composite.inputs[0].links[0].from_socket
+    else:
+        layers = next((n for n in nodes if n.type == 'R_LAYERS'), None) or nodes.new('CompositorNodeRLayers')
+        source = layers.outputs[0]
+    
+    over = nodes.new('CompositorNodeAlphaOver')
+    over.name = over.label = CropNodes[0]
+    over.location = composite.location.x - 200, composite.location.y
+    if mode == 'FLAT':
+        background = nodes.new('CompositorNodeRGB')
+        background.outputs[0].default_value = QSData.CropColor
+        background_out = background.outputs[0]
+    else:
+        background = nodes.new('CompositorNodeImage')
+        path = bpy.path.abspath(QSData.CropPlate)
+        if os.path.isfile(path):
+            background.image = bpy.data.images.load(path, check_existing = True)
+        scale = nodes.new('CompositorNodeScale')
+        scale.name = scale.label = CropNodes[2]
+        scale.space = 'RENDER_SIZE'
+        scale.location = over.location.x - 200, over.location.y - 200
+        tree.links.new(background.outputs[0], scale.inputs[0])
+        background_out = scale.outputs[0]
+    background.name = background.label = CropNodes[1]
+    background.location = over.location.x - 400, over.location.y - 200
+    
+    tree.links.new(background_out, over.inputs[1])
+    tree.links.new(source, over.inputs[2])
+    tree.links.new(over.outputs[0], composite.inputs[0])
+
+
+# Brings border and compositor in line with the crop settings.
+def crop_update(scene):
+    QSData = scene.QSProp
+    if not QSData.CropEnable:
+        scene.render.use_border = False
+    elif QSData.CropPerFrame:
+        set_border(scene.render, subject_border(scene, bpy.context.evaluated_depsgraph_get()))
+    else:
+        set_border(scene.render, subject_border_range(scene))
+    crop_compositor(scene)
+
+
+# Settings changed while cropping: redo the border and the nodes. While not cropping there is nothing to redo.
+def crop_refresh(scene):
+    if scene.QSProp.CropEnable:
+        crop_update(scene)
+
+
+# Moves the border along with the subject on every frame change, in the viewport and for the render queue, which renders
+# one still per frame. An animation render (Ctrl+F12) doesn't pick up border changes while it runs, it keeps the first frame's.
+@bpy.app.handlers.persistent
+def crop_frame_change(scene, depsgraph = None):
+    QSData = scene.QSProp
+    if QSData.CropEnable and QSData.CropPerFrame and len(QSData.CropTargets):
+        set_border(scene.render, subject_border(scene, depsgraph or bpy.context.evaluated_depsgraph_get()))
+
+
+# Renders the background plate: the whole frame, with few samples and no border.
+def render_crop_plate(scene):
+    QSData = scene.QSProp
+    render = scene.render
+    before = (render.use_border, render.image_settings.file_format, render.image_settings.color_depth)
+    samples = scene.cycles.samples if hasattr(scene, "cycles") else None
+    render.use_border = False
+    if samples is not None:
+        scene.cycles.samples = QSData.CropPlateSamples
+    try:
+        bpy.ops.render.render()
+        path = bpy.path.abspath(QSData.CropPlate)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        render.image_settings.file_format = 'OPEN_EXR'
+        render.image_settings.color_depth = '16'
+        bpy.data.images['Render Result'].save_render(path, scene = scene)
+    finally:
+        render.use_border, render.image_settings.file_format, render.image_settings.color_depth = before
+        if samples is not None:
+            scene.cycles.samples = samples
+    
+    image = next((img for img in bpy.data.images if bpy.path.abspath(img.filepath) == path), None)
+    if image is not None:
+        image.reload()
+    return path
+
+
+# ======================================================
+# Culling. Set dressed scenes are mostly out of the camera's view, but every renderable object still
+# goes into the render's BVH and memory. The culling pass goes through the frame range, puts the world
+# bounding box of every object (grown by a margin, for shadows and reflections) through the camera at
+# once with numpy, and leaves out whatever is never in view: either by turning off its render
+# visibility, or by moving it into a collection that is excluded from the view layers.
+# Quick Stage lights whose reach (EEVEE's custom distance, or what their energy gives) never touches
+# anything that stays can be left out too. Everything is remembered in "qs_cull" custom properties,
+# so Restore puts the scene back exactly.
+
+
+CullTypes = {'MESH', 'CURVE', 'SURFACE', 'META', 'FONT', 'VOLUME', 'CURVES', 'POINTCLOUD', 'GPENCIL'}
+CullCollection = "QS Culled"
+
+# The corners of a unit box, for building boxes from their min and max corners.
+BoxCorners = np.array([(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float64)
+
+
+# World matrices of every object in a collection of objects, as an (N, 4, 4) array, in one call.
+def object_matrices(objects):
+    buf = np.empty(len(objects) * 16, dtype=np.float32)
+    objects.foreach_get("matrix_world", buf)
+    # Blender hands matrices over column by column.
+    return buf.reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+
+
+# Local bounding boxes of every object in a collection of objects, as an (N, 8, 3) array.
+def object_bound_boxes(objects):
+    buf = np.empty(len(objects) * 24, dtype=np.float32)
+    try:
+        objects.foreach_get("bound_box", buf)
+    except (TypeError, RuntimeError):
+        buf = np.array([tuple(c) for ob in objects for c in ob.bound_box], dtype=np.float32)
+    return buf.reshape(-1, 8, 3).astype(np.float64)
+
+
+# World space boxes (min corner, max corner) of local boxes (N, 8, 3) under matrices (N, 4, 4), grown by margin.
+def world_boxes(boxes, matrices, margin=0.0):
+    world = np.einsum('nij,nkj->nki', matrices[:, :3, :3], boxes) + matrices[:, None, :3, 3]
+    return world.min(axis=1) - margin, world.max(axis=1) + margin
+
+
+# Which boxes the camera sees. clip is the camera's projection @ view matrix, frame_margin how far past
+# the frame edges to look. A box is only out when all its corners are past the same side of the view.
+def boxes_in_view(low, high, clip, frame_margin=0.0):
+    corners = low[:, None, :] + BoxCorners[None] * (high - low)[:, None, :]
+    h = np.concatenate([corners, np.ones(corners.shape[:2] + (1,))], axis=2) @ clip.T
+    x, y, z, w = h[..., 0], h[..., 1], h[..., 2], h[..., 3]
+    s = 1 + frame_margin
+    outside = ((x < -s * w).all(axis=1) | (x > s * w).all(axis=1) | (y < -s * w).all(axis=1) |
+               (y > s * w).all(axis=1) | (z < -w).all(axis=1) | (z > w).all(axis=1))
+    return ~outside
+
+
+def camera_clip_matrix(scene, camera, depsgraph):
+    width, height = render_pixel_size(scene.render)
+    proj = np.array(camera.calc_matrix_camera(depsgraph, x = width, y = height,
+                                              scale_x = scene.render.pixel_aspect_x, scale_y = scene.render.pixel_aspect_y))
+    return proj @ np.array(camera.evaluated_get(depsgraph).matrix_world.inverted())
+
+
+# How far a light reaches: its EEVEE custom distance when it has one, otherwise where its light
+# drops below the scene's light threshold (like EEVEE works it out). Suns reach everywhere.
+def light_reach(ldata, threshold):
+    if ldata.type == 'SUN':
+        return float('inf')
+    if getattr(ldata, "use_custom_distance", False):
+        return ldata.custom_distance
+    return float(np.sqrt(max(ldata.energy, 0) / (4 * np.pi * max(threshold, 1e-6))))
+
+
+# Distances from points (L, 3) to boxes (N, 3 / N, 3): nearest (L, N) and farthest (L, N).
+def box_distances(points, low, high):
+    p = points[:, None, :]
+    nearest = np.linalg.norm(np.maximum(np.maximum(low[None] - p, p - high[None]), 0), axis=2)
+    farthest = np.linalg.norm(np.maximum(np.abs(p - low[None]), np.abs(p - high[None])), axis=2)
+    return nearest, farthest
+
+
+# Works out what to cull, without changing anything. Returns (objects to cull, lights to cull,
+# {light data: distance it needs to reach}).
+def cull_plan(scene, camera, QSData):
+    objects = scene.objects
+    candidates = np.array([ob.type in CullTypes and not ob.hide_render and "qs_role" not in ob for ob in objects], dtype=bool)
+    boxes = object_bound_boxes(objects)[candidates]
+    
+    light_index = []
+    if QSData.CullLights:
+        light_index = [i for i, ob in enumerate(objects)
+                       if ob.type == 'LIGHT' and not ob.hide_render and ob.get("qs_kind", "").startswith("light:")]
+    lights = [objects[i] for i in light_index]
+    threshold = scene.eevee.light_threshold if hasattr(scene, "eevee") else 0.01
+    reach = np.array([light_reach(ob.data, threshold) for ob in lights])
+    light_index = np.array(light_index, dtype=int)
+    
+    seen = np.zeros(len(boxes), dtype=bool)
+    lit = np.zeros(len(lights), dtype=bool)
+    needed = np.zeros(len(lights))
+    
+    current = scene.frame_current
+    for frame in range(scene.frame_start, scene.frame_end + 1, QSData.CullStep):
+        scene.frame_set(frame)
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        matrices = object_matrices(objects)
+        low, high = world_boxes(boxes, matrices[candidates], QSData.CullMargin)
+        in_view = boxes_in_view(low, high, camera_clip_matrix(scene, camera, depsgraph), QSData.CullFrameMargin)
+        seen |= in_view
+        
+        if lights and in_view.any():
+            nearest, farthest = box_distances(matrices[light_index, :3, 3], low[in_view], high[in_view])
+            reaches = nearest <= reach[:, None]
+            lit |= reaches.any(axis=1)
+            needed = np.maximum(needed, np.where(reaches, np.minimum(farthest, reach[:, None]), 0).max(axis=1))
+    scene.frame_set(current)
+    
+    kept = [ob for ob, c in zip(objects, candidates) if c]
+    cull = [ob for ob, s in zip(kept, seen) if not s]
+    return cull, [ob for ob, l in zip(lights, lit) if not l], {ob.data: d for ob, l, d in zip(lights, lit, needed) if l}
+
+
+# The excluded collection culled objects go to, made if needed and excluded in every view layer.
+def cull_collection(scene):
+    coll = bpy.data.collections.get(CullCollection)
+    if coll is None:
+        coll = bpy.data.collections.new(CullCollection)
+    if coll.name not in scene.collection.children:
+        scene.collection.children.link(coll)
+    for view_layer in scene.view_layers:
+        layer = view_layer.layer_collection.children.get(coll.name)
+        if layer is not None:
+            layer.exclude = True
+    return coll
+
+
+# Leaves objects out of the render, remembering how to put them back.
+def cull_objects(scene, objects, mode):
+    coll = cull_collection(scene) if mode == 'COLLECTION' and objects else None
+    for ob in objects:
+        state = {'mode': mode, 'hide_render': ob.hide_render}
+        if coll is None:
+            ob.hide_render = True
+        else:
+            # "" stands for the scene's own top collection, which has no name to find it by.
+            homes = [c for c in ob.users_collection if c != coll]
+            state['collections'] = ["" if c == scene.collection else c.name for c in homes]
+            coll.objects.link(ob)
+            for c in homes:
+                c.objects.unlink(ob)
+        ob["qs_cull"] = state
+
+
+# Sets the EEVEE custom distance of lights, remembering what it was.
+def clamp_light_distances(distances):
+    for ldata, distance in distances.items():
+        if "qs_cull" not in ldata:
+            ldata["qs_cull"] = {'use_custom_distance': ldata.use_custom_distance, 'custom_distance': ldata.custom_distance}
+        ldata.use_custom_distance = True
+        ldata.custom_distance = max(distance, 0.01)
+
+
+# Puts back everything culling changed. Returns how many objects came back.
+def uncull(scene):
+    restored = 0
+    for ob in [ob for ob in bpy.data.objects if "qs_cull" in ob]:
+        state = ob["qs_cull"]
+        ob.hide_render = bool(state['hide_render'])
+        if state['mode'] == 'COLLECTION':
+            for name in state.get('collections', []):
+                home = bpy.data.collections.get(name) if name else scene.collection
+                home = home or scene.collection
+                if ob.name not in home.objects:
+                    home.objects.link(ob)
+            coll = bpy.data.collections.get(CullCollection)
+            if coll is not None and ob.name in coll.objects:
+                coll.objects.unlink(ob)
+        del ob["qs_cull"]
+        restored += 1
+    
+    for ldata in bpy.data.lights:
+        if "qs_cull" in ldata:
+            ldata.use_custom_distance = bool(ldata["qs_cull"]['use_custom_distance'])
+            ldata.custom_distance = ldata["qs_cull"]['custom_distance']
+            del ldata["qs_cull"]
+    
+    coll = bpy.data.collections.get(CullCollection)
+    if coll is not None and not coll.objects:
+        bpy.data.collections.remove(coll)
+    return restored
+
+
+# The whole culling pass for a camera. Culling again first restores the last pass.
+# Returns (objects culled, lights culled).
+def cull_scene(scene, camera):
+    QSData = scene.QSProp
+    uncull(scene)
+    cull, dark_lights, distances = cull_plan(scene, camera, QSData)
+    cull_objects(scene, cull, QSData.CullMode)
+    cull_objects(scene, dark_lights, 'HIDE')
+    if QSData.CullLightDistance:
+        clamp_light_distances(distances)
+    return len(cull), len(dark_lights)
+
+
+# ======================================================
+# Tiled rendering. One big still (a 4320p frame, say) is cut into border render tiles that overlap
+# a little, the tiles are rendered by a pool of background Blenders, and numpy stitches them back
+# together. Where tiles overlap they are cross-faded, which hides any seam the denoiser leaves at a
+# tile's edge. Every tile renders with the same seed, so the noise lines up from tile to tile.
+#
+# Next to the output goes a "<name>_tiles" folder with the tiles (EXR) and a manifest.json: the tile
+# layout and what each tile's state is. A tile counts as done when its file is there (files are renamed
+# into place only once fully written), so running again after a crash only renders the missing tiles,
+# and a single tile can be rendered again with --tile-index.
+
+
+TileVersion = 1
+TileManifestName = "manifest.json"
+
+
+# The size of the rendered image in pixels, after the resolution percentage.
+def render_pixel_size(render):
+    scale = render.resolution_percentage / 100
+    return int(render.resolution_x * scale), int(render.resolution_y * scale)
+
+
+# Cuts a width x height image into tiles_x x tiles_y tiles. Each tile's core is its share of the image,
+# its rect is the core grown by overlap pixels on every side (inside the image). Pixels count from the
+# bottom left, like Blender's render border.
+def tile_plan(width, height, tiles_x, tiles_y, overlap):
+    xs = np.linspace(0, width, tiles_x + 1).round().astype(int)
+    ys = np.linspace(0, height, tiles_y + 1).round().astype(int)
+    tiles = []
+    for j in range(tiles_y):
+        for i in range(tiles_x):
+            tiles.append({
+                'index': len(tiles),
+                'core': [int(xs[i]), int(xs[i + 1]), int(ys[j]), int(ys[j + 1])],
+                'rect': [int(max(0, xs[i] - overlap)), int(min(width, xs[i + 1] + overlap)),
+                         int(max(0, ys[j] - overlap)), int(min(height, ys[j + 1] + overlap))],
+                'status': 'pending',
+            })
+    return tiles
+
+
+def tile_folder(output):
+    return os.path.splitext(bpy.path.abspath(output))[0] + "_tiles"
+
+
+def tile_path(folder, tile):
+    return os.path.join(folder, "tile_%03d.exr" % tile['index'])
+
+
+def tile_done(folder, tile):
+    path = tile_path(folder, tile)
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    with open(path + ".part", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".part", path)
+
+
+# Sets up (or picks up) the manifest for rendering the scene's current frame in tiles.
+# An existing manifest is kept when it was made for the same size, layout, frame, camera and seed,
+# unless fresh is set. Tile states are refreshed from the files. Returns the manifest path.
+def tiled_prepare(scene, output, tiles_x, tiles_y, overlap, fresh=False):
+    folder = tile_folder(output)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, TileManifestName)
+    
+    width, height = render_pixel_size(scene.render)
+    settings = {'width': width, 'height': height, 'tiles_x': tiles_x, 'tiles_y': tiles_y, 'overlap': overlap,
+                'frame': scene.frame_current, 'camera': scene.camera.name if scene.camera else None,
+                'seed': scene.cycles.seed if hasattr(scene, "cycles") else 0}
+    manifest = None
+    if not fresh and os.path.isfile(path):
+        try:
+            manifest = read_manifest(path)
+        except (OSError, ValueError):
+            manifest = None
+        if manifest is not None and (manifest.get('version') != TileVersion or manifest.get('settings') != settings):
+            manifest = None
+    if manifest is None:
+        for tile in tile_plan(width, height, tiles_x, tiles_y, overlap):
+            if os.path.isfile(tile_path(folder, tile)):
+                os.remove(tile_path(folder, tile))
+        manifest = {'version': TileVersion, 'settings': settings, 'output': bpy.path.abspath(output),
+                    'tiles': tile_plan(width, height, tiles_x, tiles_y, overlap)}
+    
+    for tile in manifest['tiles']:
+        if tile_done(folder, tile):
+            tile['status'] = 'done'
+        elif tile['status'] == 'done':
+            tile['status'] = 'pending'
+    write_manifest(path, manifest)
+    return path
+
+
+# Indices of the tiles that still need rendering.
+def tiles_left(manifest_path):
+    folder = os.path.dirname(manifest_path)
+    return [tile['index'] for tile in read_manifest(manifest_path)['tiles'] if not tile_done(folder, tile)]
+
+
+# Renders some tiles of a manifest in this Blender. Each tile is a cropped border render, saved as
+# a full float EXR under a temporary name and renamed when complete. Returns what was rendered.
+def render_tiles(scene, manifest_path, indices):
+    manifest = read_manifest(manifest_path)
+    folder = os.path.dirname(manifest_path)
+    settings = manifest['settings']
+    render = scene.render
+    
+    scene.frame_set(settings['frame'])
+    if settings['camera'] in bpy.data.objects:
+        scene.camera = bpy.data.objects[settings['camera']]
+    if hasattr(scene, "cycles"):
+        scene.cycles.seed = settings['seed']
+        scene.cycles.use_animated_seed = False
+    
+    render.use_border = True
+    render.use_crop_to_border = True
+    render.use_persistent_data = True
+    image = render.image_settings
+    image.file_format = 'OPEN_EXR'
+    image.color_mode = 'RGBA'
+    image.color_depth = '32'
+    image.exr_codec = 'ZIP'
+    
+    done = []
+    width, height = settings['width'], settings['height']
+    swapped = hdri_render_begin(scene)
+    try:
+        for index in indices:
+            tile = manifest['tiles'][index]
+            x0, x1, y0, y1 = tile['rect']
+            render.border_min_x, render.border_max_x = x0 / width, x1 / width
+            render.border_min_y, render.border_max_y = y0 / height, y1 / height
+            
+            start = time.perf_counter()
+            bpy.ops.render.render()
+            part = tile_path(folder, tile) + ".part"
+            bpy.data.images['Render Result'].save_render(part, scene=scene)
+            os.replace(part, tile_path(folder, tile))
+            done.append({'index': index, 'seconds': time.perf_counter() - start})
+    finally:
+        hdri_render_end(scene, swapped)
+    return done
+
+
+# Weight of every pixel of a tile when stitching. On sides that meet another tile the weight ramps
+# from 0 at the tile's edge to 1 at twice the overlap in, which is exactly where the neighbour's
+# ramp ends, so the weights of two overlapping tiles add up to 1. Tiles without overlap just meet, every weight is 1.
+def tile_weights(tile, width, height, overlap, shape):
+    x0, x1, y0, y1 = tile['rect']
+    ramp = 2 * overlap
+    
+    def side(n, low, high, size):
+        pos = np.arange(n) + 0.5
+        w = np.ones(n, dtype=np.float32)
+        if low > 0 and ramp:
+            w = np.minimum(w, pos / ramp)
+        if high < size and ramp:
+            w = np.minimum(w, (n - pos) / ramp)
+        return w
+    
+    return np.outer(side(shape[0], y0, y1, height), side(shape[1], x0, x1, width))
+
+
+# Puts the tiles of a manifest back together. Returns a (height, width, 4) float array, bottom row first.
+def stitch_tiles(manifest_path):
+    manifest = read_manifest(manifest_path)
+    folder = os.path.dirname(manifest_path)
+    settings = manifest['settings']
+    width, height = settings['width'], settings['height']
+    
+    total = np.zeros((height, width, 4), dtype=np.float32)
+    weights = np.zeros((height, width, 1), dtype=np.float32)
+    for tile in manifest['tiles']:
+        px = read_image_pixels(tile_path(folder, tile))
+        x0, x1, y0, y1 = tile['rect']
+        # Border rendering may round a tile a pixel smaller, so only what is actually there is used.
+        h = min(px.shape[0], y1 - y0)
+        w = min(px.shape[1], x1 - x0)
+        weight = tile_weights(tile, width, height, settings['overlap'], (h, w))[:, :, None]
+        total[y0:y0 + h, x0:x0 + w] += px[:h, :w] * weight
+        weights[y0:y0 + h, x0:x0 + w] += weight
+    return total / np.maximum(weights, 1e-8)
+
+
+# Saves a float image the way a render would be saved: EXR stays linear, PNG goes through the
+# scene's color management (view transform and all).
+def save_render_pixels(scene, pixels, path):
+    h, w = pixels.shape[:2]
+    img = bpy.data.images.new("QS Tiled", w, h, alpha=True, float_buffer=True)
+    img.pixels.foreach_set(pixels.astype(np.float32).ravel())
+    
+    image = scene.render.image_settings
+    before = (image.file_format, image.color_mode, image.color_depth)
+    exr = path.lower().endswith(".exr")
+    image.file_format = 'OPEN_EXR' if exr else 'PNG'
+    image.color_mode = 'RGBA'
+    image.color_depth = '32' if exr else '16'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        img.save_render(path, scene=scene)
+    finally:
+        image.file_format, image.color_mode, image.color_depth = before
+        bpy.data.images.remove(img)
+    return path
+
+
+# Hands the tiles to workers, a few each (every workers-th tile, so each gets a mix of busy and empty
+# parts of the frame). Returns a list of (process, log path).
+def launch_tile_workers(blend_path, manifest_path, indices, workers):
+    shares = [indices[w::workers] for w in range(min(workers, len(indices)))]
+    return launch_blenders(blend_path, [["--render-tiles", manifest_path, "--tile-index", ",".join(map(str, share))]
+                                        for share in shares], 0, "quickstage_tiles_")
+
+
+# Records how the tiles went, and stitches the output once every tile is there.
+# Returns a summary: the output (if it was written) and the tiles still missing.
+def tiled_finish(scene, manifest_path, worker_results=()):
+    manifest = read_manifest(manifest_path)
+    folder = os.path.dirname(manifest_path)
+    seconds = {t['index']: t['seconds'] for r in worker_results for t in r.get('tiles', [])}
+    for tile in manifest['tiles']:
+        tile['status'] = 'done' if tile_done(folder, tile) else 'failed'
+        if tile['index'] in seconds:
+            tile['seconds'] = seconds[tile['index']]
+    
+    missing = [tile['index'] for tile in manifest['tiles'] if tile['status'] != 'done']
+    result = {'manifest': manifest_path, 'tiles': len(manifest['tiles']), 'missing': missing}
+    if not missing:
+        result['output'] = save_render_pixels(scene, stitch_tiles(manifest_path), manifest['output'])
+        manifest['stitched'] = time.strftime("%Y-%m-%d %H:%M:%S")
+    write_manifest(manifest_path, manifest)
+    return result
+
+
+# ======================================================
+# Relight matrix. Instead of rendering every light preset on its own, all of them are spawned at once,
+# every light gets its own Cycles light group, and the scene is rendered a single time.
+# Light adds up linearly, so any preset (at any energy per light) is just a weighted sum of the
+# light group passes. Those passes are cached, and the preview is rebuilt from them with numpy.
+# Needs Cycles light groups (Blender 3.2 and newer).
+
+
+RelightWorld = "QS_World"
+
+# The light group passes of the last relight render, downsampled for previewing.
+# 'folder' is where they came from, 'passes' maps light group name to an (height, width, 3) array.
+RelightCache = {'folder': None, 'passes': {}}
+
+
+# Light group names for every light of every preset, in LitPresets order.
+# Returns a dict of preset key to a list of group names.
+def relight_groups():
+    return {key: ["QS_" + key + "_" + str(i) for i in range(len(light_preset(key)['lights']))] for key in preset_keys()}
+
+
+# Reads an image file into an (height, width, 4) float array.
+def read_image_pixels(path):
+    img = bpy.data.images.load(path, check_existing=False)
+    w, h = img.size
+    px = np.empty(w * h * 4, dtype=np.float32)
+    img.pixels.foreach_get(px)
+    bpy.data.images.remove(img)
+    return px.reshape(h, w, 4)
+
+
+# Shrinks an image by averaging blocks of pixels, until it is at most max_width wide.
+def downsample(pixels, max_width):
+    step = int(np.ceil(pixels.shape[1] / max_width))
+    if step <= 1:
+        return pixels
+    h = pixels.shape[0] // step * step
+    w = pixels.shape[1] // step * step
+    return pixels[:h, :w].reshape(h // step, step, w // step, step, -1).mean(axis=(1, 3))
+
+
+# Linear light to sRGB, for writing 8 bit images like PNG.
+def linear_to_srgb(rgb):
+    rgb = np.clip(rgb, 0, 1)
+    return np.where(rgb <= 0.0031308, rgb * 12.92, 1.055 * np.power(rgb, 1 / 2.4) - 0.055)
+
+
+# Puts an (height, width, 3) array into a Blender image, making it if needed.
+# With path, it is also saved there as a PNG.
+def write_image(name, rgb, path=None):
+    h, w = rgb.shape[:2]
+    img = bpy.data.images.get(name)
+    if img is None or tuple(img.size) != (w, h):
+        if img is not None:
+            bpy.data.images.remove(img)
+        img = bpy.data.images.new(name, w, h, alpha=False, float_buffer=path is None)
+    
+    px = np.ones((h, w, 4), dtype=np.float32)
+    px[:, :, :3] = linear_to_srgb(rgb) if path else rgb
+    img.pixels.foreach_set(px.ravel())
+    img.update()
+    
+    if path:
+        img.filepath_raw = path
+        img.file_format = 'PNG'
+        img.save()
+    return img
+
+
+# The light group passes saved by a relight render, and the world's (if there is one).
+# The File Output node names them "<group>_<frame>.exr".
+def relight_files(folder):
+    known = set(g for groups in relight_groups().values() for g in groups)
+    known.add(RelightWorld)
+    files = {}
+    for f in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        group, sep, frame = f[:-4].rpartition("_")
+        if f.endswith(".exr") and group in known and frame.isdigit():
+            files[group] = os.path.join(folder, f)
+    return files
+
+
+# Loads the light group passes of folder into the cache (downsampled), unless they are there already.
+def relight_load(folder, max_width=1024):
+    if RelightCache['folder'] == folder and RelightCache['passes']:
+        return RelightCache['passes']
+    passes = {}
+    for group, path in relight_files(folder).items():
+        passes[group] = downsample(read_image_pixels(path), max_width)[:, :, :3].copy()
+    RelightCache['folder'] = folder
+    RelightCache['passes'] = passes
+    return passes
+
+
+# Weight of every light group, from the scene's relight settings (1 when unknown).
+def relight_weights(scene):
+    return {item.Group: item.Weight for item in scene.QSProp.RelightLights}
+
+
+# A preset's image: the weighted sum of its lights' passes, plus the world.
+# Stacking the passes lets numpy do the whole sum in one go.
+def relight_composite(passes, preset, weights):
+    groups = [g for g in relight_groups().get(preset, []) + [RelightWorld] if g in passes]
+    if not groups:
+        return None
+    stack = np.stack([passes[g] for g in groups])
+    w = np.array([weights.get(g, 1.0) for g in groups], dtype=np.float32)
+    return np.tensordot(w, stack, axes=1)
+
+
+# Redraws the "QS Relight" image for the preset picked in the panel. This is what runs
+# whenever a weight changes, no rendering involved.
+def relight_show(scene):
+    QSData = scene.QSProp
+    folder = bpy.path.abspath(QSData.RelightDir)
+    passes = RelightCache['passes'] if RelightCache['folder'] == folder else relight_load(folder)
+    rgb = relight_composite(passes, QSData.RelightPreset, relight_weights(scene))
+    if rgb is not None:
+        write_image("QS Relight", rgb)
+
+
+# All presets side by side in a grid, in preset_keys order (left to right, top to bottom).
+def relight_contact_sheet(passes, weights, columns=4):
+    tiles = [relight_composite(passes, key, weights) for key in preset_keys()]
+    tiles = [t for t in tiles if t is not None]
+    if not tiles:
+        return None
+    h, w = tiles[0].shape[:2]
+    rows = int(np.ceil(len(tiles) / columns))
+    sheet = np.zeros((rows * h, columns * w, 3), dtype=np.float32)
+    for i, tile in enumerate(tiles):
+        # Blender images start at the bottom row, so the first row of tiles goes at the end of the array.
+        r = rows - 1 - i // columns
+        c = i % columns
+        sheet[r * h:(r + 1) * h, c * w:(c + 1) * w] = tile
+    return sheet
+
+
+# Light groups can only be removed by the operator (view_layer.lightgroups just has add()), which removes the
+# active light group of the context's view layer.
+def remove_lightgroups(scene, view_layer, names):
+    with bpy.context.temp_override(scene=scene, view_layer=view_layer):
+        for name in names:
+            i = view_layer.lightgroups.find(name)
+            if i >= 0:
+                view_layer.active_lightgroup_index = i
+                bpy.ops.scene.view_layer_remove_lightgroup()
+
+
+# Spawns every preset into the "Relight Matrix" collection, each light in its own light group, and adds
+# the light groups the view layer doesn't have yet. What was made or changed goes into state as it
+# happens, so relight_cleanup can undo a run that failed halfway. Returns the names of all the light groups.
+def relight_stage(scene, view_layer, groups, state):
+    state['collection'] = bpy.data.collections.new("Relight Matrix")
+    scene.collection.children.link(state['collection'])
+    for key in groups:
+        litbase, objects = spawn_light_preset(key, state['collection'])
+        state['made'] += objects
+        lights = [ob for ob in objects if ob.type == 'LIGHT']
+        for light, group in zip(lights, groups[key]):
+            light.lightgroup = group
+    
+    all_groups = [g for key in groups for g in groups[key]]
+    if scene.world is not None:
+        state['world_group'] = scene.world.lightgroup
+        scene.world.lightgroup = RelightWorld
+        all_groups.append(RelightWorld)
+    
+    old_groups = set(lg.name for lg in view_layer.lightgroups)
+    for group in all_groups:
+        if group not in old_groups:
+            view_layer.lightgroups.add(name=group)
+            state['groups'].append(group)
+    return all_groups
+
+
+# Puts back what relight_stage and the compositor setup changed. Every step runs even when one before it
+# fails, so a failing light group removal never leaves the collection or the compositor nodes behind.
+def relight_cleanup(scene, view_layer, state):
+    try:
+        if 'settings' in state:
+            tree = scene.node_tree
+            for node in state['nodes']:
+                tree.nodes.remove(node)
+            scene.use_nodes, scene.render.use_compositing, scene.render.engine = state['settings']
+        if 'world_group' in state and scene.world is not None:
+            scene.world.lightgroup = state['world_group']
+    finally:
+        try:
+            for ob in state['made']:
+                data = ob.data
+                bpy.data.objects.remove(ob)
+                if data is not None and data.users == 0:
+                    bpy.data.lights.remove(data)
+            if 'collection' in state:
+                bpy.data.collections.remove(state['collection'])
+        finally:
+            remove_lightgroups(scene, view_layer, state['groups'])
+
+
+# Spawns every preset with its own light groups, renders once, and saves one EXR per light group
+# into folder with the compositor's File Output node. Everything it adds to the scene is removed afterwards.
+def relight_render(scene, view_layer, folder):
+    if not hasattr(view_layer, "lightgroups"):
+        raise RuntimeError("light groups need Blender 3.2 or newer")
+    
+    # All preset definitions are read first, so a broken preset file stops the run before anything is made.
+    groups = relight_groups()
+    presets = {key: light_preset(key) for key in groups}
+    state = {'made': [], 'groups': [], 'nodes': []}
+    try:
+        all_groups = relight_stage(scene, view_layer, groups, state)
+        
+        # Compositor: Render Layers -> one File Output slot per light group.
+        state['settings'] = (scene.use_nodes, scene.render.use_compositing, scene.render.engine)
+        scene.render.engine = 'CYCLES'
+        scene.use_nodes = True
+        scene.render.use_compositing = True
+        tree = scene.node_tree
+        rlayer = tree.nodes.new('CompositorNodeRLayers')
+        state['nodes'].append(rlayer)
+        rlayer.layer = view_layer.name
+        output = tree.nodes.new('CompositorNodeOutputFile')
+        state['nodes'].append(output)
+        output.base_path = folder
+        output.format.file_format = 'OPEN_EXR'
+        output.format.color_depth = '32'
+        output.file_slots.clear()
+        for group in all_groups:
+            output.file_slots.new(group + "_")
+            tree.links.new(rlayer.outputs["Combined_" + group], output.inputs[group + "_"])
+        
+        # Old passes from an earlier run would be picked up otherwise.
+        for path in relight_files(folder).values():
+            os.remove(path)
+        bpy.ops.render.render(write_still=False)
+        
+        # Fresh weights for every light, named after the lights so the panel makes sense.
+        QSData = scene.QSProp
+        QSData.RelightLights.clear()
+        for key, preset in presets.items():
+            for spec, group in zip(preset['lights'], groups[key]):
+                item = QSData.RelightLights.add()
+                item.name = spec['name'] + " " + preset['tag']
+                item.Group = group
+                item.Preset = key
+    finally:
+        relight_cleanup(scene, view_layer, state)
+    
+    RelightCache['folder'] = None
+    return relight_files(folder)
+
+
+# ======================================================
+# Diagnostics. Operators marked with @instrumented record how long they took, how many objects and
+# datablocks they made, how many depsgraph updates happened and how much the peak memory grew.
+# The last records are kept in DiagRecords and shown in the Diagnostics panel, so when a scene
+# "froze", there is something to look at. Optionally they go to a log file too, and any of the
+# operators can be run under cProfile.
+
+
+DiagRecords = deque(maxlen = 50)
+
+# Dropdown items of the instrumented operators, filled in by @instrumented.
+DiagItems = []
+
+# The bpy.data collections counted as "datablocks".
+DiagBlocks = ("objects", "meshes", "lights", "cameras", "collections", "materials", "images",
+              "node_groups", "actions", "worlds", "curves")
+
+
+# Quick Stage's folder in Blender's config folder, made if needed.
+def config_dir():
+    return bpy.utils.user_resource('CONFIG', path = "quickstage", create = True)
+
+
+def datablock_count():
+    return sum(len(getattr(bpy.data, name)) for name in DiagBlocks if hasattr(bpy.data, name))
+
+
+# Peak memory of the whole Blender process in KB (macOS reports bytes), None where unknown.
+def peak_memory_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def diag_log_path(QSData):
+    return bpy.path.abspath(QSData.DiagLogPath) if QSData.DiagLogPath else os.path.join(config_dir(), "diagnostics.jsonl")
+
+
+# Wraps an operator's execute with the measurements above.
+def instrumented(cls):
+    run = cls.execute
+    DiagItems.append((cls.__name__, cls.bl_label, cls.bl_idname))
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        updates = [0]
+        
+        def count(scene, depsgraph = None):
+            updates[0] += 1
+        
+        profile = cProfile.Profile() if cls.__name__ in QSData.DiagProfile else None
+        objects = len(bpy.data.objects)
+        blocks = datablock_count()
+        memory = peak_memory_kb()
+        bpy.app.handlers.depsgraph_update_post.append(count)
+        start = time.perf_counter()
+        try:
+            if profile is not None:
+                profile.enable()
+            result = run(self, context)
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            bpy.app.handlers.depsgraph_update_post.remove(count)
+        
+        record = {
+            'operator': cls.__name__,
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'seconds': seconds,
+            'objects': len(bpy.data.objects) - objects,
+            'datablocks': datablock_count() - blocks,
+            'depsgraph_updates': updates[0],
+            'peak_memory_kb': None if memory is None else peak_memory_kb() - memory,
+            'result': sorted(result),
+        }
+        
+        if profile is not None:
+            record['profile'] = os.path.join(os.path.dirname(diag_log_path(QSData)),
+                                             cls.__name__ + time.strftime("_%Y%m%d_%H%M%S") + ".prof")
+            profile.dump_stats(record['profile'])
+        
+        DiagRecords.append(record)
+        if QSData.DiagLog:
+            try:
+                with open(diag_log_path(QSData), "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as err:
+                # Kept on the record, so the Diagnostics panel shows why the log stays empty.
+                record['log_error'] = str(err)
+        return result
+    
+    cls.execute = execute
+    return cls
+
+
+# ======================================================
+# Bounds cache. World space bounding boxes of objects, from their evaluated vertices (modifiers included),
+# worked out with numpy: the vertex positions come out in one foreach_get, get moved to world space
+# in one matrix multiply, and min/max does the rest. The results are kept per object and dropped
+# when the depsgraph says the object's geometry or transform changed, so asking again is free.
+
+
+# Object key -> (min corner, max corner, radius of the sphere around the box center holding every vertex).
+BoundsCache = {}
+
+
+def bounds_key(ob):
+    return getattr(ob, "session_uid", None) or ob.name
+
+
+# Evaluated vertex positions of an object as an (N, 3) array in local space, None if it has no geometry.
+def object_vertices(ob, depsgraph):
+    ob_eval = ob.evaluated_get(depsgraph)
+    if ob.type == 'MESH':
+        mesh = ob_eval.data
+    elif ob.type in ('CURVE', 'SURFACE', 'FONT', 'META'):
+        mesh = ob_eval.to_mesh()
+    else:
+        return None
+    
+    verts = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", verts)
+    if ob.type != 'MESH':
+        ob_eval.to_mesh_clear()
+    return verts.reshape(-1, 3)
+
+
+# World space bounds of one object, from the cache when possible.
+def object_bounds(ob, depsgraph):
+    key = bounds_key(ob)
+    if key in BoundsCache:
+        return BoundsCache[key]
+    
+    verts = object_vertices(ob, depsgraph)
+    mat = np.array(ob.evaluated_get(depsgraph).matrix_world, dtype=np.float64)
+    if verts is None or not len(verts):
+        # No geometry (empties, lights, ...), the object's origin is all there is.
+        world = mat[:3, 3].reshape(1, 3)
+    else:
+        world = verts @ mat[:3, :3].T + mat[:3, 3]
+    
+    low = world.min(axis=0)
+    high = world.max(axis=0)
+    center = (low + high) / 2
+    radius = float(np.sqrt(((world - center) ** 2).sum(axis=1).max()))
+    BoundsCache[key] = (low, high, radius)
+    return BoundsCache[key]
+
+
+# Bounds around several objects together: (center, min corner, max corner, radius).
+# The radius is measured from the shared center, so nothing sticks out of the sphere.
+def selection_bounds(objects, depsgraph):
+    boxes = [object_bounds(ob, depsgraph) for ob in objects]
+    low = np.min([b[0] for b in boxes], axis=0)
+    high = np.max([b[1] for b in boxes], axis=0)
+    center = (low + high) / 2
+    radius = max(float(np.linalg.norm((b[0] + b[1]) / 2 - center)) + b[2] for b in boxes)
+    return center, low, high, radius
+
+
+# Drops the cached bounds of anything the depsgraph changed. Registered in register().
+@bpy.app.handlers.persistent
+def bounds_depsgraph_update(scene, depsgraph=None):
+    if depsgraph is None:
+        BoundsCache.clear()
+        return
+    for update in depsgraph.updates:
+        if (update.is_updated_geometry or update.is_updated_transform) and isinstance(update.id, bpy.types.Object):
+            BoundsCache.pop(bounds_key(update.id.original), None)
+
+
+@bpy.app.handlers.persistent
+def bounds_load_post(*args):
+    BoundsCache.clear()
+
+
+# The objects worth framing: selected, and not part of a camera or light rig.
+def frame_targets(context):
+    return [ob for ob in context.selected_objects if ob.type not in ('CAMERA', 'LIGHT')
+            and ("qs_role" not in ob or ob.get("qs_kind", "").startswith("stage:"))]
+
+
+# How far a camera has to be from a sphere of this radius to fit it, given its lens and the
+# render ratio. The field of view is measured on the sensor's long side, like Blender's 'Auto' fit.
+def frame_distance(radius, lens, sensor, ratio, margin=1.1):
+    w, h, name = RatioTable[ratio]
+    wide = 2 * np.arctan(sensor / (2 * lens))
+    if w >= h:
+        fov = 2 * np.arctan(np.tan(wide / 2) * h / w)
+    else:
+        fov = 2 * np.arctan(np.tan(wide / 2) * w / h)
+    return float(radius * margin / np.sin(fov / 2))
+
+
+# Moves a freshly made camera rig: focus point to focus_location, camera distance away in front of it (-Y).
+# For the complex rig it's the Zoom Rig that moves, in the Rotation Rig's space.
+def place_cam_rig(rig, focus_location, distance):
+    focus = Vector(focus_location)
+    cam_world = focus + Vector((0, -distance, 0))
+    rig['focus'].location = focus
+    if 'zoom' in rig:
+        sphere = Matrix.Translation(focus) @ rig['rotation'].rotation_euler.to_matrix().to_4x4()
+        rig['zoom'].location = (sphere @ rig['zoom'].matrix_parent_inverse).inverted() @ cam_world
+    else:
+        rig['camera'].location = cam_world
+
+
+# Subject fitting for light presets. The presets in LitPresets are laid out for a person standing at
+# the origin, roughly the subject below. Fitting maps that subject onto the selection's bounds: the
+# set base gets moved, turned and scaled (and everything parented to it follows, area light sizes
+# included), and since every distance grows by the same scale, energies grow by its square,
+# which keeps the light arriving at the subject, and so the exposure, the same.
+
+
+LitSubject = {'center': (0, 0, 0.9), 'radius': 0.95}
+
+
+# Turn around Z that points a preset's front (-Y) from center towards the camera.
+def face_camera_yaw(center, camera):
+    if camera is None:
+        return 0.0
+    d = camera.matrix_world.translation - Vector(center)
+    if abs(d.x) < 1e-9 and abs(d.y) < 1e-9:
+        return 0.0
+    return float(np.arctan2(d.x, -d.y))
+
+
+# Fits a spawned light preset to a subject of the given bounds. Returns the scale used.
+# Light data shared with other copies (linked duplicates) is split off first, so they keep their energy.
+def fit_light_preset(litbase, made, center, radius, yaw=0.0):
+    scale = radius / LitSubject['radius']
+    fit = (Matrix.Translation(Vector(center)) @ Matrix.Rotation(yaw, 4, 'Z') @ Matrix.Scale(scale, 4)
+           @ Matrix.Translation(-Vector(LitSubject['center'])))
+    litbase.matrix_basis = fit @ litbase.matrix_basis
+    
+    for ob in made:
+        if ob.type == 'LIGHT':
+            if ob.data.users > 1:
+                ob.data = ob.data.copy()
+            ob.data.energy *= scale * scale
+            ob["qs_energy"] = ob.get("qs_energy", ob.data.energy / (scale * scale)) * scale * scale
+    return scale
+
+
+# ======================================================
+# Preset library. Every light preset and camera rig is built once into its own small .blend in
+# Blender's config folder. The file name has a fingerprint of the preset's definition (and of the code
+# that builds it), so changing a preset means a new file, and the old one is thrown away.
+# Spawning then either links the library collection in as an instance (one empty, no matter how big
+# the preset is), or makes linked duplicates of an appended template, which share light and camera
+# data between all copies. Either way, 40 staged shots don't mean 40 copies of every light.
+#
+# Library keys are the LitPresets keys for lights, and "camrig_simple" / "camrig_complex"
+# (plus "_light" for the camera light version) for camera rigs.
+
+
+LibraryVersion = 1
+
+
+def library_camrig_key(kind, cam_light):
+    return "camrig_" + kind.lower() + ("_light" if cam_light else "")
+
+
+# Builds what a library key stands for into a collection. Returns the objects made.
+def library_build_into(key, collection):
+    if key.startswith("camrig_"):
+        kind = key.split("_")[1].upper()
+        return list(build_cam_rig(kind, collection, None, key.endswith("_light")).values())
+    return spawn_light_preset(key, collection)[1]
+
+
+# Fingerprint of everything that decides what a library key builds into.
+def library_hash(key):
+    h = hashlib.sha1(repr((LibraryVersion, tuple(bpy.app.version[:2]), key)).encode())
+    if key in LitPresets or key in PresetHeaders:
+        h.update(json.dumps(light_preset(key), sort_keys = True).encode())
+    for func in (spawn_light_preset, build_cam_rig, new_light, new_empty, parent_keep):
+        h.update(func.__code__.co_code)
+        h.update(repr([c for c in func.__code__.co_consts if not hasattr(c, "co_code")]).encode())
+    return h.hexdigest()[:12]
+
+
+def library_path(key):
+    return os.path.join(config_dir(), "library", key + "_" + library_hash(key) + ".blend")
+
+
+def library_collection_name(key):
+    return "QS " + key
+
+
+# Makes sure the library file of a key exists and is up to date. Returns its path.
+def library_build(key):
+    path = library_path(key)
+    if os.path.isfile(path):
+        return path
+    
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok = True)
+    coll = bpy.data.collections.new(library_collection_name(key))
+    made = library_build_into(key, coll)
+    bpy.data.libraries.write(path, {coll}, fake_user = True)
+    
+    # Older versions of this preset are out of date now.
+    for f in os.listdir(folder):
+        if f.endswith(".blend") and f[:-6].rpartition("_")[0] == key and os.path.join(folder, f) != path:
+            os.remove(os.path.join(folder, f))
+    
+    # The library has them now, the local copies can go.
+    data = [ob.data for ob in made if ob.data is not None]
+    bpy.data.batch_remove(made + [coll])
+    bpy.data.batch_remove([d for d in data if d.users == 0])
+    return path
+
+
+# The library collection of a key, linked (link=True) or appended as a local template.
+# Loaded only once per file, after that it's just a lookup.
+def library_collection(key, link):
+    path = library_build(key)
+    name = library_collection_name(key)
+    stamp = os.path.basename(path)
+    
+    for coll in bpy.data.collections:
+        if link and coll.library is not None and coll.name == name and os.path.normpath(bpy.path.abspath(coll.library.filepath)) == os.path.normpath(path):
+            return coll
+        if not link and coll.library is None and coll.get("qs_library") == stamp:
+            return coll
+    
+    with bpy.data.libraries.load(path, link = link) as (data_from, data_to):
+        data_to.collections = [name]
+    coll = data_to.collections[0]
+    if not link:
+        # Nothing in the scene uses the template itself, the fake user keeps it in the file.
+        coll["qs_library"] = stamp
+        coll.use_fake_user = True
+    return coll
+
+
+# One empty that instances the library collection. Returns the empty, and it in a list.
+def spawn_library_instance(key, name, collection, view_layer = None):
+    inst = bpy.data.objects.new(name, None)
+    inst.instance_type = 'COLLECTION'
+    inst.instance_collection = library_collection(key, True)
+    inst["qs_role"] = "base"
+    link_objects([inst], collection, view_layer)
+    return inst, [inst]
+
+
+# Linked duplicates of the library template: new objects, shared data. Parents and constraint
+# targets are pointed at the new copies, so the copy is a working rig of its own.
+# Returns the root (the first object without a parent) and every object made.
+def spawn_library_linked(key, collection, view_layer = None):
+    template = library_collection(key, False)
+    copies = {ob: ob.copy() for ob in template.objects}
+    
+    for ob in copies.values():
+        if ob.parent in copies:
+            ob.parent = copies[ob.parent]
+        for con in ob.constraints:
+            if getattr(con, "target", None) in copies:
+                con.target = copies[con.target]
+            if getattr(con, "space_object", None) in copies:
+                con.space_object = copies[con.space_object]
+    
+    made = list(copies.values())
+    link_objects(made, collection, view_layer)
+    root = next(ob for ob in made if ob.parent is None)
+    return root, made
+
+
+# Camera rig for the operators: built fresh, or linked duplicates from the library.
+# (An instanced camera can't be the scene camera, so 'INSTANCE' also makes linked duplicates here.)
+# Returns the rig members by role, like build_cam_rig.
+def make_cam_rig(kind, collection, view_layer, scene, cam_light, mode = 'OFF'):
+    if mode == 'OFF':
+        return build_cam_rig(kind, collection, view_layer, cam_light, scene)
+    
+    root, made = spawn_library_linked(library_camrig_key(kind, cam_light), collection, view_layer)
+    rig = {ob["qs_role"]: ob for ob in made}
+    
+    # The depth of field focus is stored in the camera data, so this copy needs data of its own.
+    rig['camera'].data = rig['camera'].data.copy()
+    rig['camera'].data.dof.focus_object = rig['focus']
+    
+    if scene.camera is None:
+        scene.camera = rig['camera']
+    return rig
+
+
+def spawn_cam_rig(kind, context, cam_light, mode = 'OFF'):
+    return make_cam_rig(kind, spawn_collection(context), context.view_layer, context.scene, cam_light, mode)
+
+
+# Frames the selected objects with a camera rig, if asked to. Returns True when it did.
+def frame_cam_rig(rig, context):
+    QSData = context.scene.QSProp
+    targets = frame_targets(context)
+    if not QSData.CamFrame or not targets:
+        return False
+    
+    center, low, high, radius = selection_bounds(targets, context.evaluated_depsgraph_get())
+    camdata = rig['camera'].data
+    place_cam_rig(rig, center, frame_distance(radius, camdata.lens, camdata.sensor_width, QSData.ScrRat, QSData.CamFrameMargin))
+    context.view_layer.update()
+    return True
+
+
+# ======================================================
+# Rig baking. A complex rig is a chain of constraints that every render node has to evaluate on every frame.
+# Baking plays the rig once, writes the camera's (and camera light's) transforms into keyframes,
+# and mutes their constraints, so renders just read curves. Unbaking puts the live rig back.
+# What was there before the bake is remembered in custom properties on the baked object.
+
+
+EulerModes = ('XYZ', 'XZY', 'YXZ', 'YZX', 'ZXY', 'ZYX')
+
+
+# The camera of the rig an object belongs to. The object may be the camera itself, or one of the
+# empties the camera follows (Focus Rig, Zoom Rig, or Rotation Rig through the Zoom Rig).
+def find_rig_camera(ob):
+    if ob is None:
+        return None
+    if ob.type == 'CAMERA':
+        return ob
+    rig = object_rig(bpy.context.scene, ob)
+    if rig is not None:
+        cams = [member for member, role in rig_members(rig) if role == 'camera']
+        if cams:
+            return cams[0]
+    targets = {ob} | set(child for child in ob.children if child.type == 'EMPTY')
+    for cam in bpy.data.objects:
+        if cam.type == 'CAMERA' and any(getattr(con, "target", None) in targets for con in cam.constraints):
+            return cam
+    return None
+
+
+# Lights glued to a camera with Copy Transforms (the camera light).
+def find_cam_lights(cam):
+    return [ob for ob in bpy.data.objects if ob.type == 'LIGHT'
+            and any(con.type == 'COPY_TRANSFORMS' and con.target == cam for con in ob.constraints)]
+
+
+# Which keys of a curve can go, Ramer-Douglas-Peucker style: a segment keeps its worst key if that key is
+# further than tol from the straight line between the segment's ends, and the halves are checked again.
+# Returns a mask of the keys to keep.
+def simplify_keys(frames, values, tol):
+    keep = np.zeros(len(values), dtype=bool)
+    keep[0] = keep[-1] = True
+    todo = [(0, len(values) - 1)]
+    while todo:
+        a, b = todo.pop()
+        if b - a < 2:
+            continue
+        t = (frames[a + 1:b] - frames[a]) / (frames[b] - frames[a])
+        err = np.abs(values[a + 1:b] - (values[a] + t * (values[b] - values[a])))
+        worst = int(np.argmax(err))
+        if err[worst] > tol:
+            mid = a + 1 + worst
+            keep[mid] = True
+            todo += [(a, mid), (mid, b)]
+    return keep
+
+
+# Writes whole keyframe arrays into an F-curve with foreach_set, linear interpolation.
+def write_fcurve(action, data_path, index, frames, values):
+    fc = action.fcurves.new(data_path, index=index)
+    fc.keyframe_points.add(len(frames))
+    fc.keyframe_points.foreach_set("co", np.column_stack((frames, values)).astype(np.float32).ravel())
+    linear = bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items['LINEAR'].value
+    fc.keyframe_points.foreach_set("interpolation", [linear] * len(frames))
+    fc.update()
+    return fc
+
+
+# Plays the frame range once and bakes every object's transform into a new action each.
+# Returns the number of keys written per object.
+def bake_objects(scene, objects, frame_start, frame_end, simplify=True, tol=0.0001, mute=True):
+    frames = np.arange(frame_start, frame_end + 1, dtype=np.float64)
+    locs = {ob: np.empty((len(frames), 3)) for ob in objects}
+    rots = {ob: np.empty((len(frames), 3)) for ob in objects}
+    modes = {ob: ob.rotation_mode if ob.rotation_mode in EulerModes else 'XYZ' for ob in objects}
+    prev = {ob: None for ob in objects}
+    
+    old_frame = scene.frame_current
+    for i, frame in enumerate(range(frame_start, frame_end + 1)):
+        scene.frame_set(frame)
+        for ob in objects:
+            # What the object's own loc/rot need to be to land where the rig put it, parent included.
+            basis = ob.matrix_world
+            if ob.parent is not None:
+                basis = (ob.parent.matrix_world @ ob.matrix_parent_inverse).inverted() @ basis
+            euler = basis.to_euler(modes[ob], prev[ob]) if prev[ob] is not None else basis.to_euler(modes[ob])
+            prev[ob] = euler
+            locs[ob][i] = basis.to_translation()
+            rots[ob][i] = euler
+    scene.frame_set(old_frame)
+    
+    written = {}
+    for ob in objects:
+        # Remember how things were, for unbake.
+        ob["qs_bake_basis"] = [v for row in ob.matrix_basis for v in row]
+        ob["qs_bake_mode"] = ob.rotation_mode
+        ob["qs_bake_mute"] = [int(con.mute) for con in ob.constraints]
+        anim = ob.animation_data or ob.animation_data_create()
+        ob["qs_bake_action"] = anim.action.name if anim.action else ""
+        
+        action = bpy.data.actions.new("QS Bake " + ob.name)
+        ob.rotation_mode = modes[ob]
+        count = 0
+        for path, values in (("location", locs[ob]), ("rotation_euler", rots[ob])):
+            for axis in range(3):
+                mask = simplify_keys(frames, values[:, axis], tol) if simplify else np.ones(len(frames), dtype=bool)
+                write_fcurve(action, path, axis, frames[mask], values[mask, axis])
+                count += int(mask.sum())
+        anim.action = action
+        ob["qs_baked"] = action.name
+        
+        if mute:
+            for con in ob.constraints:
+                con.mute = True
+        written[ob.name] = count
+    return written
+
+
+# Undoes bake_objects on an object: baked action gone, old action, transform and constraints back.
+def unbake_object(ob):
+    if "qs_baked" not in ob:
+        return False
+    
+    baked = bpy.data.actions.get(ob["qs_baked"])
+    anim = ob.animation_data
+    if anim is not None:
+        anim.action = bpy.data.actions.get(ob["qs_bake_action"]) if ob["qs_bake_action"] else None
+    if baked is not None and baked.users == 0:
+        bpy.data.actions.remove(baked)
+    
+    ob.rotation_mode = ob["qs_bake_mode"]
+    basis = ob["qs_bake_basis"]
+    ob.matrix_basis = Matrix([basis[0:4], basis[4:8], basis[8:12], basis[12:16]])
+    for con, mute in zip(ob.constraints, ob["qs_bake_mute"]):
+        con.mute = bool(mute)
+    
+    for key in ("qs_baked", "qs_bake_action", "qs_bake_basis", "qs_bake_mode", "qs_bake_mute"):
+        del ob[key]
+    return True
+
+
+# ======================================================
+# Camera moves. The complex rig's Rotation Rig and Zoom Rig are there to be animated, so instead of
+# keying them by hand, a move is computed for the whole frame range at once with numpy and written
+# straight into their F-curves, one key per frame, one foreach_set per channel.
+# Every move only owns its own channels and replaces them when run again, so moves on different
+# channels add up: an orbit (Rotation Rig Z), a crane (Rotation Rig X) and a push-in (Zoom Rig location)
+# can all be on the same rig. Handheld noise goes into the delta transforms, on top of everything else.
+
+
+# Eased progress, 0 to 1, for progress t (0 to 1).
+def ease(t, kind):
+    if kind == 'EASE_IN_OUT':
+        return t * t * (3 - 2 * t)
+    if kind == 'EASE_IN':
+        return t * t
+    if kind == 'EASE_OUT':
+        return 1 - (1 - t) * (1 - t)
+    return t
+
+
+# Smooth noise, about -1 to 1: random values every 'period' frames, blended smoothly, plus two
+# finer layers at half the size each. Same rng state, same noise.
+def smooth_noise(rng, count, period, octaves=3):
+    t = np.arange(count) / max(period, 1e-6)
+    out = np.zeros(count)
+    total = 0.0
+    for octave in range(octaves):
+        amp = 0.5 ** octave
+        knots = rng.uniform(-1, 1, int(t[-1]) + 2 if count else 1)
+        i = np.floor(t).astype(int)
+        f = t - i
+        f = f * f * (3 - 2 * f)
+        out += amp * (knots[i] * (1 - f) + knots[i + 1] * f)
+        total += amp
+        t = t * 2
+    return out / total
+
+
+# The values of a move for every frame, by channel: {(role, data path, index): values}.
+# start holds where the rig is now: 'pan', 'tilt' (Rotation Rig Z, X) and 'distance' (Zoom Rig).
+# Zoom Rig channels are 'distance' here, the rig's own location is worked out by apply_motion.
+def motion_channels(kind, count, start, settings):
+    t = ease(np.linspace(0, 1, count), settings['ease'])
+    if kind == 'ORBIT':
+        return {('rotation', "rotation_euler", 2): start['pan'] + t * settings['turns'] * 2 * np.pi}
+    if kind == 'CRANE':
+        # The camera sits on the rotation rig's -Y, turning it the other way round X lifts it.
+        return {('rotation', "rotation_euler", 0): start['tilt'] - t * settings['angle']}
+    if kind == 'DOLLY':
+        return {('zoom', "distance", 1): np.maximum(start['distance'] - t * settings['distance'], 0.01)}
+    if kind == 'PUSH_IN':
+        return {('zoom', "distance", 1): start['distance'] * (1 - t * settings['amount'])}
+    
+    # Handheld: slow sway in pan and tilt, a little less roll, and some breathing in and out.
+    rng = np.random.default_rng(settings['seed'])
+    period = settings['fps'] / 2
+    shake = settings['shake']
+    return {('rotation', "delta_rotation_euler", 0): shake * smooth_noise(rng, count, period),
+            ('rotation', "delta_rotation_euler", 1): shake * 0.3 * smooth_noise(rng, count, period),
+            ('rotation', "delta_rotation_euler", 2): shake * smooth_noise(rng, count, period),
+            ('zoom', "delta_location", 1): shake * start['distance'] * 0.5 * smooth_noise(rng, count, period * 2)}
+
+
+# The first key of a channel, or default when it isn't animated. Moves start from there, so running
+# one again starts from the same place and not from wherever the last run left the current frame.
+def first_key(ob, path, index, default):
+    anim = ob.animation_data
+    fc = anim.action.fcurves.find(path, index = index) if anim is not None and anim.action is not None else None
+    return fc.keyframe_points[0].co[1] if fc is not None and len(fc.keyframe_points) else default
+
+
+# Writes a move into the rig (roles from rig_roles) over frames frame_start to frame_end.
+# Channels the move owns are replaced, the rest is left alone. Returns the number of keys written.
+def apply_motion(roles, kind, frame_start, frame_end, settings):
+    rotation = roles['rotation']
+    zoom = roles['zoom']
+    # Where the zoom rig is along the rotation rig's Y, the same way set_cam_distance sees it.
+    local = zoom.matrix_parent_inverse @ Vector([first_key(zoom, "location", i, zoom.location[i]) for i in range(3)])
+    start = {'pan': first_key(rotation, "rotation_euler", 2, rotation.rotation_euler.z),
+             'tilt': first_key(rotation, "rotation_euler", 0, rotation.rotation_euler.x), 'distance': abs(local.y) or 10}
+    
+    frames = np.arange(frame_start, frame_end + 1, dtype=np.float64)
+    channels = {}
+    for (role, path, index), values in motion_channels(kind, len(frames), start, settings).items():
+        if path == "distance":
+            # The zoom rig's location for each distance: back through the parent inverse, every frame at once.
+            points = np.tile(np.array(local), (len(frames), 1))
+            points[:, 1] = -values if local.y <= 0 else values
+            inverse = np.array(zoom.matrix_parent_inverse.inverted())
+            locations = points @ inverse[:3, :3].T + inverse[:3, 3]
+            for axis in range(3):
+                channels[(role, "location", axis)] = locations[:, axis]
+        else:
+            channels[(role, path, index)] = values
+    
+    count = 0
+    for (role, path, index), values in channels.items():
+        ob = roles[role]
+        anim = ob.animation_data or ob.animation_data_create()
+        if anim.action is None:
+            anim.action = bpy.data.actions.new("QS Motion " + ob.name)
+        old = anim.action.fcurves.find(path, index = index)
+        if old is not None:
+            anim.action.fcurves.remove(old)
+        write_fcurve(anim.action, path, index, frames, values)
+        count += len(frames)
+    return count
+
+
+# ======================================================
+# Rig registry. Every spawned rig gets an id, and every member object is stamped with custom properties:
+# "qs_rig" (the id), "qs_kind" (what was spawned, like "light:kfh" or "camrig:complex") and "qs_role"
+# (its part in the rig, like "base", "focus", "camera" or "light:Key Light").
+# The scene keeps the list of rigs (QSProps.Rigs), saved with the file. On top of that sits an
+# in-memory index by id and kind, so looking a rig up, or all rigs of a kind, never means going
+# through bpy.data.objects. The index is rebuilt when it no longer matches the list (after undo, say).
+
+
+RigIndex = {}
+
+# Dropdown items of the rig kinds in the scene. Blender needs these kept alive while the dropdown shows.
+RigKindItems = []
+
+
+def rig_index(scene):
+    rigs = scene.QSProp.Rigs
+    index = RigIndex.get(scene.name)
+    if index is None or index['count'] != len(rigs):
+        index = {'ids': {}, 'kinds': {}, 'count': len(rigs)}
+        for i, item in enumerate(rigs):
+            index['ids'][item.name] = i
+            index['kinds'].setdefault(item.Kind, []).append(item.name)
+        RigIndex[scene.name] = index
+    return index
+
+
+# A rig by id, or None.
+def find_rig(scene, rig_id):
+    rigs = scene.QSProp.Rigs
+    i = rig_index(scene)['ids'].get(rig_id)
+    if i is None or i >= len(rigs) or rigs[i].name != rig_id:
+        # Stale index, build it again and have another look.
+        RigIndex.pop(scene.name, None)
+        i = rig_index(scene)['ids'].get(rig_id)
+        if i is None:
+            return None
+    return rigs[i]
+
+
+# The rig an object belongs to, or None.
+def object_rig(scene, ob):
+    rig_id = ob.get("qs_rig") if ob is not None else None
+    return find_rig(scene, rig_id) if rig_id else None
+
+
+# Rigs of a kind. Like find_rig, a stale index (a rig removed or changed kind) is built again once.
+def rigs_of_kind(scene, kind):
+    for attempt in range(2):
+        rigs = [find_rig(scene, rig_id) for rig_id in rig_index(scene)['kinds'].get(kind, [])]
+        if all(rig is not None and rig.Kind == kind for rig in rigs):
+            return rigs
+        RigIndex.pop(scene.name, None)
+    return [rig for rig in rigs if rig is not None and rig.Kind == kind]
+
+
+# The index only knows the scene by name, so it starts over after loading a file, undo and redo.
+@bpy.app.handlers.persistent
+def rig_index_reset(*args):
+    RigIndex.clear()
+
+
+# Objects of a rig that still exist, with their roles.
+def rig_members(rig):
+    return [(m.Object, m.Role) for m in rig.Members if m.Object is not None]
+
+
+# Adds a freshly spawned rig to the registry. objects are its members, root the one that moves the rest.
+# Returns the registry entry.
+def register_rig(scene, kind, root, objects):
+    # The index from before the rig is added, so it's only counted once.
+    index = rig_index(scene)
+    rig_id = uuid.uuid4().hex[:12]
+    rig = scene.QSProp.Rigs.add()
+    rig.name = rig_id
+    rig.Kind = kind
+    rig.Root = root
+    for ob in objects:
+        ob["qs_rig"] = rig_id
+        ob["qs_kind"] = kind
+        member = rig.Members.add()
+        member.Object = ob
+        member.Role = ob.get("qs_role", "")
+    rig_params_init(rig)
+    
+    index['ids'][rig_id] = len(scene.QSProp.Rigs) - 1
+    index['kinds'].setdefault(kind, []).append(rig_id)
+    index['count'] = len(scene.QSProp.Rigs)
+    return rig
+
+
+# Takes rigs out of the registry (not out of the scene). Removing from the end keeps the other positions right.
+def unregister_rigs(scene, rig_ids):
+    rigs = scene.QSProp.Rigs
+    index = rig_index(scene)['ids']
+    for i in sorted((index[r] for r in rig_ids if r in index), reverse=True):
+        rigs.remove(i)
+    RigIndex.pop(scene.name, None)
+
+
+# Forgets rigs whose objects are all gone (deleted by hand, for example).
+def prune_rigs(scene):
+    unregister_rigs(scene, [rig.name for rig in scene.QSProp.Rigs if not rig_members(rig)])
+
+
+# Members of a rig by role. Roles that several members share (like the cameras of an array) keep the first.
+def rig_roles(rig):
+    roles = {}
+    for ob, role in rig_members(rig):
+        roles.setdefault(role, ob)
+    return roles
+
+
+# Fills in a new rig's settings from what was actually spawned. Written as plain values,
+# so no update runs and nothing gets patched.
+def rig_params_init(rig):
+    if rig.Root is None:
+        return
+    params = rig.Root.QSRigParams
+    roles = rig_roles(rig)
+    cam = roles.get('camera')
+    if cam is not None:
+        params["Lens"] = cam.data.lens
+        params["CamDistance"] = (cam.matrix_world.translation - roles['focus'].matrix_world.translation).length or 10
+        params["CamLight"] = 'light' in roles
+        if 'light' in roles:
+            params["CamLightEnergy"] = roles['light'].data.energy
+
+
+# Data that is shared (linked duplicates) gets its own copy before it is changed, so the other rigs keep theirs.
+def own_data(ob):
+    if ob.data.users > 1:
+        ob.data = ob.data.copy()
+    return ob.data
+
+
+# Moves the camera of a rig to distance from the focus, along the line it is on now.
+def set_cam_distance(roles, distance):
+    if 'zoom' in roles:
+        # The zoom rig may only slide along the rotation rig's Y.
+        zoom = roles['zoom']
+        local = zoom.matrix_parent_inverse @ zoom.location
+        local.y = -distance if local.y <= 0 else distance
+        zoom.location = zoom.matrix_parent_inverse.inverted() @ local
+    else:
+        cam = roles['camera']
+        focus = roles['focus'].location
+        direction = (cam.location - focus).normalized() if (cam.location - focus).length > 1e-9 else Vector((0, -1, 0))
+        cam.location = focus + direction * distance
+
+
+# Update callback of every rig setting. Only the objects the setting is about are touched.
+def rig_params_update(params, what):
+    root = params.id_data
+    rig = object_rig(bpy.context.scene, root)
+    if rig is None:
+        return
+    roles = rig_roles(rig)
+    members = rig_members(rig)
+    
+    if what == 'ENERGY':
+        for ob, role in members:
+            if role.startswith("light:"):
+                own_data(ob).energy = ob.get("qs_energy", ob.data.energy) * params.Energy
+    
+    elif what == 'DISTANCE':
+        # The lights and the light focus share a parent, so their locations are all in the same space.
+        # Presets without a light focus scale about the middle of the lights' home spots instead, so
+        # the lights keep their average height rather than being pushed up off the floor.
+        homes = [Vector(ob["qs_home"]) for ob, role in members if role.startswith("light:") and "qs_home" in ob]
+        if 'focus' in roles:
+            focus = Vector(roles['focus'].get("qs_home", roles['focus'].location))
+        elif homes:
+            focus = sum(homes, Vector()) / len(homes)
+        for ob, role in members:
+            if role.startswith("light:") and "qs_home" in ob:
+                ob.location = focus + (Vector(ob["qs_home"]) - focus) * params.Distance
+    
+    elif what == 'LENS' and 'camera' in roles:
+        own_data(roles['camera']).lens = params.Lens
+    
+    elif what == 'CAM_DISTANCE' and 'camera' in roles:
+        set_cam_distance(roles, params.CamDistance)
+    
+    elif what == 'CAM_LIGHT' and 'camera' in roles:
+        spot = roles.get('light')
+        if spot is None and params.CamLight:
+            # Rigs made without the light get one the first time it is switched on.
+            spot = new_cam_light(roles['camera'])
+            spot["qs_role"] = 'light'
+            spot["qs_rig"] = rig.name
+            spot["qs_kind"] = rig.Kind
+            spot.data.energy = params.CamLightEnergy
+            for collection in roles['camera'].users_collection:
+                collection.objects.link(spot)
+            member = rig.Members.add()
+            member.Object = spot
+            member.Role = 'light'
+        elif spot is not None:
+            spot.hide_viewport = not params.CamLight
+            spot.hide_render = not params.CamLight
+    
+    elif what == 'CAM_LIGHT_ENERGY' and 'light' in roles:
+        own_data(roles['light']).energy = params.CamLightEnergy
+
+
+# Readable name of a rig kind.
+def rig_kind_label(kind):
+    group, sep, key = kind.partition(":")
+    if group == "light":
+        return dict((item[0], item[1]) for item in PresetItems).get(key, key)
+    if group == "camrig":
+        return key.capitalize() + " Cam Rig"
+    if group == "stage":
+        return StageNames.get(key.upper(), key)
+    if group == "hdri":
+        return "HDRI World"
+    return "Camera Array" if group == "camarray" else kind
+
+
+def rig_kind_items(scene):
+    RigKindItems.clear()
+    for kind, ids in sorted(rig_index(scene)['kinds'].items()):
+        RigKindItems.append((kind, rig_kind_label(kind) + " (" + str(len(ids)) + ")", ""))
+    if not RigKindItems:
+        RigKindItems.append(('NONE', "No rigs", ""))
+    return RigKindItems
+
+
+# Does something to every rig of a kind. action is one of:
+# SELECT, HIDE, SHOW, DELETE, ENERGY (multiply light energy by value), LENS (set camera lens to value).
+# Returns how many rigs were touched.
+def rigs_bulk(scene, view_layer, kind, action, value=None):
+    rigs = rigs_of_kind(scene, kind)
+    members = [ob for rig in rigs for ob, role in rig_members(rig)]
+    
+    if action == 'SELECT':
+        for ob in members:
+            if ob.name in view_layer.objects:
+                ob.select_set(True, view_layer=view_layer)
+    elif action in ('HIDE', 'SHOW'):
+        for ob in members:
+            if ob.name in view_layer.objects:
+                ob.hide_set(action == 'HIDE', view_layer=view_layer)
+            ob.hide_render = action == 'HIDE'
+    elif action == 'DELETE':
+        data = set(ob.data for ob in members if ob.data is not None)
+        unregister_rigs(scene, [rig.name for rig in rigs])
+        bpy.data.batch_remove(members)
+        bpy.data.batch_remove([d for d in data if d.users == 0])
+    elif action == 'ENERGY':
+        # Shared light data (linked duplicates) only gets multiplied once. The energies the rig settings
+        # work from are scaled too, or the next change in the Rig Settings panel would undo this.
+        lights = set(ob for ob in members if ob.type == 'LIGHT')
+        for ldata in set(ob.data for ob in lights):
+            ldata.energy *= value
+        for ob in lights:
+            if "qs_energy" in ob:
+                ob["qs_energy"] *= value
+        for rig in rigs:
+            roles = rig_roles(rig)
+            if rig.Root is not None and 'camera' in roles and 'light' in roles:
+                rig.Root.QSRigParams["CamLightEnergy"] = roles['light'].data.energy
+    elif action == 'LENS':
+        for camdata in set(ob.data for ob in members if ob.type == 'CAMERA'):
+            camdata.lens = value
+    return len(rigs)
+
+
+# ======================================================
+# Batch staging. Making hundreds of rigs in one execute() freezes Blender until it is done, so the
+# batch operator builds them from a timer instead: every tick it builds rigs for a few milliseconds
+# (BatchSlice), then hands control back so the viewport stays usable. Esc throws away everything the
+# batch made so far. Nothing in the batch calls other operators, so the whole batch is one undo step.
+
+
+# Where the rigs of a batch go: a square grid centered on origin, in rows along X.
+def batch_offsets(count, spacing, origin=(0, 0, 0)):
+    side = int(np.ceil(np.sqrt(count)))
+    n = np.arange(count)
+    grid = np.stack([n % side, n // side, np.zeros(count)], axis=1).astype(float)
+    grid[:, :2] -= (side - 1) / 2
+    return grid * spacing + np.asarray(origin, dtype=float)
+
+
+# Builds one rig of a batch, offset by offset. Returns (rig kind for the registry, root, objects made).
+# The view layer is left alone, the caller updates it once per tick.
+def spawn_batch_rig(what, collection, scene, mode, cam_light, offset):
+    if what.startswith("CAM_"):
+        kind = what[4:]
+        rig = make_cam_rig(kind, collection, None, scene, cam_light, mode)
+        root, made, rig_kind = rig['focus'], list(rig.values()), "camrig:" + kind.lower()
+    else:
+        if mode == 'INSTANCE':
+            root, made = spawn_library_instance(what, "Set Base " + light_preset(what)['tag'], collection)
+        elif mode == 'LINKED':
+            root, made = spawn_library_linked(what, collection)
+        else:
+            root, made = spawn_light_preset(what, collection)
+        rig_kind = "light:" + what
+    
+    # Only the top of each rig is moved, parents and constraints bring the rest along.
+    offset = Vector(offset)
+    for ob in made:
+        if ob.parent is None:
+            ob.location = ob.location + offset
+    return rig_kind, root, made
+
+
+# The rigs of a batch, built one by one. Yields after every rig, so it can be run in slices.
+# Everything made ends up in made (objects) and rig_ids (registry entries), for rolling back.
+def batch_work(scene, collection, what, count, spacing, origin, mode, cam_light, made, rig_ids):
+    for offset in batch_offsets(count, spacing, origin):
+        rig_kind, root, objects = spawn_batch_rig(what, collection, scene, mode, cam_light, offset)
+        made.extend(objects)
+        rig_ids.append(register_rig(scene, rig_kind, root, objects).name)
+        yield
+
+
+# Runs work until it is done or budget (seconds) is used up. Returns how many steps ran,
+# and whether the work is finished.
+def run_slice(work, budget):
+    end = time.perf_counter() + budget
+    steps = 0
+    for _ in work:
+        steps += 1
+        if time.perf_counter() >= end:
+            return steps, False
+    return steps, True
+
+
+# Removes everything a cancelled batch made: its objects, their now unused light / camera data,
+# and its entries in the rig registry.
+def batch_rollback(scene, made, rig_ids):
+    data = set(ob.data for ob in made if ob.data is not None)
+    bpy.data.batch_remove(made)
+    bpy.data.batch_remove([d for d in data if d.users == 0])
+    unregister_rigs(scene, rig_ids)
+    made.clear()
+    rig_ids.clear()
+
+
+# Progress of the running batch, shown in the Rigs panel.
+BatchProgress = {'done': 0, 'total': 0, 'running': False}
+
+
+# ======================================================
+# Below is a group of classes that governs panel displays. Basically displayed menus.
+
+     
+# Render Setting panel. Will display to user, the enum list 
+# of dropdown menu from the custom properties above.
+# In this panel, user can select screen resolution and ratio.
+class RendSet(bpy.types.Panel):
+    bl_label = "Render Settings"
+    bl_idname = "quickstage_PT_RendSet"
+    bl_space_type = "VIEW_3D"               # Dictates which screen its displayed, here its 3D view
+    bl_region_type = "UI"                   # Dictates which section of the screen its displayed in, here its the tab groups
+    bl_category = "Quick Stage"             # Tab name
+    bl_options = {'DEFAULT_CLOSED'}         # When displayed, panel will be by default in compact view
+    
+    # Each panel class has a draw function,
+    # which will draw buttons, menus, etc.
+    def draw(self, context):    
+        
+        # First, declare variables
+        layout = self.layout                # layout is the panel's layout - displaying line per line.
+        scene = context.scene               # scene is the current scene in context.
+        QSData = scene.QSProp               # QSData is pointed to our custom properties pointer. (Under the hood, Blender is written in C/C++)
+        
+        layout.prop(QSData, "ScrRat")       # Make a dropdown menu, based on custom properties' ScrRat (screen ratio)
+        layout.operator("object.scrrat")    # Make a button that execute a function-like class, that sets the screen ratio
+        layout.prop(QSData, "ScrReso")      # same like layout.prop(QSData, "ScrRat"), but for screen resolution
+        layout.operator("object.scrreso")   # same, another button for a function-like class, sets screen resolution
+        
+        # Quality tier, with how long a frame took on the reference scene (only once the tiers have been timed here).
+        layout.prop(QSData, "Quality")
+        timing = tier_timings().get(QSData.Quality)
+        if timing is not None:
+            layout.label(text = "Reference scene: %.1f s per frame" % timing, icon = 'TIME')
+        layout.operator("object.qsquality")
+        
+        # Render only the part of the frame the subject is in.
+        box = layout.box()
+        row = box.row()
+        row.operator("object.qscrop", icon = 'SELECT_SET')
+        row.operator("object.qscropclear", text = "", icon = 'X')
+        if QSData.CropEnable:
+            box.label(text = "Subject: " + ", ".join(ob.name for ob in crop_objects(scene)))
+            row = box.row()
+            row.prop(QSData, "CropMargin")
+            row.prop(QSData, "CropPerFrame")
+            box.prop(QSData, "CropBackground")
+            if QSData.CropBackground == 'FLAT':
+                box.prop(QSData, "CropColor")
+            elif QSData.CropBackground == 'PLATE':
+                box.prop(QSData, "CropPlate")
+                row = box.row()
+                row.prop(QSData, "CropPlateSamples")
+                row.operator("object.qscropplate")
+
+
+# Panel for making camera rigs.
+# Users can choose, make a simple or complex rig, with or without light.
+class CamRigPnl(bpy.types.Panel):
+    bl_label = "Camera Quick Rig"
+    bl_idname = "quickstage_PT_CamRig"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Quick Stage"
+    bl_options = {'DEFAULT_CLOSED'}
+    
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        QSData = scene.QSProp
+        
+        layout.prop(QSData, "CamLitRig")
+        row = layout.row()
+        row.prop(QSData, "CamFrame")
+        if QSData.CamFrame:
+            row.prop(QSData, "CamFrameMargin")
+        layout.prop(QSData, "LibMode")
+        layout.operator("object.crigs")
+        layout.operator("object.crigc")
+        
+        # Baking the selected rig to keyframes, and back.
+        box = layout.box()
+        row = box.row()
+        row.prop(QSData, "BakeSimplify")
+        row.prop(QSData, "BakeMute")
+        if QSData.BakeSimplify:
+            box.prop(QSData, "BakeTol")
+        row = box.row(align = True)
+        row.operator("object.qsbake")
+        row.operator("object.qsunbake")
+        
+        # Camera moves keyed into the complex rig.
+        box = layout.box()
+        box.prop(QSData, "MotionKind")
+        if QSData.MotionKind == 'HANDHELD':
+            row = box.row()
+            row.prop(QSData, "MotionShake")
+            row.prop(QSData, "MotionSeed")
+        else:
+            box.prop(QSData, "MotionEase")
+            box.prop(QSData, {'ORBIT': "MotionTurns", 'CRANE': "MotionAngle", 'DOLLY': "MotionDistance", 'PUSH_IN': "MotionAmount"}[QSData.MotionKind])
+        row = box.row(align = True)
+        row.operator("object.qsmotion")
+        row.operator("object.qsmotionclear")
+        
+        # Camera array, a whole bunch of simple rigs sharing one focus point.
+        box = layout.box()
+        box.prop(QSData, "ArrCount")
+        box.prop(QSData, "ArrLayout")
+        box.prop(QSData, "ArrRadius")
+        if QSData.ArrLayout == 'RING':
+            box.prop(QSData, "ArrHeight")
+        elif QSData.ArrLayout == 'GRID':
+            box.prop(QSData, "ArrSpacing")
+        elif QSData.ArrLayout == 'SPHERE':
+            box.prop(QSData, "ArrHemi")
+        box.operator("object.crigarr")
+        
+        # Leaving out what the rig's camera never sees.
+        box = layout.box()
+        box.prop(QSData, "CullMode")
+        row = box.row()
+        row.prop(QSData, "CullMargin")
+        row.prop(QSData, "CullFrameMargin")
+        box.prop(QSData, "CullStep")
+        row = box.row()
+        row.prop(QSData, "CullLights")
+        row.prop(QSData, "CullLightDistance")
+        row = box.row(align = True)
+        row.operator("object.qscull")
+        row.operator("object.qsuncull")
+
+
+# Panel for the stage generator: cycloramas, pedestals, risers and racks.
+class StagePnl(bpy.types.Panel):
+    bl_label = "Stage"
+    bl_idname = "quickstage_PT_Stage"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Quick Stage"
+    bl_options = {'DEFAULT_CLOSED'}
+    
+    def draw(self, context):
+        layout = self.layout
+        QSData = context.scene.QSProp
+        
+        layout.prop(QSData, "StageKind")
+        col = layout.column(align = True)
+        if QSData.StageKind == 'CYC':
+            for prop in ("CycWidth", "CycDepth", "CycHeight", "CycCove"):
+                col.prop(QSData, prop)
+        else:
+            for prop in ("width", "depth", "height", "bevel", "steps"):
+                if prop in StageParams[QSData.StageKind]:
+                    col.prop(QSData, "Stage" + prop.capitalize())
+        layout.operator("object.qsstage")
+
+
+# Panel for making preconfigured light set up rigs.
+# Users can choose from dropdown menu.
+class LitSetPnl(bpy.types.Panel):
+    bl_label = "Light Setup"
+    bl_idname = "quickstage_PT_LitSet"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Quick Stage"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        QSData = scene.QSProp
+        
+        thumb_request()
+        if preset_icon_items() is ThumbItems:
+            layout.template_icon_view(QSData, "MakeLight", show_labels = True, scale = 6.0, scale_popup = 5.0)
+        layout.prop(QSData, "MakeLight")
+        if ThumbState['proc'] is not None:
+            layout.label(text = "Rendering " + str(len(ThumbState['rendering'])) + " thumbnail(s)...", icon = 'RENDER_STILL')
+        row = layout.row()
+        row.prop(QSData, "LitFit")
+        if QSData.LitFit:
+            row.prop(QSData, "LitOrient")
+        layout.prop(QSData, "LibMode")
+        layout.operator("object.lsrig")
+        
+        box = layout.box()
+        box.label(text = "HDRI World")
+        box.prop(QSData, "HdriPath")
+        box.prop(QSData, "HdriProxy")
+        box.operator("object.qshdri")
+        
+        row = layout.row(align = True)
+        row.label(text = str(len(PresetHeaders)) + " preset file(s)")
+        row.operator("object.qspresetreload", text = "", icon = 'FILE_REFRESH')
+        for path, error in PresetErrors.items():
+            layout.label(text = os.path.basename(path) + ": " + error, icon = 'ERROR')
+
+
+# Settings of the rig the active object belongs to. Changes are patched into the rig right away.
+class RigParamsPnl(bpy.types.Panel):
+    bl_label = "Rig Settings"
+    bl_idname = "quickstage_PT_RigParams"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Quick Stage"
+    
+    @classmethod
+    def poll(cls, context):
+        return object_rig(context.scene, context.active_object) is not None
+    
+    def draw(self, context):
+        layout = self.layout
+        rig = object_rig(context.scene, context.active_object)
+        if rig.Root is None:
+            layout.label(text = "The root of this rig was deleted.")
+            return
+        
+        params = rig.Root.QSRigParams
+        layout.label(text = rig_kind_label(rig.Kind) + ": " + rig.Root.name)
+        if "qs_world" in rig.Root:
+            layout.prop(params, "HdriStrength")
+            layout.prop(params, "HdriRotation")
+        if rig.Kind.startswith("light:"):
+            if rig.Root.instance_type == 'COLLECTION':
+                layout.label(text = "Instanced from the library, spawn as linked duplicates to edit.")
+                return
+            layout.prop(params, "Energy")
+            layout.prop(params, "Distance")
+            layout.operator("object.qscapture", icon = 'EXPORT')
+        elif rig.Kind.startswith("camrig:"):
+            layout.prop(params, "Lens")
+            layout.prop(params, "CamDistance")
+            row = layout.row()
+            row.prop(params, "CamLight")
+            if params.CamLight:
+                row.prop(params, "CamLightEnergy")
+        elif rig.Kind == "camarray":
+            layout.label(text = "Use the Rigs panel for camera arrays.")
+
+
+# Panel for every rig spawned in the scene, by kind. Select, hide or delete them all at once,
+# or change the energy / lens of all of them.
+class RigsPnl(bpy.types.Panel):
+    bl_label = "Rigs"
+    bl_idname = "quickstage_PT_Rigs"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Quick Stage"
+    bl_options = {'DEFAULT_CLOSED'}
+    
+    def draw(self, context):
+        layout = self.layout
+        QSData = context.scene.QSProp
+        
+        layout.prop(QSData, "RigKind")
+        row = layout.row(align = True)
+        for action, label in (('SELECT', "Select"), ('HIDE', "Hide"), ('SHOW', "Show"), ('DELETE', "Delete")):
+            row.operator("object.qsrigbulk", text = label).action = action
+        
+        if QSData.RigKind.startswith("light:"):
+            row = layout.row(align = True)
+            row.prop(QSData, "RigEnergy")
+            row.operator("object.qsrigbulk", text = "Apply").action = 'ENERGY'
+        elif QSData.RigKind.startswith("cam"):
+            row = layout.row(align = True)
+            row.prop(QSData, "RigLens")
+            row.operator("object.qsrigbulk", text = "Apply").action = 'LENS'
+        layout.operator("object.qsrigprune")
+        
+        box = layout.box()
+        box.label(text = "Batch Staging")
+        box.prop(QSData, "BatchWhat")
+        row = box.row(align = True)
+        row.prop(QSData, "BatchCount")
+        row.prop(QSData, "BatchSpacing")
+        box.prop(QSData, "BatchSlice")
+        if BatchProgress['running']:
+            box.label(text = "Building %d / %d rigs, Esc to cancel" % (BatchProgress['done'], BatchProgress['total']), icon = 'TIME')
+        else:
+            box.operator("object.qsbatch")
+
+
+# Panel for the relight matrix. One render of every light preset, then an instant
+# preview of any preset with per-light weights.
+class RelightPnl(bpy.types.Panel):
+    bl_label = "Relight Matrix"
+    bl_idname = "quickstage_PT_Relight"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Quick Stage"
+    bl_parent_id = "quickstage_PT_LitSet"
+    bl_options = {'DEFAULT_CLOSED'}
+    
+    def draw(self, context):
+        layout = self.layout
+        QSData = context.scene.QSProp
+        
+        layout.prop(QSData, "RelightDir")
+        layout.operator("object.qsrelight")
+        
+        if len(QSData.RelightLights):
+            layout.prop(QSData, "RelightPreset")
+            col = layout.column(align = True)
+            for item in QSData.RelightLights:
+                if item.Preset == QSData.RelightPreset:
+                    col.prop(item, "Weight", text = item.name)
+            layout.operator("object.qsrelightsheet")
+
+
+# Diagnostics panel, closed by default, under Render Settings. The latest operator records,
+# newest first, and the log / profile switches.
+class DiagPnl(bpy.types.Panel):
+    bl_label = "Diagnostics"
+    bl_idname = "quickstage_PT_Diag"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Quick Stage"
+    bl_parent_id = "quickstage_PT_RendSet"
+    bl_options = {'DEFAULT_CLOSED'}
+    
+    def draw(self, context):
+        layout = self.layout
+        QSData = context.scene.QSProp
+        
+        layout.prop(QSData, "DiagLog")
+        if QSData.DiagLog:
+            layout.prop(QSData, "DiagLogPath")
+        layout.label(text = "Profile:")
+        layout.prop(QSData, "DiagProfile")
+        
+        col = layout.column(align = True)
+        for record in reversed(DiagRecords):
+            memory = "" if record['peak_memory_kb'] is None else "  +" + str(record['peak_memory_kb']) + " KB"
+            col.label(text = "%s  %.1f ms  +%d obj  +%d data  %d upd%s" % (
+                record['operator'], record['seconds'] * 1000, record['objects'], record['datablocks'],
+                record['depsgraph_updates'], memory))
+            if 'log_error' in record:
+                col.label(text = "Not logged: " + record['log_error'], icon = 'ERROR')
+        if not DiagRecords:
+            col.label(text = "Nothing recorded yet.")
+        layout.operator("object.qsdiagclear")
+
+
+# The list rows of the render queue.
+# (Blender wants list classes to be named like this, with _UL_ in the middle.)
+class QS_UL_RendJobs(bpy.types.UIList):
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        row = layout.row(align = True)
+        row.prop(item, "Enabled", text = "")
+        row.label(text = item.Camera.name if item.Camera else "(no camera)", icon = 'CAMERA_DATA')
+        row.label(text = str(item.FrameStart) + " - " + str(item.FrameEnd))
+
+
+# Panel for the render queue. The list of jobs, the settings of the selected job,
+# and the button that renders them all in the background.
+class RendQueuePnl(bpy.types.Panel):
+    bl_label = "Render Queue"
+    bl_idname = "quickstage_PT_RendQueue"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Quick Stage"
+    bl_options = {'DEFAULT_CLOSED'}
+    
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        QSData = scene.QSProp
+        
+        row = layout.row()
+        row.template_list("QS_UL_RendJobs", "", QSData, "RendJobs", QSData, "RendJobIdx", rows = 3)
+        col = row.column(align = True)
+        col.operator("object.qsjobadd", icon = 'ADD', text = "")
+        col.operator("object.qsjobdel", icon = 'REMOVE', text = "")
+        
+        if 0 <= QSData.RendJobIdx < len(QSData.RendJobs):
+            job = QSData.RendJobs[QSData.RendJobIdx]
+            box = layout.box()
+            box.prop(job, "Camera")
+            row = box.row(align = True)
+            row.prop(job, "FrameStart")
+            row.prop(job, "FrameEnd")
+            box.prop(job, "ScrRat")
+            box.prop(job, "ScrReso")
+            box.prop(job, "Output")
+        
+        layout.operator("object.qsjobrigs")
+        row = layout.row()
+        row.prop(QSData, "RendWorkers")
+        row.prop(QSData, "RendMultiview")
+        layout.operator("object.qsqueue")
+        
+        box = layout.box()
+        box.label(text = "Tiled Still")
+        box.prop(QSData, "TileOutput")
+        row = box.row(align = True)
+        row.prop(QSData, "TilesX")
+        row.prop(QSData, "TilesY")
+        row = box.row()
+        row.prop(QSData, "TileOverlap")
+        row.prop(QSData, "TileResume")
+        box.operator("object.qstiled")
+
+
+# ======================================================
+# Below is a group of classes that are programmed to do a certain task 
+# when called, acts like function. Takes an argument, usually from
+# the custom properties data, context, and self, then execute lines of codes.
+
+
+# Ratio Change (class RatChg), takes in the current screen height, and multiplies it based on the selected ratio
+# then applying it to the screen width.
+# The math lives in ratio_width/apply_render_size, so the same thing works from scripts and the command line.
+@instrumented
+class RatChg(bpy.types.Operator):
+    bl_label = "Change Ratio"
+    bl_idname = "object.scrrat"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        # Same like in def draw, variables are assigned inside the execute function, so that it will be refreshed
+        # with the latest data everytime the class is called.
+        QSData = context.scene.QSProp
+        
+        apply_render_size(context.scene.render, QSData.ScrRat)
+        
+        # A report function that appears on the bottom of the screen.
+        # Useful for reporting error, exception, etc. But this one ('INFO')
+        # is just a simple notification.
+        self.report({'INFO'}, 'Render set to ' + RatioTable[QSData.ScrRat][2])
+        return {'FINISHED'}
+
+
+# Based on the selected resoltion from the dropdown menu, will change the render resolution 
+# of the camera.
+@instrumented
+class ResoChg(bpy.types.Operator):
+    bl_label = "Change Render Resolution"
+    bl_idname = "object.scrreso"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    # This is pretty much the same as RatChg, but deals with resolution instead.
+    # The ratio is applied in the same step, so the width follows along.
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        
+        apply_render_size(context.scene.render, QSData.ScrRat, QSData.ScrReso)
+        
+        self.report({'INFO'}, 'Resolution is now: ' + str(ResoTable[QSData.ScrReso]) + 'p')
+        return {'FINISHED'}
+ 
+
+# Applies the chosen render quality tier.
+@instrumented
+class QualChg(bpy.types.Operator):
+    bl_label = "Apply Render Quality"
+    bl_idname = "object.qsquality"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        apply_quality(context.scene, QSData.Quality)
+        self.report({'INFO'}, 'Render quality is now: ' + dict((k, n) for k, n, d in QualityItems)[QSData.Quality])
+        return {'FINISHED'}
+
+
+# Class for making simple camera rig.
+# Just a thin wrapper, the actual building happens in build_cam_rig.
+@instrumented
+class CamRigSmpl(bpy.types.Operator):
+    bl_label = "Make Simple Cam Rig"
+    bl_idname = "object.crigs"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        
+        rig = spawn_cam_rig('SIMPLE', context, QSData.CamLitRig, QSData.LibMode)
+        frame_cam_rig(rig, context)
+        register_rig(context.scene, "camrig:simple", rig['focus'], rig.values())
+        context.view_layer.objects.active = rig['focus']
+        
+        if QSData.CamLitRig == True:
+            self.report({'INFO'}, 'Simple camera rig, with camera light made.')
+        else:
+            self.report({'INFO'}, 'Simple camera rig made.')
+        return {'FINISHED'}
+
+
+# Class for making complex camera rig.
+@instrumented
+class CamRigCmplx(bpy.types.Operator):
+    bl_label = "Make Complex Cam Rig"
+    bl_idname = "object.crigc"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        
+        rig = spawn_cam_rig('COMPLEX', context, QSData.CamLitRig, QSData.LibMode)
+        frame_cam_rig(rig, context)
+        register_rig(context.scene, "camrig:complex", rig['focus'], rig.values())
+        context.view_layer.objects.active = rig['focus']
+        
+        if QSData.CamLitRig == True:
+            self.report({'INFO'}, 'Complex camera rig, with camera light made.')
+        else:
+            self.report({'INFO'}, 'Complex camera rig made.')
+        return {'FINISHED'}
+
+
+# Class for making an array of simple camera rigs, all looking at the same focus point.
+@instrumented
+class CamRigArr(bpy.types.Operator):
+    bl_label = "Make Camera Array"
+    bl_idname = "object.crigarr"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        
+        # With Frame Selection on, the array circles the middle of the selection.
+        focus = (0, 0, 0)
+        targets = frame_targets(context)
+        if QSData.CamFrame and targets:
+            focus = tuple(selection_bounds(targets, context.evaluated_depsgraph_get())[0])
+        
+        rig = build_cam_array(QSData.ArrCount, QSData.ArrLayout, QSData.ArrRadius, spawn_collection(context),
+                              context.view_layer, QSData.ArrHeight, QSData.ArrHemi, QSData.ArrSpacing, context.scene, focus)
+        register_rig(context.scene, "camarray", rig['focus'], [rig['focus']] + rig['cameras'])
+        context.view_layer.objects.active = rig['focus']
+        
+        self.report({'INFO'}, 'Camera array made: ' + str(len(rig['cameras'])) + ' cameras.')
+        return {'FINISHED'}
+
+
+# Bakes the active object's camera rig over the scene's frame range.
+@instrumented
+class BakeRig(bpy.types.Operator):
+    bl_label = "Bake Rig"
+    bl_idname = "object.qsbake"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        scene = context.scene
+        
+        cam = find_rig_camera(context.active_object)
+        if cam is None:
+            self.report({'WARNING'}, 'Select a camera rig (camera or one of its empties) first.')
+            return {'CANCELLED'}
+        if "qs_baked" in cam:
+            self.report({'WARNING'}, cam.name + ' is already baked, unbake it first.')
+            return {'CANCELLED'}
+        
+        objects = [cam] + [ob for ob in find_cam_lights(cam) if "qs_baked" not in ob]
+        written = bake_objects(scene, objects, scene.frame_start, scene.frame_end,
+                               QSData.BakeSimplify, QSData.BakeTol, QSData.BakeMute)
+        self.report({'INFO'}, 'Rig baked: ' + ", ".join(name + " (" + str(keys) + " keys)" for name, keys in written.items()))
+        return {'FINISHED'}
+
+
+# The complex rig the active object belongs to, as roles. None if it isn't one.
+def motion_rig(context):
+    rig = object_rig(context.scene, context.active_object)
+    if rig is None:
+        return None
+    roles = rig_roles(rig)
+    return roles if 'rotation' in roles and 'zoom' in roles else None
+
+
+# Keys the chosen camera move into the selected complex rig, over the scene's frame range.
+@instrumented
+class CamMotion(bpy.types.Operator):
+    bl_label = "Key Move"
+    bl_idname = "object.qsmotion"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        scene = context.scene
+        roles = motion_rig(context)
+        if roles is None:
+            self.report({'WARNING'}, 'Select a complex camera rig first.')
+            return {'CANCELLED'}
+        
+        settings = {'ease': QSData.MotionEase, 'turns': QSData.MotionTurns, 'angle': QSData.MotionAngle,
+                    'distance': QSData.MotionDistance, 'amount': QSData.MotionAmount, 'shake': QSData.MotionShake,
+                    'seed': QSData.MotionSeed, 'fps': scene.render.fps / scene.render.fps_base}
+        start = time.perf_counter()
+        keys = apply_motion(roles, QSData.MotionKind, scene.frame_start, scene.frame_end, settings)
+        self.report({'INFO'}, '%s keyed: %d keys in %.1f ms' % (dict((k, n) for k, n, d in MotionItems)[QSData.MotionKind],
+                                                                 keys, (time.perf_counter() - start) * 1000))
+        return {'FINISHED'}
+
+
+# Takes every move off the selected complex rig. The rig goes back to where the first key had it.
+class CamMotionClear(bpy.types.Operator):
+    bl_label = "Clear Moves"
+    bl_idname = "object.qsmotionclear"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        roles = motion_rig(context)
+        if roles is None:
+            self.report({'WARNING'}, 'Select a complex camera rig first.')
+            return {'CANCELLED'}
+        
+        for ob in (roles['rotation'], roles['zoom']):
+            anim = ob.animation_data
+            if anim is None or anim.action is None:
+                continue
+            for fc in list(anim.action.fcurves):
+                path, index = fc.data_path, fc.array_index
+                if path not in ("rotation_euler", "location", "delta_rotation_euler", "delta_location"):
+                    continue
+                # Deltas are only ever the wobble, they go back to nothing.
+                value = 0.0 if path.startswith("delta_") else fc.keyframe_points[0].co[1] if len(fc.keyframe_points) else None
+                anim.action.fcurves.remove(fc)
+                if value is not None:
+                    getattr(ob, path)[index] = value
+        return {'FINISHED'}
+
+
+# Puts the live rig back on a baked camera (and its camera light).
+class UnbakeRig(bpy.types.Operator):
+    bl_label = "Unbake Rig"
+    bl_idname = "object.qsunbake"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        cam = find_rig_camera(context.active_object)
+        if cam is None or "qs_baked" not in cam:
+            self.report({'WARNING'}, 'Select a baked camera rig first.')
+            return {'CANCELLED'}
+        
+        for ob in [cam] + find_cam_lights(cam):
+            unbake_object(ob)
+        self.report({'INFO'}, 'Rig unbaked: ' + cam.name)
+        return {'FINISHED'}
+
+
+@instrumented
+class LitSetRig(bpy.types.Operator):
+    bl_label = "Make Light Setup"
+    bl_idname = "object.lsrig"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        self.QSData = context.scene.QSProp
+        
+        # Built-in presets are rows in LitPresets, user presets are files loaded (and checked) here on
+        # first use; the spawn engine does the rest. It goes straight through bpy.data, so no operator
+        # chain, no selection juggling, and only one view layer update at the very end.
+        # A user preset file can be gone or broken by now, so say so before anything is made.
+        try:
+            preset = light_preset(self.QSData.MakeLight)
+        except KeyError:
+            self.report({'ERROR'}, 'Light setup preset not found: ' + self.QSData.MakeLight)
+            return {'CANCELLED'}
+        except (OSError, ValueError) as err:
+            self.report({'ERROR'}, 'Light setup preset ' + self.QSData.MakeLight + ' could not be loaded: ' + str(err))
+            return {'CANCELLED'}
+        if self.QSData.LibMode == 'INSTANCE':
+            litbase, made = spawn_library_instance(self.QSData.MakeLight, "Set Base " + preset['tag'], spawn_collection(context), context.view_layer)
+        elif self.QSData.LibMode == 'LINKED':
+            litbase, made = spawn_library_linked(self.QSData.MakeLight, spawn_collection(context), context.view_layer)
+        else:
+            litbase, made = spawn_light_preset(self.QSData.MakeLight, spawn_collection(context), context.view_layer)
+        
+        # Fit to the selected subject, using the cached bounds.
+        report = preset_report(self.QSData.MakeLight)
+        targets = frame_targets(context)
+        if self.QSData.LitFit and targets:
+            center, low, high, radius = selection_bounds(targets, context.evaluated_depsgraph_get())
+            yaw = face_camera_yaw(center, context.scene.camera) if self.QSData.LitOrient else 0.0
+            scale = fit_light_preset(litbase, made, center, max(radius, 1e-4), yaw)
+            context.view_layer.update()
+            report += ' (scaled x%.3g)' % scale
+            if self.QSData.LibMode == 'INSTANCE':
+                report += ', energies not adjusted for instances'
+        
+        register_rig(context.scene, "light:" + self.QSData.MakeLight, litbase, made)
+        
+        # Make the base the active object so it can be grabbed right away.
+        context.view_layer.objects.active = litbase
+        
+        self.report({'INFO'}, report)
+        return {'FINISHED'}
 
-# ======================================================
-# Below is a group of classes that governs panel displays. Basically displayed menus.
 
-     
-# Render Setting panel. Will display to user, the enum list 
-# of dropdown menu from the custom properties above.
-# In this panel, user can select screen resolution and ratio.
-class RendSet(bpy.types.Panel):
-    bl_label = "Render Settings"
-    bl_idname = "quickstage_PT_RendSet"
-    bl_space_type = "VIEW_3D"               # Dictates which screen its displayed, here its 3D view
-    bl_region_type = "UI"                   # Dictates which section of the screen its displayed in, here its the tab groups
-    bl_category = "Quick Stage"             # Tab name
-    bl_options = {'DEFAULT_CLOSED'}         # When displayed, panel will be by default in compact view
+# Adds an HDRI world tied to the Set Base of the active light setup, or to a new Set Base at the 3D cursor.
+@instrumented
+class HdriAdd(bpy.types.Operator):
+    bl_label = "Add HDRI World"
+    bl_idname = "object.qshdri"
+    bl_options = {'REGISTER', 'UNDO'}
     
-    # Each panel class has a draw function,
-    # which will draw buttons, menus, etc.
-    def draw(self, context):    
+    def execute(self, context):
+        scene = context.scene
+        QSData = scene.QSProp
+        path = os.path.normpath(bpy.path.abspath(QSData.HdriPath))
+        if not os.path.isfile(path):
+            self.report({'WARNING'}, 'Choose an HDRI file first.')
+            return {'CANCELLED'}
         
-        # First, declare variables
-        layout = self.layout                # layout is the panel's layout - displaying line per line.
-        scene = context.scene               # scene is the current scene in context.
-        QSData = scene.QSProp               # QSData is pointed to our custom properties pointer. (Under the hood, Blender is written in C/C++)
+        rig = object_rig(scene, context.active_object)
+        if rig is not None and rig.Root is not None and rig.Kind.startswith(("light:", "hdri")):
+            base = rig.Root
+        else:
+            base = new_empty("Set Base HDRI", 'CIRCLE', 5, scene.cursor.location)
+            base["qs_role"] = "base"
+            link_objects([base], spawn_collection(context), context.view_layer)
+            register_rig(scene, "hdri", base, [base])
         
-        layout.prop(QSData, "ScrRat")       # Make a dropdown menu, based on custom properties' ScrRat (screen ratio)
-        layout.operator("object.scrrat")    # Make a button that execute a function-like class, that sets the screen ratio
-        layout.prop(QSData, "ScrReso")      # same like layout.prop(QSData, "ScrRat"), but for screen resolution
-        layout.operator("object.scrreso")   # same, another button for a function-like class, sets screen resolution
+        try:
+            world = hdri_world(scene, base, path, QSData.HdriProxy)
+        except (OSError, RuntimeError) as err:
+            self.report({'ERROR'}, 'Could not make the HDRI proxies: ' + str(err))
+            return {'CANCELLED'}
+        
+        context.view_layer.objects.active = base
+        self.report({'INFO'}, world.name + ' follows ' + base.name + ', full resolution for Final renders only.')
+        return {'FINISHED'}
 
 
-# Panel for making camera rigs.
-# Users can choose, make a simple or complex rig, with or without light.
-class CamRigPnl(bpy.types.Panel):
-    bl_label = "Camera Quick Rig"
-    bl_idname = "quickstage_PT_CamRig"
-    bl_space_type = "VIEW_3D"
-    bl_region_type = "UI"
-    bl_category = "Quick Stage"
-    bl_options = {'DEFAULT_CLOSED'}
+# Renders every light preset in one go, then shows the picked preset in the "QS Relight" image.
+class RelightRender(bpy.types.Operator):
+    bl_label = "Render Relight Matrix"
+    bl_idname = "object.qsrelight"
     
-    def draw(self, context):
-        layout = self.layout
+    def execute(self, context):
         scene = context.scene
-        QSData = scene.QSProp
+        folder = bpy.path.abspath(scene.QSProp.RelightDir)
         
-        layout.prop(QSData, "CamLitRig")
-        layout.operator("object.crigs")
-        layout.operator("object.crigc")
+        # A preset file that broke or went away since the last scan, passes that can't be removed or
+        # written, or a step Blender refuses all end up here. relight_render has cleaned up by then.
+        try:
+            files = relight_render(scene, context.view_layer, folder)
+        except (RuntimeError, OSError, ValueError, KeyError, AttributeError) as err:
+            self.report({'ERROR'}, 'Relight matrix failed: ' + str(err))
+            return {'CANCELLED'}
+        
+        relight_show(scene)
+        self.report({'INFO'}, 'Relight matrix rendered: ' + str(len(files)) + ' light group passes. See the "QS Relight" image.')
+        return {'FINISHED'}
 
-# Panel for making preconfigured light set up rigs.
-# Users can choose from dropdown menu.
-class LitSetPnl(bpy.types.Panel):
-    bl_label = "Light Setup"
-    bl_idname = "quickstage_PT_LitSet"
-    bl_space_type = "VIEW_3D"
-    bl_region_type = "UI"
-    bl_category = "Quick Stage"
-    bl_options = {'DEFAULT_CLOSED'}
 
-    def draw(self, context):
-        layout = self.layout
+# Saves every preset, with the current weights, side by side into one PNG.
+class RelightSheet(bpy.types.Operator):
+    bl_label = "Save Contact Sheet"
+    bl_idname = "object.qsrelightsheet"
+    
+    def execute(self, context):
         scene = context.scene
-        QSData = scene.QSProp
+        folder = bpy.path.abspath(scene.QSProp.RelightDir)
+        sheet = relight_contact_sheet(relight_load(folder), relight_weights(scene))
+        if sheet is None:
+            self.report({'WARNING'}, 'No relight passes found, render the relight matrix first.')
+            return {'CANCELLED'}
         
-        layout.prop(QSData, "MakeLight")
-        layout.operator("object.lsrig")
+        path = os.path.join(folder, "contact_sheet.png")
+        write_image("QS Relight Sheet", sheet, path)
+        self.report({'INFO'}, 'Contact sheet saved: ' + path)
+        return {'FINISHED'}
 
 
-# ======================================================
-# Below is a group of classes that are programmed to do a certain task 
-# when called, acts like function. Takes an argument, usually from
-# the custom properties data, context, and self, then execute lines of codes.
+# Empties the diagnostics list (the log file is left alone).
+class DiagClear(bpy.types.Operator):
+    bl_label = "Clear Diagnostics"
+    bl_idname = "object.qsdiagclear"
+    
+    def execute(self, context):
+        DiagRecords.clear()
+        return {'FINISHED'}
 
 
-# Ratio Change (class RatChg), takes in the current screen height, and multiplies it based on the selected ratio
-# then applying it to the screen width
-# This class is also called in Resolution Change (class ResoChg) to dynamically apply the ratio
-class RatChg(bpy.types.Operator):
-    bl_label = "Change Ratio"
-    bl_idname = "object.scrrat"
+# Saves the light setup the active object belongs to as a preset file, so it shows up in the
+# Light Setup dropdown (and can be handed to others).
+class CapturePreset(bpy.types.Operator):
+    bl_label = "Capture Preset"
+    bl_idname = "object.qscapture"
+    
+    key : bpy.props.StringProperty(name = "Key", description = "Short id of the preset, letters, digits and _ only")
+    name : bpy.props.StringProperty(name = "Name", description = "Name shown in the dropdown")
+    description : bpy.props.StringProperty(name = "Description")
+    
+    @classmethod
+    def poll(cls, context):
+        rig = object_rig(context.scene, context.active_object)
+        return rig is not None and rig.Kind.startswith("light:") and rig.Root is not None and rig.Root.instance_type != 'COLLECTION'
+    
+    def invoke(self, context, event):
+        rig = object_rig(context.scene, context.active_object)
+        if not self.name:
+            self.name = rig_kind_label(rig.Kind) + " Custom"
+        if not self.key:
+            self.key = bpy.path.clean_name(self.name).lower()
+        return context.window_manager.invoke_props_dialog(self)
     
     def execute(self, context):
-        # Same like in def draw, variables are assigned inside the execute function, so that it will be refreshed
-        # with the latest data everytime the class is called.
-        
-        # Directly takes value from the blender data. An alternative is to use context.scene
-        # but i dont like using that since it can cause discrepancies between displyed
-        # values and actual values inside the blender data.
-        self.ScrHeight = bpy.data.scenes['Scene'].render.resolution_y
-        self.ScrWidth = bpy.data.scenes['Scene'].render.resolution_x
-        
-        self.QSData = bpy.context.scene.QSProp
-        
-        # A series of if-else statments that read the current dropdown menu selection.
-        # and set the resolution accordingly.
-        if self.QSData.ScrRat == 'Sqr':
-            self.ScrWidth = self.ScrHeight
-            bpy.data.scenes['Scene'].render.resolution_x = int(self.ScrWidth)
-            
-            # A report function that appears on the bottom of the screen.
-            # Useful for reporting error, exception, etc. But this one ('INFO')
-            # is just a simple notification.
-            self.report({'INFO'},'Render set to Square')
-        
-        elif self.QSData.ScrRat == 'SDScr':
-            self.ScrWidth = 4 * (self.ScrHeight / 3)
-            bpy.data.scenes['Scene'].render.resolution_x = self.ScrWidth
-            self.report({'INFO'},'Render set to SD')
-            
-        elif self.QSData.ScrRat == 'HDScr':
-            self.ScrWidth = 16 * (self.ScrHeight / 9)
-            bpy.data.scenes['Scene'].render.resolution_x = self.ScrWidth
-            self.report({'INFO'},'Render set to HD')
+        rig = object_rig(context.scene, context.active_object)
+        try:
+            path = save_preset(capture_preset(rig, self.key, self.name, self.description))
+        except (OSError, ValueError) as err:
+            self.report({'ERROR'}, 'Could not save the preset: ' + str(err))
+            return {'CANCELLED'}
+        self.report({'INFO'}, 'Preset saved: ' + path)
+        return {'FINISHED'}
+
+
+# Looks through the preset folders right now, instead of waiting for the next check.
+class PresetReload(bpy.types.Operator):
+    bl_label = "Reload Preset Files"
+    bl_idname = "object.qspresetreload"
+    
+    def execute(self, context):
+        scan_presets()
+        if PresetErrors:
+            self.report({'WARNING'}, str(len(PresetHeaders)) + ' preset file(s), ' + str(len(PresetErrors)) + ' with errors.')
+        else:
+            self.report({'INFO'}, str(len(PresetHeaders)) + ' preset file(s).')
+        return {'FINISHED'}
+
+
+# Makes the stage piece picked in the Stage panel at the 3D cursor.
+@instrumented
+class StageAdd(bpy.types.Operator):
+    bl_label = "Make Stage"
+    bl_idname = "object.qsstage"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        kind = QSData.StageKind
+        proxy, made = spawn_stage(kind, stage_params(QSData, kind), spawn_collection(context), context.view_layer,
+                                  tuple(context.scene.cursor.location))
+        register_rig(context.scene, "stage:" + kind.lower(), proxy, made)
         
-        elif self.QSData.ScrRat == 'WideScr':
-            self.ScrWidth = 21 * (self.ScrHeight / 9)
-            bpy.data.scenes['Scene'].render.resolution_x = self.ScrWidth
-            self.report({'INFO'},'Render set to Ultrawide')
+        context.view_layer.objects.active = proxy
+        self.report({'INFO'}, 'Stage made: ' + StageNames[kind] + ' (mesh ' + proxy.data.name + ')')
+        return {'FINISHED'}
+
+
+# Runs one of the rigs_bulk actions on every rig of the kind picked in the Rigs panel.
+@instrumented
+class RigBulk(bpy.types.Operator):
+    bl_label = "Rigs"
+    bl_idname = "object.qsrigbulk"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    action : bpy.props.EnumProperty(items = [('SELECT', "Select", ""), ('HIDE', "Hide", ""), ('SHOW', "Show", ""),
+                                             ('DELETE', "Delete", ""), ('ENERGY', "Energy", ""), ('LENS', "Lens", "")])
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        if QSData.RigKind == 'NONE':
+            return {'CANCELLED'}
         
+        value = QSData.RigEnergy if self.action == 'ENERGY' else QSData.RigLens
+        count = rigs_bulk(context.scene, context.view_layer, QSData.RigKind, self.action, value)
+        self.report({'INFO'}, self.action.capitalize() + ': ' + str(count) + ' rig(s).')
         return {'FINISHED'}
 
 
-# Based on the selected resoltion from the dropdown menu, will change the render resolution 
-# of the camera.
-class ResoChg(bpy.types.Operator):
-    bl_label = "Change Render Resolution"
-    bl_idname = "object.scrreso"
+# Forgets rigs that were deleted by hand.
+class RigPrune(bpy.types.Operator):
+    bl_label = "Forget Deleted Rigs"
+    bl_idname = "object.qsrigprune"
+    bl_options = {'UNDO'}
     
-    # This is pretty much the same as RatChg, but deals with resolution instead.
+    def execute(self, context):
+        before = len(context.scene.QSProp.Rigs)
+        prune_rigs(context.scene)
+        self.report({'INFO'}, str(before - len(context.scene.QSProp.Rigs)) + ' rig(s) forgotten.')
+        return {'FINISHED'}
+
+
+# Makes BatchCount rigs of BatchWhat in a grid around the 3D cursor.
+# From the UI it runs from a timer, a slice at a time, with the progress in the status bar and the Rigs panel.
+# Esc cancels and removes what was made. When run from a script (or redone) it just builds everything at once.
+@instrumented
+class StageBatch(bpy.types.Operator):
+    bl_label = "Stage Batch"
+    bl_idname = "object.qsbatch"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def start(self, context):
+        QSData = context.scene.QSProp
+        self.made = []
+        self.rig_ids = []
+        self.total = QSData.BatchCount
+        self.work = batch_work(context.scene, spawn_collection(context), QSData.BatchWhat, QSData.BatchCount, QSData.BatchSpacing,
+                               tuple(context.scene.cursor.location), QSData.LibMode, QSData.CamLitRig, self.made, self.rig_ids)
     
     def execute(self, context):
+        self.start(context)
+        for _ in self.work:
+            pass
+        context.view_layer.update()
+        self.report({'INFO'}, 'Batch staged: ' + str(len(self.rig_ids)) + ' rigs.')
+        return {'FINISHED'}
+    
+    def invoke(self, context, event):
+        if BatchProgress['running']:
+            self.report({'WARNING'}, 'A batch is already being staged.')
+            return {'CANCELLED'}
+        
+        self.start(context)
+        BatchProgress.update(done = 0, total = self.total, running = True)
+        wm = context.window_manager
+        wm.progress_begin(0, self.total)
+        self.timer = wm.event_timer_add(0.001, window = context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+    
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.cancel(context)
+            self.report({'WARNING'}, 'Batch cancelled, nothing was kept.')
+            return {'CANCELLED'}
         
-        self.ScrHeight = bpy.data.scenes['Scene'].render.resolution_y
-        self.ScrWidth = bpy.data.scenes['Scene'].render.resolution_x
-        self.QSData = bpy.context.scene.QSProp
+        if event.type != 'TIMER':
+            # Everything else (navigating the viewport, say) goes on as usual.
+            return {'PASS_THROUGH'}
         
-        if self.QSData.ScrReso == 'res720':
-            bpy.data.scenes['Scene'].render.resolution_y = 720
-            
-            # Calls screen ratio class once again to dynamically adjust ratio
-            bpy.ops.object.scrrat()
-            
-            self.report({'INFO'},'Resolution is now: 720p')
+        steps, finished = run_slice(self.work, context.scene.QSProp.BatchSlice / 1000)
+        BatchProgress['done'] += steps
+        context.view_layer.update()
         
-        elif self.QSData.ScrReso == 'res1080':
-            bpy.data.scenes['Scene'].render.resolution_y = 1080
-            bpy.ops.object.scrrat()
-            self.report({'INFO'},'Resolution is now: 1080p')
-            
-        elif self.QSData.ScrReso == 'res1440':
-            bpy.data.scenes['Scene'].render.resolution_y = 1440
-            bpy.ops.object.scrrat()
-            self.report({'INFO'},'Resolution is now: 1440p')
-            
-        elif self.QSData.ScrReso == 'res2160':
-            bpy.data.scenes['Scene'].render.resolution_y = 2160
-            bpy.ops.object.scrrat()
-            self.report({'INFO'},'Resolution is now: 2160p')
-            
-        elif self.QSData.ScrReso == 'res4320':
-            bpy.data.scenes['Scene'].render.resolution_y = 4320
-            bpy.ops.object.scrrat()
-            self.report({'INFO'},'Resolution is now: 4320p')
-            
+        context.window_manager.progress_update(BatchProgress['done'])
+        context.workspace.status_text_set("Quick Stage: building %d / %d rigs (Esc to cancel)" % (BatchProgress['done'], self.total))
+        for area in context.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+        
+        if finished:
+            self.finish(context)
+            self.report({'INFO'}, 'Batch staged: ' + str(len(self.rig_ids)) + ' rigs.')
+            return {'FINISHED'}
+        return {'RUNNING_MODAL'}
+    
+    def finish(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        BatchProgress.update(done = 0, total = 0, running = False)
+    
+    # Also called by Blender when the operator is stopped from outside (the window closes, say).
+    def cancel(self, context):
+        self.work.close()
+        batch_rollback(context.scene, self.made, self.rig_ids)
+        context.view_layer.update()
+        self.finish(context)
+
+
+# A new render queue job for a camera, with the scene's frame range and the chosen size.
+def add_render_job(scene, camera):
+    QSData = scene.QSProp
+    job = QSData.RendJobs.add()
+    job.Camera = camera
+    job.FrameStart = scene.frame_start
+    job.FrameEnd = scene.frame_end
+    job.ScrRat = QSData.ScrRat
+    job.ScrReso = QSData.ScrReso
+    if camera is not None:
+        job.Output = "//render/" + bpy.path.clean_name(camera.name) + "/"
+    QSData.RendJobIdx = len(QSData.RendJobs) - 1
+    return job
+
+
+# Adds a job to the render queue, filled in with the scene's camera, frame range and the chosen size.
+class RendJobAdd(bpy.types.Operator):
+    bl_label = "Add Render Job"
+    bl_idname = "object.qsjobadd"
+    bl_options = {'UNDO'}
+    
+    def execute(self, context):
+        add_render_job(context.scene, context.scene.camera)
         return {'FINISHED'}
- 
 
-# Class for making simple camera rig.
-class CamRigSmpl(bpy.types.Operator):
-    bl_label = "Make Simple Cam Rig"
-    bl_idname = "object.crigs"
+
+# Adds a job for every camera of the selected rigs (cam rigs and camera arrays), all with the same
+# frames and size, so with Multiview on they render as one.
+class RendJobRigs(bpy.types.Operator):
+    bl_label = "Add Selected Rig Cameras"
+    bl_idname = "object.qsjobrigs"
+    bl_options = {'UNDO'}
+    
+    def execute(self, context):
+        scene = context.scene
+        queued = set(job.Camera for job in scene.QSProp.RendJobs)
+        cameras = []
+        for ob in context.selected_objects:
+            rig = object_rig(scene, ob)
+            members = rig_members(rig) if rig is not None else [(ob, 'camera')] if ob.type == 'CAMERA' else []
+            cameras += [member for member, role in members if role == 'camera' and member not in queued and member not in cameras]
+        
+        if not cameras:
+            self.report({'WARNING'}, 'Select a camera rig (or a camera) that is not in the queue yet.')
+            return {'CANCELLED'}
+        for cam in cameras:
+            add_render_job(scene, cam)
+        self.report({'INFO'}, 'Added ' + str(len(cameras)) + ' render job(s).')
+        return {'FINISHED'}
+
+
+# Removes the selected job from the render queue.
+class RendJobDel(bpy.types.Operator):
+    bl_label = "Remove Render Job"
+    bl_idname = "object.qsjobdel"
+    bl_options = {'UNDO'}
+    
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        if 0 <= QSData.RendJobIdx < len(QSData.RendJobs):
+            QSData.RendJobs.remove(QSData.RendJobIdx)
+            QSData.RendJobIdx = max(0, QSData.RendJobIdx - 1)
+        return {'FINISHED'}
+
+
+# Renders the queue in background Blenders while the UI stays usable.
+# Checks on the workers once a second, Esc stops them.
+class RendQueueRun(bpy.types.Operator):
+    bl_label = "Render Queue"
+    bl_idname = "object.qsqueue"
     
     def execute(self, context):
         QSData = context.scene.QSProp
+        if not queue_jobs(context.scene):
+            self.report({'WARNING'}, 'Nothing to render, add a job with a camera first.')
+            return {'CANCELLED'}
         
-        # bpy.ops is part of the operator functions - this one will 'spawn' a reference point.
-        bpy.ops.object.empty_add(type='PLAIN_AXES', align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-        # When objects are first made, its selected as active object by default.
-        # This line will take that, and assigned it to a variable as a value for future reference.
-        empty = bpy.context.active_object
+        blend_path, base_dir = save_queue_copy()
+        self.procs = launch_render_workers(blend_path, QSData.RendWorkers, base_dir, multiview=QSData.RendMultiview)
         
-        # Make a camera, assign it to 'cam'
-        bpy.ops.object.camera_add(enter_editmode=False, align='WORLD', location=(0, -10, 0), rotation=(1.5708, -0, -0), scale=(1, 1, 1))
-        cam = bpy.context.active_object
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(1.0, window = context.window)
+        wm.modal_handler_add(self)
+        self.report({'INFO'}, 'Rendering queue with ' + str(len(self.procs)) + ' worker(s), Esc to stop.')
+        return {'RUNNING_MODAL'}
+    
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            for proc, log in self.procs:
+                proc.terminate()
+            context.window_manager.event_timer_remove(self.timer)
+            self.report({'WARNING'}, 'Render queue stopped. Finished frames are kept, run it again to resume.')
+            return {'CANCELLED'}
         
-        # Rename the camera and reference point
-        cam.name = "Camera Rig"
-        empty.name = "Focus Rig"
+        if event.type == 'TIMER' and all(proc.poll() is not None for proc, log in self.procs):
+            context.window_manager.event_timer_remove(self.timer)
+            rendered = 0
+            failed = 0
+            for proc, log in self.procs:
+                results = read_worker_results(log)
+                if proc.returncode != 0 or not any(r['ok'] for r in results):
+                    failed += 1
+                for r in results:
+                    rendered += sum(job['rendered'] for job in r.get('queue', []))
+            if failed:
+                self.report({'ERROR'}, 'Render queue finished with ' + str(failed) + ' failed worker(s), see ' + os.path.dirname(self.procs[0][1]))
+            else:
+                self.report({'INFO'}, 'Render queue done: ' + str(rendered) + ' frames rendered.')
+            return {'FINISHED'}
         
-        # Add a constraint to the camera to always face the reference point - now called 'Focus Rig'.
-        cam.constraints.new('TRACK_TO')
-        cam.constraints['Track To'].target = empty
+        return {'PASS_THROUGH'}
+
+
+# Culls the scene for the active object's camera rig (or the scene camera).
+@instrumented
+class CullScene(bpy.types.Operator):
+    bl_label = "Cull Unseen"
+    bl_idname = "object.qscull"
+    bl_options = {'REGISTER', 'UNDO'}
     
-        selrep = 'Simple camera rig made.'
+    def execute(self, context):
+        camera = find_rig_camera(context.active_object) or context.scene.camera
+        if camera is None:
+            self.report({'WARNING'}, 'No camera to cull for, make a camera rig first.')
+            return {'CANCELLED'}
         
-        # If user wanted a light attached to the camera, this part will run.
-        if QSData.CamLitRig == True:
-            
-            bpy.ops.object.light_add(type='SPOT', align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-            spot = bpy.context.active_object
-            spot.name = "Cam Light Rig"
-            
-            spot.constraints.new('COPY_TRANSFORMS')
-            spot.constraints['Copy Transforms'].target = cam
-            
-            # Now this part modifies the value of the light.
-            spot.data.energy = 1500             # Dictates brightness/luminescences.
-            spot.data.shadow_soft_size = 6      # How dispersed is the light
-            spot.data.spot_blend = 1            # Blured or sharp.
-            spot.data.spot_size = 1.13446       # How big is the spotlight radius
+        objects, lights = cull_scene(context.scene, camera)
+        self.report({'INFO'}, 'Culled for ' + camera.name + ': ' + str(objects) + ' object(s), ' + str(lights) + ' light(s).')
+        return {'FINISHED'}
 
-            selrep = 'Simple camera rig, with camera light made.'
+
+# Puts everything culling left out back.
+class UncullScene(bpy.types.Operator):
+    bl_label = "Restore"
+    bl_idname = "object.qsuncull"
+    bl_options = {'REGISTER', 'UNDO'}
     
-        self.report({'INFO'}, selrep)
+    def execute(self, context):
+        self.report({'INFO'}, str(uncull(context.scene)) + ' object(s) restored.')
         return {'FINISHED'}
 
 
-# Class for making complex camera rig.
-class CamRigCmplx(bpy.types.Operator):
-    bl_label = "Make Complex Cam Rig"
-    bl_idname = "object.crigc"
+# Crops the render border to the selected objects, as seen from the scene camera.
+@instrumented
+class CropSubject(bpy.types.Operator):
+    bl_label = "Crop to Subject"
+    bl_idname = "object.qscrop"
+    bl_options = {'REGISTER', 'UNDO'}
     
     def execute(self, context):
-        QSData = context.scene.QSProp
+        scene = context.scene
+        QSData = scene.QSProp
+        targets = frame_targets(context)
+        if not targets or scene.camera is None:
+            self.report({'WARNING'}, 'Select the subject, and make sure the scene has a camera.')
+            return {'CANCELLED'}
         
-        # Again, make various componenets of the camera rig.
-        bpy.ops.object.empty_add(type='PLAIN_AXES', align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-        empty = bpy.context.active_object
-        
-        bpy.ops.object.camera_add(enter_editmode=False, align='WORLD', location=(0, -10, 0), rotation=(1.5708, -0, -0), scale=(1, 1, 1))
-        cam = bpy.context.active_object
-        
-        bpy.ops.object.empty_add(type='CUBE', align='WORLD', location=(0, -10, 0), scale=(1, 1, 1))
-        cube = bpy.context.active_object
-        
-        bpy.ops.object.empty_add(type='SPHERE', align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-        sphere = bpy.context.active_object
-        
-        # Rename the objects.
-        empty.name = "Focus Rig"
-        sphere.name = "Rotation Rig"
-        cube.name = "Zoom Rig"
-        cam.name = "Camera Rig"
-        
-        # Start adding constraints
-        empty.constraints.new('LIMIT_ROTATION')
-        empty.constraints['Limit Rotation'].use_limit_x = True
-        empty.constraints['Limit Rotation'].use_limit_y = True
-        empty.constraints['Limit Rotation'].use_limit_z = True
-
-        sphere.constraints.new('COPY_LOCATION')
-        sphere.constraints['Copy Location'].target = empty
-        
-        # This one is object parenting procedure.
-        bpy.ops.object.select_all(action='DESELECT')                        # First it clears selections, so no active object.
-        cube.select_set(True)                                               # select cube.
-        sphere.select_set(True)                                             # select sphere.
-        bpy.context.view_layer.objects.active = sphere                      # make sphere active object to be parented to.
-        bpy.ops.object.parent_set(type = 'OBJECT', keep_transform = True)   # Parent the selected object(s) (this time only the cube), to the active object (sphere).
-        
-        # More constraints declaration and setting. This one is limit cube location movement in relation to sphere.
-        cube.constraints.new('LIMIT_LOCATION')
-        cube.constraints['Limit Location'].use_min_x = True
-        cube.constraints['Limit Location'].use_max_x = True
-        cube.constraints['Limit Location'].use_min_z = True
-        cube.constraints['Limit Location'].use_max_z = True
-        cube.constraints['Limit Location'].owner_space = 'CUSTOM'
-        cube.constraints['Limit Location'].space_object = sphere
-        
-        # Constraint cam to follow cube and always face focus point.
-        cam.constraints.new('COPY_LOCATION')
-        cam.constraints['Copy Location'].target = cube
-        cam.constraints.new('TRACK_TO')
-        cam.constraints['Track To'].target = empty
-        
-        selrep = 'Complex camera rig made.'
+        QSData.CropTargets.clear()
+        for ob in targets:
+            QSData.CropTargets.add().Object = ob
+        QSData.CropEnable = True    # The update sets the border and the compositor.
         
-        if QSData.CamLitRig == True:
-            
-            bpy.ops.object.light_add(type='SPOT', align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-            spot = bpy.context.active_object
-            spot.name = "Cam Light Rig"
-            
-            spot.constraints.new('COPY_TRANSFORMS')
-            spot.constraints['Copy Transforms'].target = cam
-            
-            spot.data.energy = 1500
-            spot.data.shadow_soft_size = 6
-            spot.data.spot_blend = 1
-            spot.data.spot_size = 1.13446
+        render = scene.render
+        area = (render.border_max_x - render.border_min_x) * (render.border_max_y - render.border_min_y)
+        self.report({'INFO'}, 'Rendering %d%% of the frame.' % round(area * 100))
+        return {'FINISHED'}
 
-            selrep = 'Complex camera rig, with camera light made.'
+
+# Back to rendering the whole frame.
+class CropClear(bpy.types.Operator):
+    bl_label = "Stop Cropping"
+    bl_idname = "object.qscropclear"
+    bl_options = {'REGISTER', 'UNDO'}
     
-        self.report({'INFO'}, selrep)
+    def execute(self, context):
+        QSData = context.scene.QSProp
+        QSData.CropTargets.clear()
+        QSData.CropEnable = False
         return {'FINISHED'}
 
 
-class LitSetRig(bpy.types.Operator):
-    bl_label = "Make Light Setup"
-    bl_idname = "object.lsrig"
+# Renders the background plate used behind the cropped render.
+class CropPlate(bpy.types.Operator):
+    bl_label = "Render Plate"
+    bl_idname = "object.qscropplate"
     
     def execute(self, context):
-        self.QSData = context.scene.QSProp
-        
-        if self.QSData.MakeLight == 'clmshll':
-            
-            # This one and the next 6 if-else statement is similar in structure.
-            # Just different combination of setup.
-            
-            # Make 2 lights, one above, one below. Set the reference (Upper light = l1, lower light = l2)
-            bpy.ops.object.light_add(type='AREA', radius = 2.5, align='WORLD', location=(0, -5, 4.75), rotation=(1.13446, 0, 0), scale=(1, 1, 1))
-            l1 = bpy.context.active_object
-            bpy.ops.object.light_add(type='AREA', radius = 2.5, align='WORLD', location=(0, -5, 1.5), rotation=(2.00713, 0, 0), scale=(1, 1, 1))
-            l2 = bpy.context.active_object
-
-            # Set luminescence to 250 watt each
-            l1.data.energy = 250
-            l2.data.energy = 250
-            l1.name = "Upper Light ClmShll"
-            l1.name = "Lower Light ClmShll"
-
-            # Make a focus point for the light
-            bpy.ops.object.empty_add(type='SPHERE', radius = 1.15, align='WORLD', location=(0, 0, 3.12), scale=(1, 1, 1))
-            litfoc = bpy.context.active_object
-            litfoc.name = "Light Focus ClmShll"
-
-            # Constraint both lights to aim to the focus point
-            l1.constraints.new('TRACK_TO')
-            l1.constraints['Track To'].target = litfoc
-            l2.constraints.new('TRACK_TO')
-            l2.constraints['Track To'].target = litfoc
-
-            # Make base to move the entire light set.
-            bpy.ops.object.empty_add(type='CIRCLE', radius=5, align='WORLD', location=(0, 0, 1.8), rotation=(1.5708, 0, 0), scale=(1, 1, 1))
-            litbase = bpy.context.active_object
-            litbase.name = "Set Base ClmShll"
-
-            # Select all light set objects, parent it to the base.
-            bpy.ops.object.select_all(action='DESELECT')
-            l1.select_set(True)
-            l2.select_set(True)
-            litfoc.select_set(True)
-            litbase.select_set(True)
-            bpy.context.view_layer.objects.active = litbase
-            bpy.ops.object.parent_set(type = 'OBJECT', keep_transform = True)
-            
-            selrep = "Light setup made: Clamshell"
-            
-        elif self.QSData.MakeLight == 'fltlt':
-            
-            bpy.ops.object.light_add(type='AREA', radius=3, align='WORLD', location=(5, -5, 3), rotation=(1.5708, 0, 0.785398), scale=(1, 1, 1))
-            lLeft = bpy.context.active_object
-            bpy.ops.object.light_add(type='AREA', radius=3, align='WORLD', location=(-5, -5, 3), rotation=(1.5708, 0, -0.785398), scale=(1, 1, 1))
-            lRight = bpy.context.active_object
-
-            lLeft.data.energy = 250
-            lRight.data.energy = 250
-            lLeft.name = "Left Light FltLt"
-            lRight.name = "Right Light FltLt"
-
-            bpy.ops.object.empty_add(type='SPHERE', radius = 1.15, align='WORLD', location=(0, 0, 3), scale=(1, 1, 1))
-            litfoc = bpy.context.active_object
-            litfoc.name = "Light Focus FltLt"
-
-            lLeft.constraints.new('TRACK_TO')
-            lLeft.constraints['Track To'].target = litfoc
-            lRight.constraints.new('TRACK_TO')
-            lRight.constraints['Track To'].target = litfoc
-
-            bpy.ops.object.empty_add(type='CIRCLE', radius=5, align='WORLD', location=(0, 0, 1.5), rotation=(1.5708, 0, 0), scale=(1, 1, 1))
-            litbase = bpy.context.active_object
-            litbase.name = "Set Base FltLt"
-
-            bpy.ops.object.select_all(action='DESELECT')
-            lLeft.select_set(True)
-            lRight.select_set(True)
-            litfoc.select_set(True)
-            litbase.select_set(True)
-            bpy.context.view_layer.objects.active = litbase
-            bpy.ops.object.parent_set(type = 'OBJECT', keep_transform = True)
-            
-            selrep = "Light setup made: Flatlight"
-                        
-        elif self.QSData.MakeLight == 'kfh':
-            
-            bpy.ops.object.light_add(type='AREA', radius=3, align='WORLD', location=(5, -5, 2.5), rotation=(1.5708, 0, 0.785398), scale=(1, 1, 1))
-            lfill = bpy.context.active_object
-            bpy.ops.object.light_add(type='AREA', radius=3, align='WORLD', location=(-3.5, -3.5, 3), rotation=(1.5708, 0, -0.785398), scale=(1, 1, 1))
-            lkey = bpy.context.active_object
-
-            lkey.data.energy = 400
-            lfill.data.energy = 200
-            lkey.name = "Key Light KFHLt"
-            lfill.name = "Fill Light KFHLt"
-
-            bpy.ops.object.light_add(type='SPOT', radius=3, align='WORLD', location=(1.5, 1.5, 8), rotation=(-0.314159, 0.314159, 0), scale=(1, 1, 1))
-            lhigh = bpy.context.active_object
-            lhigh.name = "Highlight KFHLt"
-            lhigh.data.energy = 2500
-            lhigh.data.shadow_soft_size = 1.5
-            lhigh.data.spot_size = 0.872665
-            lhigh.data.spot_blend = 0
-
-            bpy.ops.object.empty_add(type='CIRCLE', radius=5, align='WORLD', location=(0, 0, 1.8), rotation=(1.5708, 0, 0), scale=(1, 1, 1))
-            litbase = bpy.context.active_object
-            litbase.name = "Set Base KFHLt"
-
-            bpy.ops.object.select_all(action='DESELECT')
-            lhigh.select_set(True)
-            lkey.select_set(True)
-            lfill.select_set(True)
-            litbase.select_set(True)
-            bpy.context.view_layer.objects.active = litbase
-            bpy.ops.object.parent_set(type = 'OBJECT', keep_transform = True)
-            
-            selrep = "Light setup made: Key & Fill lights"
+        path = render_crop_plate(context.scene)
+        crop_compositor(context.scene)
+        self.report({'INFO'}, 'Background plate saved: ' + path)
+        return {'FINISHED'}
 
-        elif self.QSData.MakeLight == 'hghky':
-            
-            bpy.ops.object.light_add(type='AREA', radius=3, align='WORLD', location=(5, -5, 2.5), rotation=(1.5708, 0, 0.785398), scale=(1, 1, 1))
-            lfill = bpy.context.active_object
-            bpy.ops.object.light_add(type='AREA', radius=3, align='WORLD', location=(-3.5, -3.5, 3), rotation=(1.5708, 0, -0.785398), scale=(1, 1, 1))
-            lkey = bpy.context.active_object
 
-            lkey.data.energy = 400
-            lfill.data.energy = 200
-            
-            lkey.name = "Key Light KF"
-            lfill.name = "Fill Light KF"
-            
-            bpy.ops.object.empty_add(type='CIRCLE', radius=5, align='WORLD', location=(0, 0, 1.8), rotation=(1.5708, 0, 0), scale=(1, 1, 1))
-            litbase = bpy.context.active_object
-            litbase.name = "Set Base KF"
-
-            bpy.ops.object.select_all(action='DESELECT')
-            lkey.select_set(True)
-            lfill.select_set(True)
-            litbase.select_set(True)
-            bpy.context.view_layer.objects.active = litbase
-            bpy.ops.object.parent_set(type = 'OBJECT', keep_transform = True)
-            
-            selrep = "Light setup made: Key & Fill with highlight"
-            
-        elif self.QSData.MakeLight == 'lprmlt':
-            
-            bpy.ops.object.light_add(type='AREA', radius=3, align='WORLD', location=(-3.5, -3.5, 3), rotation=(1.5708, 0, -0.785398), scale=(1, 1, 1))
-            lkey = bpy.context.active_object
-            lkey.data.energy = 400
-            lkey.name = "Key Light LpRm"
-
-            bpy.ops.object.light_add(type='SPOT', radius=3, align='WORLD', location=(2, 4, 5), rotation=(-1.27409, 0, -0.47473), scale=(1, 1, 1))
-            lhigh = bpy.context.active_object
-
-            lhigh.name = "Highlight LpRm"
-            lhigh.data.energy = 2500
-            lhigh.data.shadow_soft_size = 1.5
-            lhigh.data.spot_size = 0.523599
-            lhigh.data.spot_blend = 0
-            
-            bpy.ops.object.empty_add(type='CIRCLE', radius=5, align='WORLD', location=(0, 0, 1.8), rotation=(1.5708, 0, 0), scale=(1, 1, 1))
-            litbase = bpy.context.active_object
-            litbase.name = "Set Base LpRm"
-            
-            bpy.ops.object.select_all(action='DESELECT')
-            lkey.select_set(True)
-            lfill.select_set(True)
-            litbase.select_set(True)
-            bpy.context.view_layer.objects.active = litbase
-            bpy.ops.object.parent_set(type = 'OBJECT', keep_transform = True)
-            
-            selrep = "Light setup made: Loop with rim light"
-            
-        elif self.QSData.MakeLight == 'hkk':
-            
-            bpy.ops.object.light_add(type='AREA', radius=2, align='WORLD', location=(3.5, 4, 2.5), rotation=(-1.5708, 0, -0.637045), scale=(1, 1, 1))
-            l1 = bpy.context.active_object
-            bpy.ops.object.light_add(type='AREA', radius=2, align='WORLD', location=(-3.5, 4, 2.5), rotation=(-1.5708, 0, 0.637045), scale=(1, 1, 1))
-            l2 = bpy.context.active_object
-
-            l1.data.energy = 300
-            l2.data.energy = 300
-            l1.name = "Back Light1 HKK"
-            l1.name = "Back Light2 HKK"
-            
-            bpy.ops.object.light_add(type='SPOT', radius=3, align='WORLD', location=(0.8, -5, 5), rotation=(1.22173, 0, 0.174533), scale=(1, 1, 1))
-            lk = bpy.context.active_object
-            lk.data.energy = 1000
-            lk.name = "Kicker Light HKK"
-
-            bpy.ops.object.empty_add(type='CIRCLE', radius=5, align='WORLD', location=(0, 0, 1.8), rotation=(1.5708, 0, 0), scale=(1, 1, 1))
-            litbase = bpy.context.active_object
-            litbase.name = "Set Base HKK"
-
-            bpy.ops.object.select_all(action='DESELECT')
-            l1.select_set(True)
-            l2.select_set(True)
-            lk.select_set(True)
-            litbase.select_set(True)
-            bpy.context.view_layer.objects.active = litbase
-            bpy.ops.object.parent_set(type = 'OBJECT', keep_transform = True)
-            
-            selrep = "Light setup made: High key with Kickers"
-            
-        elif self.QSData.MakeLight == 'bgr':
-            
-            bpy.ops.object.light_add(type='AREA', radius=2, align='WORLD', location=(3.5, 4, 2.5), rotation=(-1.5708, 0, -0.637045), scale=(1, 1, 1))
-            l1 = bpy.context.active_object
-            bpy.ops.object.light_add(type='AREA', radius=2, align='WORLD', location=(-3.5, 4, 2.5), rotation=(-1.5708, 0, 0.637045), scale=(1, 1, 1))
-            l2 = bpy.context.active_object
-
-            l1.data.energy = 500
-            l2.data.energy = 500
-            l1.name = "Upper Light Bdgr"
-            l1.name = "Lower Light Bdgr"
-
-            bpy.ops.object.empty_add(type='SPHERE', radius = 1.15, align='WORLD', location=(0, 0, 3.5), scale=(1, 1, 1))
-            litfoc = bpy.context.active_object
-            litfoc.name = "Light Focus Bdgr"
-
-            l1.constraints.new('TRACK_TO')
-            l1.constraints['Track To'].target = litfoc
-            l2.constraints.new('TRACK_TO')
-            l2.constraints['Track To'].target = litfoc
-
-            bpy.ops.object.empty_add(type='CIRCLE', radius=5, align='WORLD', location=(0, 0, 1.8), rotation=(1.5708, 0, 0), scale=(1, 1, 1))
-            litbase = bpy.context.active_object
-            litbase.name = "Set Base Bdgr"
-
-            bpy.ops.object.select_all(action='DESELECT')
-            l1.select_set(True)
-            l2.select_set(True)
-            litfoc.select_set(True)
-            litbase.select_set(True)
-            bpy.context.view_layer.objects.active = litbase
-            bpy.ops.object.parent_set(type = 'OBJECT', keep_transform = True)
-            
-            selrep = "Light setup made: Badger"
-            
-        self.report({'INFO'}, selrep)
+# Renders the current frame in tiles on RendWorkers background Blenders, then stitches them.
+# Tiles that failed get one more go, Esc stops the workers (finished tiles are kept for the next run).
+class RenderTiled(bpy.types.Operator):
+    bl_label = "Render Tiled Still"
+    bl_idname = "object.qstiled"
+    
+    def execute(self, context):
+        scene = context.scene
+        QSData = scene.QSProp
+        if scene.camera is None:
+            self.report({'WARNING'}, 'The scene has no camera.')
+            return {'CANCELLED'}
+        
+        self.manifest = tiled_prepare(scene, QSData.TileOutput, QSData.TilesX, QSData.TilesY, QSData.TileOverlap, not QSData.TileResume)
+        self.total = QSData.TilesX * QSData.TilesY
+        self.retried = False
+        self.results = []
+        self.blend_path = save_queue_copy()[0]
+        if not self.launch(QSData.RendWorkers):
+            return {'FINISHED'}
+        
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(1.0, window = context.window)
+        wm.modal_handler_add(self)
+        self.report({'INFO'}, 'Rendering ' + str(self.total) + ' tiles, Esc to stop.')
+        return {'RUNNING_MODAL'}
+    
+    # Starts workers for the tiles that are left. False when there was nothing left to render.
+    def launch(self, workers):
+        left = tiles_left(self.manifest)
+        self.procs = launch_tile_workers(self.blend_path, self.manifest, left, workers) if left else []
+        return bool(self.procs)
+    
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            for proc, log in self.procs:
+                proc.terminate()
+            self.end(context)
+            self.report({'WARNING'}, 'Tiled render stopped. Finished tiles are kept, run it again to resume.')
+            return {'CANCELLED'}
+        
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        
+        left = len(tiles_left(self.manifest))
+        context.workspace.status_text_set("Quick Stage: %d / %d tiles rendered (Esc to stop)" % (self.total - left, self.total))
+        if not all(proc.poll() is not None for proc, log in self.procs):
+            return {'PASS_THROUGH'}
+        
+        self.results += [r for proc, log in self.procs for r in read_worker_results(log)]
+        # A worker that died leaves its tiles unrendered, they get one more try.
+        if left and not self.retried:
+            self.retried = True
+            if self.launch(context.scene.QSProp.RendWorkers):
+                return {'PASS_THROUGH'}
+        
+        self.end(context)
+        result = tiled_finish(context.scene, self.manifest, self.results)
+        if result['missing']:
+            self.report({'ERROR'}, str(len(result['missing'])) + ' tile(s) failed, see ' + self.manifest)
+        else:
+            self.report({'INFO'}, 'Tiled still saved: ' + result['output'])
         return {'FINISHED'}
+    
+    def end(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        context.workspace.status_text_set(None)
 
 
 # ======================================================
 # Addon installation and setup.
 
 # A list of all the classes in the python script
-classes = [QSProps, RendSet, CamRigPnl, RatChg, LitSetPnl, ResoChg, CamRigCmplx, CamRigSmpl, LitSetRig]
+classes = [QSRenderJob, QSRelightLight, QSCropTarget, QSRigParams, QSRigMember, QSRig, QSProps, RendSet, CamRigPnl, RatChg, LitSetPnl, ResoChg, QualChg, CamRigCmplx, CamRigSmpl, CamRigArr, LitSetRig,
+           QS_UL_RendJobs, RendQueuePnl, RendJobAdd, RendJobDel, RendJobRigs, RendQueueRun, RelightPnl, RelightRender, RelightSheet,
+           DiagPnl, DiagClear, BakeRig, UnbakeRig, RigsPnl, RigBulk, RigPrune, StageBatch, RigParamsPnl,
+           CapturePreset, PresetReload, StagePnl, StageAdd, RenderTiled,
+           CropSubject, CropClear, CropPlate, CullScene, UncullScene, HdriAdd, CamMotion, CamMotionClear]
 
 # Will "install" the classes in 'classes' list.
 def register():
@@ -623,6 +5242,19 @@ def register():
     
     # Will install our custom properties    
     bpy.types.Scene.QSProp = bpy.props.PointerProperty(type = QSProps)
+    bpy.types.Object.QSRigParams = bpy.props.PointerProperty(type = QSRigParams)
+    
+    # Keeps the bounds cache honest.
+    bpy.app.handlers.depsgraph_update_post.append(bounds_depsgraph_update)
+    bpy.app.handlers.load_post.append(bounds_load_post)
+    bpy.app.handlers.frame_change_post.append(crop_frame_change)
+    bpy.app.handlers.load_post.append(hdri_load_post)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        handlers.append(rig_index_reset)
+    
+    # Preset files: headers now, definitions when used, and a look at the folders every few seconds.
+    scan_presets()
+    bpy.app.timers.register(preset_watch, first_interval = PresetWatchInterval, persistent = True)
 
 # Uninstall 
 def unregister():
@@ -631,6 +5263,186 @@ def unregister():
         
     # Will uninstall our custom properties   
     del bpy.types.Scene.QSProp
+    del bpy.types.Object.QSRigParams
+    
+    for handlers, func in ((bpy.app.handlers.depsgraph_update_post, bounds_depsgraph_update),
+                           (bpy.app.handlers.load_post, bounds_load_post),
+                           (bpy.app.handlers.frame_change_post, crop_frame_change),
+                           (bpy.app.handlers.load_post, hdri_load_post),
+                           (bpy.app.handlers.load_post, rig_index_reset),
+                           (bpy.app.handlers.undo_post, rig_index_reset),
+                           (bpy.app.handlers.redo_post, rig_index_reset)):
+        if func in handlers:
+            handlers.remove(func)
+    if bpy.app.timers.is_registered(preset_watch):
+        bpy.app.timers.unregister(preset_watch)
+    thumb_release()
+
+
+# ======================================================
+# Command line staging. Lets a pipeline stage .blend files without any UI, like:
+#   blender -b file.blend -P quickstage_final.py -- --ratio HDScr --reso res2160 --light kfh --camrig complex
+# The file is saved back (or to --output), and one line starting with CLI_TAG is printed with
+# a JSON summary, so whoever launched Blender can pick it out of Blender's own output.
+# quickstage_batch.py uses this to stage a whole folder over all cores.
+# With --render-queue the file's render queue is rendered too, by --workers background Blenders.
+
+
+CLI_TAG = "QUICKSTAGE_RESULT "
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser(prog="quickstage_final.py", description="Stage the open .blend file with Quick Stage.")
+    parser.add_argument("--ratio", choices=list(RatioTable), help="Screen ratio")
+    parser.add_argument("--reso", choices=list(ResoTable), help="Render resolution")
+    parser.add_argument("--quality", choices=list(QualityTiers), help="Render quality tier")
+    parser.add_argument("--light", choices=preset_keys(), help="Light preset to spawn (built-in or preset file)")
+    parser.add_argument("--camrig", choices=["simple", "complex"], help="Camera rig to spawn")
+    parser.add_argument("--camlight", action="store_true", help="Attach a light to the camera rig")
+    parser.add_argument("--output", help="Save to this path instead of overwriting the open file")
+    parser.add_argument("--no-save", action="store_true", help="Don't save anything, just report")
+    parser.add_argument("--render-queue", action="store_true", help="Render the file's render queue (after staging, if asked)")
+    parser.add_argument("--workers", type=int, help="Background Blenders for the render queue (default: the file's setting)")
+    parser.add_argument("--multiview", action="store_true", help="Render queue jobs with the same frames and size as one multiview render")
+    parser.add_argument("--cull", action="store_true", help="Leave out objects the scene camera never sees (before saving and rendering)")
+    parser.add_argument("--tiled", metavar="OUTPUT", help="Render the current frame in tiles over --workers Blenders, stitched into OUTPUT (.exr or .png)")
+    parser.add_argument("--tiles", default="4x4", help="Tile layout for --tiled, columns x rows (default 4x4)")
+    parser.add_argument("--overlap", type=int, default=32, help="Pixels tiles overlap for --tiled (default 32)")
+    parser.add_argument("--tile-index", help="Only render these tiles (comma separated), like a tile that failed")
+    parser.add_argument("--fresh", action="store_true", help="Start --tiled over instead of resuming")
+    parser.add_argument("--render-tiles", help=argparse.SUPPRESS)
+    parser.add_argument("--thumbnails", nargs="+", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--base-dir", help=argparse.SUPPRESS)
+    return parser
+
+
+# --tiled from the command line: renders the missing tiles (or just --tile-index) here or on workers,
+# gives failed tiles one more go, and stitches.
+def render_tiled_cli(scene, args, workers):
+    tiles_x, sep, tiles_y = args.tiles.lower().partition("x")
+    manifest = tiled_prepare(scene, args.tiled, int(tiles_x), int(tiles_y or tiles_x), args.overlap, args.fresh)
+    only = [int(i) for i in args.tile_index.split(",")] if args.tile_index else None
+    
+    results = []
+    for attempt in range(2):
+        left = [i for i in tiles_left(manifest) if only is None or i in only]
+        if not left:
+            break
+        if workers > 1:
+            blend_path = save_queue_copy()[0]
+            for proc, log in launch_tile_workers(blend_path, manifest, left, workers):
+                proc.wait()
+                results += read_worker_results(log)
+        else:
+            results.append({'tiles': render_tiles(scene, manifest, left)})
+    return tiled_finish(scene, manifest, results)
+
+
+# Applies the command line settings to a scene, no UI context needed.
+# Returns a dict describing what was done.
+def stage_scene(scene, view_layer, ratio=None, reso=None, light=None, camrig=None, camlight=False, quality=None):
+    result = {}
+    QSData = scene.QSProp
+    
+    # Keep the scene's Quick Stage settings in line, so the panels show what was applied.
+    if ratio is not None:
+        QSData.ScrRat = ratio
+    if reso is not None:
+        QSData.ScrReso = reso
+    if ratio is not None or reso is not None:
+        result['resolution'] = list(apply_render_size(scene.render, QSData.ScrRat, reso))
+    
+    if quality is not None:
+        QSData.Quality = quality
+        result['quality'] = apply_quality(scene, quality)
+    
+    if light is not None:
+        QSData.MakeLight = light
+        litbase, made = spawn_light_preset(light, scene.collection)
+        result['light'] = [ob.name for ob in made]
+        result['light_rig'] = register_rig(scene, "light:" + light, litbase, made).name
+    
+    if camrig is not None:
+        QSData.CamLitRig = camlight
+        rig = build_cam_rig(camrig.upper(), scene.collection, None, camlight, scene)
+        result['camrig'] = [ob.name for ob in rig.values()]
+        result['camrig_rig'] = register_rig(scene, "camrig:" + camrig, rig['focus'], rig.values()).name
+    
+    view_layer.update()
+    return result
+
+
+# Entry point for background runs. Returns the exit code.
+def run_cli(argv):
+    start = time.perf_counter()
+    result = {'file': bpy.data.filepath, 'ok': False}
+    
+    try:
+        args = cli_parser().parse_args(argv)
+    except SystemExit as err:
+        result['error'] = "bad arguments"
+        print(CLI_TAG + json.dumps(result), flush=True)
+        return err.code or 2
+    
+    try:
+        scene = bpy.context.scene
+        result.update(stage_scene(scene, bpy.context.view_layer, args.ratio, args.reso, args.light, args.camrig,
+                                  args.camlight, args.quality))
+        
+        if args.cull:
+            if scene.camera is None:
+                raise RuntimeError("--cull needs a scene camera")
+            result['culled'] = dict(zip(('objects', 'lights'), cull_scene(scene, scene.camera)))
+        
+        # Only write the file when something was staged into it.
+        staged = any((args.ratio, args.reso, args.light, args.camrig, args.quality, args.cull))
+        if staged and not args.no_save:
+            path = args.output or bpy.data.filepath
+            if not path:
+                raise RuntimeError("no file is open, use --output to choose where to save")
+            bpy.ops.wm.save_as_mainfile(filepath=path)
+            result['saved'] = path
+        
+        if args.render_queue:
+            workers = args.workers or scene.QSProp.RendWorkers
+            multiview = args.multiview or scene.QSProp.RendMultiview
+            scene.QSProp.RendMultiview = multiview
+            if args.worker is not None:
+                # We are one of the workers, render our share.
+                result['queue'] = render_queue_worker(scene, args.worker, workers, args.base_dir)
+            elif workers > 1:
+                # Hand the queue to a pool of workers and wait for all of them.
+                base_dir = os.path.dirname(bpy.data.filepath)
+                procs = launch_render_workers(bpy.data.filepath, workers, base_dir, multiview=multiview)
+                result['workers'] = []
+                for proc, log in procs:
+                    proc.wait()
+                    result['workers'].append({'log': log, 'exit_code': proc.returncode, 'results': read_worker_results(log)})
+                if any(w['exit_code'] != 0 for w in result['workers']):
+                    raise RuntimeError("some render workers failed, see their logs")
+            else:
+                result['queue'] = render_queue_worker(scene)
+        
+        if args.thumbnails:
+            # We are the thumbnail renderer of a Blender with the Light Setup panel open.
+            result['thumbnails'] = render_thumbnails(args.thumbnails)
+        
+        if args.render_tiles:
+            # We are a tile worker, render the tiles we were given.
+            result['tiles'] = render_tiles(scene, args.render_tiles, [int(i) for i in args.tile_index.split(",")])
+        elif args.tiled:
+            result['tiled'] = render_tiled_cli(scene, args, args.workers or scene.QSProp.RendWorkers)
+            if result['tiled']['missing']:
+                raise RuntimeError("tiles " + ", ".join(map(str, result['tiled']['missing'])) + " failed, run again to resume")
+        
+        result['ok'] = True
+    except Exception as err:
+        result['error'] = str(err)
+    
+    result['seconds'] = time.perf_counter() - start
+    print(CLI_TAG + json.dumps(result), flush=True)
+    return 0 if result['ok'] else 1
 
 
 # ======================================================
@@ -640,8 +5452,11 @@ def unregister():
 # When script is run, all it does is just install the classes.
 # Blender will take care of the execution of the classes, display
 # of panels, custom properties values, etc.
+# When run in the background with arguments after '--', it stages the open file instead (see run_cli).
 if __name__ == "__main__":
-    register()    
+    register()
+    if bpy.app.background and "--" in sys.argv:
+        sys.exit(run_cli(sys.argv[sys.argv.index("--") + 1:]))
 
 
 # ======================================================
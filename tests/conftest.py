@@ -0,0 +1,50 @@
+# bpy (and mathutils) only exist inside Blender. The helpers tested here are plain python and numpy,
+# so outside Blender the add-on is imported against a stand-in that takes anything: the classes,
+# props and handlers at module level only need to be made, never used.
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Anything:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return Anything()
+
+    def __call__(self, *args, **kwargs):
+        return Anything()
+
+    # Lets "class Foo(bpy.types.Operator)" work.
+    def __mro_entries__(self, bases):
+        return (object,)
+
+
+def stub_blender():
+    bpy = types.ModuleType("bpy")
+    bpy.__path__ = []
+    for name in ("types", "props", "data", "ops", "context", "path"):
+        setattr(bpy, name, Anything())
+    bpy.app = Anything()
+    # Handlers decorated as persistent stay plain functions.
+    bpy.app.handlers = types.SimpleNamespace(persistent = lambda func: func)
+
+    utils = types.ModuleType("bpy.utils")
+    utils.__path__ = []
+    utils.previews = types.ModuleType("bpy.utils.previews")
+    utils.register_class = utils.unregister_class = lambda cls: None
+    bpy.utils = utils
+
+    mathutils = types.ModuleType("mathutils")
+    mathutils.Euler = mathutils.Matrix = mathutils.Vector = Anything
+
+    sys.modules.update({"bpy": bpy, "bpy.utils": utils, "bpy.utils.previews": utils.previews, "mathutils": mathutils})
+
+
+try:
+    import bpy
+except ImportError:
+    stub_blender()
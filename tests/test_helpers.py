@@ -0,0 +1,330 @@
+# The helpers of the add-on that are plain python and numpy, and don't need Blender to run.
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import quickstage_final as qs
+
+
+# ======================================================
+# Camera arrays
+
+
+@pytest.mark.parametrize("layout", ['RING', 'GRID', 'SPHERE'])
+def test_array_positions_count(layout):
+    positions = qs.array_positions(10, layout, 5, height=1.5)
+    assert positions.shape == (10, 3)
+
+
+def test_array_positions_ring():
+    positions = qs.array_positions(4, 'RING', 5, height=1.5)
+    assert np.allclose(positions[0], (0, -5, 1.5))
+    assert np.allclose(np.hypot(positions[:, 0], positions[:, 1]), 5)
+    assert np.allclose(positions[:, 2], 1.5)
+
+
+def test_array_positions_grid_centered():
+    positions = qs.array_positions(9, 'GRID', 4, spacing=2)
+    assert np.allclose(positions.mean(axis=0), (0, -4, 0))
+    assert len(set(map(tuple, positions.round(6)))) == 9
+
+
+@pytest.mark.parametrize("hemisphere", [True, False])
+def test_array_positions_sphere(hemisphere):
+    positions = qs.array_positions(50, 'SPHERE', 3, hemisphere=hemisphere)
+    assert np.allclose(np.linalg.norm(positions, axis=1), 3)
+    if hemisphere:
+        assert (positions[:, 2] > 0).all()
+    else:
+        assert (positions[:, 2] > 0).any() and (positions[:, 2] < 0).any()
+
+
+# Turns -Z (where a camera looks) by XYZ euler angles.
+def look_direction(rot):
+    x, z = rot[0], rot[2]
+    d = np.array([0, 0, -1.0])
+    d = np.array([d[0], np.cos(x) * d[1] - np.sin(x) * d[2], np.sin(x) * d[1] + np.cos(x) * d[2]])
+    return np.array([np.cos(z) * d[0] - np.sin(z) * d[1], np.sin(z) * d[0] + np.cos(z) * d[1], d[2]])
+
+
+def test_aim_rotations_point_at_target():
+    positions = qs.array_positions(12, 'SPHERE', 4, hemisphere=False)
+    target = np.array([0.5, -0.25, 1.0])
+    for position, rot in zip(positions, qs.aim_rotations(positions, target)):
+        want = (target - position) / np.linalg.norm(target - position)
+        assert np.allclose(look_direction(rot), want)
+
+
+# ======================================================
+# Render sizes
+
+
+@pytest.mark.parametrize("ratio", list(qs.RatioTable))
+def test_ratio_width(ratio):
+    w, h, name = qs.RatioTable[ratio]
+    assert qs.ratio_width(1080, ratio) == round(1080 * w / h)
+    assert qs.ratio_width(h * 10, ratio) == w * 10
+
+
+# ======================================================
+# Keyframes
+
+
+def test_simplify_keys_line():
+    frames = np.arange(100, dtype=float)
+    keep = qs.simplify_keys(frames, frames * 0.5 + 2, 1e-6)
+    assert keep.tolist() == [True] + [False] * 98 + [True]
+
+
+def test_simplify_keys_within_tolerance():
+    frames = np.arange(200, dtype=float)
+    values = np.sin(frames / 15)
+    tol = 0.01
+    keep = qs.simplify_keys(frames, values, tol)
+    assert keep[0] and keep[-1] and keep.sum() < len(frames)
+    assert np.abs(np.interp(frames, frames[keep], values[keep]) - values).max() <= tol
+
+
+def test_simplify_keys_keeps_corners():
+    frames = np.arange(21, dtype=float)
+    values = np.where(frames < 10, 0.0, frames - 10)
+    keep = qs.simplify_keys(frames, values, 1e-6)
+    assert np.flatnonzero(keep).tolist() == [0, 10, 20]
+
+
+# ======================================================
+# Preset files
+
+
+def good_preset():
+    return {"format": qs.PresetFormat, "version": 1, "key": "rembrandt", "name": "Rembrandt", "tag": "Rmbr",
+            "base": {"location": [0, 0, 1.8]}, "focus": {"location": [0, 0, 3]},
+            "empties": [{"name": "Bounce Aim", "display": "SPHERE", "size": 0.5, "location": [2, -2, 1]}],
+            "lights": [{"name": "Key", "type": "AREA", "location": [-3, -3, 3], "energy": 400, "radius": 3,
+                        "track": True, "constraints": [{"type": "DAMPED_TRACK", "target": "Bounce Aim"}],
+                        "data": {"color": [1, 0.9, 0.8]}}]}
+
+
+def test_validate_preset_good():
+    assert qs.validate_preset(good_preset()) == []
+
+
+@pytest.mark.parametrize("change, message", [
+    (lambda p: p.update(format="other"), "'format'"),
+    (lambda p: p.update(version=99), "'version'"),
+    (lambda p: p.update(key="kfh"), "'key'"),
+    (lambda p: p.update(key="has space"), "'key'"),
+    (lambda p: p.pop("tag"), "'tag'"),
+    (lambda p: p.update(lights=[]), "'lights'"),
+    (lambda p: p["lights"][0].update(type="MESH"), "'type'"),
+    (lambda p: p["lights"][0].update(energy=-1), "'energy'"),
+    (lambda p: p["lights"][0].update(location=[0, 0]), "'location'"),
+    (lambda p: p["lights"][0].update(name="Bounce Aim"), "'name'"),
+    (lambda p: p["lights"][0].update(parent="Nowhere"), "'parent'"),
+    (lambda p: p["lights"][0]["constraints"][0].update(target="Nowhere"), "'target'"),
+    (lambda p: p["lights"][0].update(data={"_secret": 1}), "'data'"),
+    (lambda p: p["lights"][0].update(data={"spot_size": 0.5}), "can't set \"spot_size\" on a AREA light"),
+    (lambda p: p["lights"][0].update(data={"energyy": 10}), "can't set \"energyy\""),
+    (lambda p: p["lights"][0].update(data={"shape": "TRIANGLE"}), "'data' shape"),
+    (lambda p: p["lights"][0].update(data={"color": "red"}), "'data' color"),
+    (lambda p: p["lights"][0].update(data=[1, 2]), "'data'"),
+    (lambda p: p["lights"][0].update(type="SPOT", data={"spot_size": 0.5, "show_cone": True}), None),
+    (lambda p: p["empties"][0].update(parent="Key"), None),
+])
+def test_validate_preset_errors(change, message):
+    preset = good_preset()
+    change(preset)
+    errors = qs.validate_preset(preset)
+    if message is None:
+        assert errors == []
+    else:
+        assert any(message in error for error in errors), errors
+
+
+def test_validate_preset_parent_circle():
+    preset = good_preset()
+    preset["empties"][0]["parent"] = "Key"
+    preset["lights"][0]["parent"] = "Bounce Aim"
+    assert any("circle" in error for error in qs.validate_preset(preset))
+
+
+def test_validate_preset_not_a_dict():
+    assert qs.validate_preset([]) == ["not a JSON object"]
+
+
+# Whatever capture_preset writes must load again.
+def test_capture_light_data_validates():
+    for light_type, attrs in qs.CaptureLightData.items():
+        allowed = dict(qs.PresetLightCommon, **qs.PresetLightData[light_type])
+        assert set(attrs) <= set(allowed), light_type
+
+
+# ======================================================
+# Stage meshes
+
+
+StageTestParams = {'width': 1.2, 'depth': 1.0, 'height': 0.9, 'bevel': 0.03, 'steps': 3, 'cove': 2}
+CycTestParams = {'width': 12, 'depth': 10, 'height': 6, 'cove': 2}
+
+
+# Every edge of every face, as (from, to) vertex pairs, going round the faces.
+def directed_edges(faces):
+    edges = []
+    for index, smooth in faces:
+        assert len(index) == len(smooth)
+        for face in index:
+            edges += zip(face.tolist(), np.roll(face, -1).tolist())
+    return edges
+
+
+@pytest.mark.parametrize("kind", ['PED_ROUND', 'PED_SQUARE', 'RISER', 'RACK'])
+@pytest.mark.parametrize("lod", list(qs.StageLODs))
+def test_stage_mesh_closed(kind, lod):
+    verts, faces = qs.StageBuilders[kind](StageTestParams, qs.StageLODs[lod])
+    edges = Counter(directed_edges(faces))
+    # Closed and pointing the same way: every edge is used once in each direction.
+    assert all(count == 1 for count in edges.values())
+    assert all((b, a) in edges for a, b in edges)
+    assert max(max(a, b) for a, b in edges) < len(verts)
+
+
+@pytest.mark.parametrize("kind", ['PED_ROUND', 'PED_SQUARE', 'RISER', 'RACK'])
+def test_stage_mesh_faces_out(kind):
+    verts, faces = qs.StageBuilders[kind](StageTestParams, qs.StageLODs['PROXY'])
+    # Positive volume (divergence theorem over fan triangles) means the faces point outwards.
+    volume = 0.0
+    for index, smooth in faces:
+        for face in index:
+            p = verts[face]
+            for i in range(1, len(face) - 1):
+                volume += np.dot(p[0], np.cross(p[i], p[i + 1])) / 6
+    assert volume > 0
+
+
+def test_stage_mesh_cyc():
+    verts, faces = qs.build_cyc(CycTestParams, qs.StageLODs['RENDER'])
+    edges = Counter(directed_edges(faces))
+    assert all(count == 1 for count in edges.values())
+    assert verts[:, 0].min() == pytest.approx(-6) and verts[:, 0].max() == pytest.approx(6)
+    assert verts[:, 2].min() == pytest.approx(0) and verts[:, 2].max() == pytest.approx(6)
+    # The first floor face points up.
+    a, b, c = verts[faces[0][0][0][:3]]
+    assert np.cross(b - a, c - a)[2] > 0
+
+
+# ======================================================
+# Tiled rendering
+
+
+def test_tile_plan_cores_cover_the_image():
+    tiles = qs.tile_plan(1000, 600, 3, 2, 16)
+    assert len(tiles) == 6
+    covered = np.zeros((600, 1000), dtype=int)
+    for tile in tiles:
+        x0, x1, y0, y1 = tile['core']
+        covered[y0:y1, x0:x1] += 1
+    assert (covered == 1).all()
+
+
+def test_tile_plan_overlap_stays_inside():
+    for tile in qs.tile_plan(1000, 600, 3, 2, 16):
+        x0, x1, y0, y1 = tile['rect']
+        cx0, cx1, cy0, cy1 = tile['core']
+        assert 0 <= x0 <= cx0 and cx1 <= x1 <= 1000
+        assert 0 <= y0 <= cy0 and cy1 <= y1 <= 600
+
+
+@pytest.mark.parametrize("overlap", [0, 8, 32])
+def test_tile_weights_sum_to_one(overlap):
+    width, height = 640, 360
+    total = np.zeros((height, width))
+    for tile in qs.tile_plan(width, height, 4, 3, overlap):
+        x0, x1, y0, y1 = tile['rect']
+        total[y0:y1, x0:x1] += qs.tile_weights(tile, width, height, overlap, (y1 - y0, x1 - x0))
+    assert np.allclose(total, 1, atol=1e-6)
+
+
+# ======================================================
+# Culling
+
+
+# A camera at the origin looking down -Y, 90 degrees wide, as a clip matrix.
+def clip_matrix(near=0.1, far=100):
+    look = np.array([[-1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]], dtype=float)
+    project = np.array([[1, 0, 0, 0], [0, 1, 0, 0],
+                        [0, 0, -(far + near) / (far - near), -2 * far * near / (far - near)], [0, 0, -1, 0]])
+    return project @ look
+
+
+def test_boxes_in_view():
+    low = np.array([[-0.5, -5.5, -0.5],     # right in front
+                    [-0.5, 4.5, -0.5],      # behind the camera
+                    [20, -5.5, -0.5],       # far off to the side
+                    [-0.5, -200, -0.5],     # past the far clip
+                    [5.6, -5.5, -0.5]])     # just past the edge of the frame
+    high = low + 1
+    assert qs.boxes_in_view(low, high, clip_matrix()).tolist() == [True, False, False, False, False]
+    # The margin looks a bit past the edges.
+    assert qs.boxes_in_view(low, high, clip_matrix(), frame_margin=0.1).tolist() == [True, False, False, False, True]
+
+
+def test_boxes_in_view_straddling():
+    # A big box around the camera is in view, though none of its corners are.
+    low = np.array([[-50.0, -50.0, -50.0]])
+    assert qs.boxes_in_view(low, low + 100, clip_matrix()).tolist() == [True]
+
+
+# ======================================================
+# Camera moves
+
+
+@pytest.mark.parametrize("kind", [key for key, name, desc in qs.MotionEaseItems])
+def test_ease_ends(kind):
+    t = np.linspace(0, 1, 101)
+    eased = qs.ease(t, kind)
+    assert eased[0] == pytest.approx(0) and eased[-1] == pytest.approx(1)
+    assert (np.diff(eased) >= 0).all()
+
+
+MotionStart = {'pan': 0.3, 'tilt': 1.2, 'distance': 8.0}
+MotionSettings = {'ease': 'LINEAR', 'turns': 1.0, 'angle': 0.5, 'distance': 3.0, 'amount': 0.25,
+                  'seed': 7, 'fps': 24, 'shake': 0.02}
+
+
+def test_motion_orbit():
+    values = qs.motion_channels('ORBIT', 49, MotionStart, MotionSettings)[('rotation', "rotation_euler", 2)]
+    assert values[0] == pytest.approx(0.3) and values[-1] == pytest.approx(0.3 + 2 * np.pi)
+
+
+def test_motion_crane_lifts():
+    values = qs.motion_channels('CRANE', 25, MotionStart, MotionSettings)[('rotation', "rotation_euler", 0)]
+    assert values[0] == pytest.approx(1.2) and values[-1] == pytest.approx(0.7)
+
+
+def test_motion_dolly_and_push_in():
+    dolly = qs.motion_channels('DOLLY', 25, MotionStart, MotionSettings)[('zoom', "distance", 1)]
+    assert dolly[0] == pytest.approx(8) and dolly[-1] == pytest.approx(5)
+    push = qs.motion_channels('PUSH_IN', 25, MotionStart, MotionSettings)[('zoom', "distance", 1)]
+    assert push[-1] == pytest.approx(6)
+    # Never through the focus point.
+    close = qs.motion_channels('DOLLY', 25, MotionStart, dict(MotionSettings, distance=20))[('zoom', "distance", 1)]
+    assert close.min() > 0
+
+
+def test_motion_handheld_seeded():
+    first = qs.motion_channels('HANDHELD', 120, MotionStart, MotionSettings)
+    again = qs.motion_channels('HANDHELD', 120, MotionStart, MotionSettings)
+    other = qs.motion_channels('HANDHELD', 120, MotionStart, dict(MotionSettings, seed=8))
+    assert len(first) == 4
+    for channel, values in first.items():
+        assert values.shape == (120,)
+        assert np.array_equal(values, again[channel])
+        assert not np.array_equal(values, other[channel])
+
+
+def test_smooth_noise_range_and_smoothness():
+    noise = qs.smooth_noise(np.random.default_rng(1), 500, 12)
+    assert np.abs(noise).max() <= 1
+    # Neighbouring frames stay close, no jumps.
+    assert np.abs(np.diff(noise)).max() < 0.5